@@ -0,0 +1,99 @@
+
+#--------------Benchmark: response compression--------------#
+
+# CPU cost against bytes saved for the gzip and zstd levels the export and list
+# responses can use. Realistic payloads are generated from a schema (CSV export
+# rows and the JSON list format) and fed to the incremental encoders in the same
+# piece sizes the export writer produces.
+#
+#   python benchmarks/compression_cost.py
+#   python benchmarks/compression_cost.py --rows 200000 --schema-file college.json --output compression.json
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import content_encoding
+from datagen import RowGenerator
+from load import BENCH_SCHEMA
+from models import SchemaModel
+
+LEVELS = {"gzip": [1, 6, 9], "zstd": [1, 3, 9]}
+
+
+def payloads(schema: SchemaModel, rows: int, batch_rows: int) -> Dict[str, List[bytes]]:
+    generator = RowGenerator(schema, seed=1)
+    columns = generator.columns
+    csv_pieces: List[bytes] = []
+    json_pieces: List[bytes] = []
+    for batch in generator.batches(rows, batch_rows):
+        documents = [row for row, _ in batch]
+        csv_pieces.append(pd.DataFrame(documents, columns=columns).to_csv(index=False, header=not csv_pieces).encode())
+        json_pieces.append(("," if json_pieces else "[").encode() + b",".join(content_encoding.dumps(document) for document in documents))
+    json_pieces.append(b"]")
+    return {"csv": csv_pieces, "json": json_pieces}
+
+
+def measure(pieces: List[bytes], encoding: str, level: int, repeat: int) -> Dict[str, Any]:
+    size = sum(len(piece) for piece in pieces)
+    best = None
+    for _ in range(repeat):
+        compressor = content_encoding.encoder(encoding, gzip_level=level, zstd_level=level)
+        start = time.process_time()
+        out = sum(len(compressor.compress(piece)) for piece in pieces) + len(compressor.flush())
+        cpu = time.process_time() - start
+        best = cpu if best is None else min(best, cpu)
+    saved = size - out
+    return {
+        "output_mb": round(out / 1e6, 3),
+        "ratio": round(size / out, 2) if out else None,
+        "saved_pct": round(100 * saved / size, 1) if size else 0.0,
+        "cpu_s": round(best, 4),
+        "input_mb_per_cpu_s": round(size / 1e6 / best, 1) if best else None,
+        "cpu_ms_per_mb_saved": round(best * 1000 / (saved / 1e6), 2) if saved > 0 else None,
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    if args.schema_file:
+        with open(args.schema_file) as file:
+            schema = SchemaModel(**json.load(file))
+    else:
+        schema = SchemaModel(**BENCH_SCHEMA)
+    report: Dict[str, Any] = {
+        "config": {"schema": schema.schema_name, "rows": args.rows, "batch_rows": args.batch_rows, "zstd": content_encoding.zstandard is not None},
+        "results": {},
+    }
+    for fmt, pieces in payloads(schema, args.rows, args.batch_rows).items():
+        result: Dict[str, Any] = {"input_mb": round(sum(len(piece) for piece in pieces) / 1e6, 3)}
+        for encoding in content_encoding.ENCODINGS:
+            for level in LEVELS[encoding]:
+                result[f"{encoding}-{level}"] = measure(pieces, encoding, level, args.repeat)
+        report["results"][fmt] = result
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compression CPU cost against bytes saved")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--batch-rows", type=int, default=5000, help="Rows per piece, as the export writer batches them")
+    parser.add_argument("--schema-file", default=None, help="Schema JSON to generate rows for (defaults to the load benchmark schema)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per setting, the fastest is reported")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text)
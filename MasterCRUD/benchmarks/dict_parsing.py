@@ -0,0 +1,99 @@
+
+#--------------Benchmark: dict column parsing--------------#
+
+# Parsing throughput for dict-typed import columns on a wide schema shaped like
+# college_details (several dict fields per row). Compares the old per-cell
+# json.loads(cell.replace("'", '"')) with import_worker.parse_dict_columns, with
+# and without repeated cell values, in both JSON and Python notation.
+#
+#   python benchmarks/dict_parsing.py
+#   python benchmarks/dict_parsing.py --rows 200000 --dict-fields 8 --distinct 500
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import import_worker
+from import_worker import parse_dict_columns
+from models import FieldModel
+
+DICT_KEYS = {"city": "str", "district": "str", "pincode": "str", "phone": "str"}
+WORDS = ["chennai", "madurai", "coimbatore", "trichy", "salem", "erode", "vellore", "tirunelveli"]
+
+
+def make_frame(rows: int, dict_fields: int, distinct: int, notation: str, seed: int = 1) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    pool_size = distinct or rows
+    columns = {}
+    for index in range(dict_fields):
+        pool = []
+        for _ in range(min(pool_size, rows)):
+            value = {key: f"{rnd.choice(WORDS)} {rnd.randint(0, 10 ** 6)}" for key in DICT_KEYS}
+            pool.append(json.dumps(value) if notation == "json" else repr(value))
+        columns[f"details_{index}"] = [pool[rnd.randrange(len(pool))] for _ in range(rows)] if distinct else pool
+    return pd.DataFrame(columns)
+
+
+def legacy_parse(df: pd.DataFrame, fields: List[FieldModel]) -> int:
+    # The previous row-by-row path
+    parsed = 0
+    for record in df.to_dict("records"):
+        for field in fields:
+            json.loads(record[field.col_name].replace("'", '"'))
+            parsed += 1
+    return parsed
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def run(args) -> Dict[str, Any]:
+    fields = [FieldModel(col_name=f"details_{index}", type="dict", unique=False, dict_keys=DICT_KEYS) for index in range(args.dict_fields)]
+    report: Dict[str, Any] = {
+        "config": {"rows": args.rows, "dict_fields": args.dict_fields, "orjson": import_worker.orjson is not None},
+        "results": {},
+    }
+    cells = args.rows * args.dict_fields
+    for notation in ("json", "python"):
+        for distinct in (0, args.distinct):
+            df = make_frame(args.rows, args.dict_fields, distinct, notation)
+            result: Dict[str, Any] = {}
+            # The old path can't read Python notation with apostrophes, it's timed on JSON only
+            if notation == "json":
+                elapsed = timed(legacy_parse, df, fields)
+                result["legacy_cells_per_s"] = round(cells / elapsed, 1)
+            elapsed = timed(parse_dict_columns, df, fields, True)
+            result["cells_per_s"] = round(cells / elapsed, 1)
+            result["rows_per_s"] = round(args.rows / elapsed, 1)
+            if "legacy_cells_per_s" in result:
+                result["speedup"] = round(result["cells_per_s"] / result["legacy_cells_per_s"], 2)
+            report["results"][f"{notation}/{'distinct' if not distinct else f'{distinct}_repeated'}"] = result
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dict column parsing throughput")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dict-fields", type=int, default=6)
+    parser.add_argument("--distinct", type=int, default=1000, help="Distinct cell values per column in the repeated runs")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text)
@@ -0,0 +1,158 @@
+
+#--------------Benchmark: request latency during a large import--------------#
+
+# Measures list and get-by-id latency while the app is idle, then again while a
+# large CSV import is running, to check that parsing and validation in the worker
+# pool keep the event loop responsive. With --max-ratio the script exits non-zero
+# when the p95 latency during the import exceeds that multiple of the idle p95.
+#
+#   python benchmarks/import_concurrency.py --mongo-uri mongodb://localhost:27017/ --import-rows 200000
+#   python benchmarks/import_concurrency.py --in-memory --import-rows 50000 --max-ratio 5
+#
+# The in-memory stand-in executes writes on the event loop thread, so numbers from a
+# real mongod are the ones to compare.
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import RowGenerator, csv_bytes
+from load import BENCH_SCHEMA, _patch_mongomock_bulk, percentile, seed
+from models import SchemaModel
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+# Issue list and get-by-id requests back to back, `interval` seconds apart, until `stop` is set
+async def probe(client, schema_name: str, item_id: str, interval: float, stop: asyncio.Event) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = {"list": [], "get": []}
+    while not stop.is_set():
+        for name, request in (
+            ("list", lambda: client.get(f"/{schema_name}/", params={"page": 1, "page_size": 20})),
+            ("get", lambda: client.get(f"/{schema_name}/{item_id}")),
+        ):
+            start = time.perf_counter()
+            response = await request()
+            response.raise_for_status()
+            latencies[name].append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(args) -> Dict[str, Any]:
+    # Settings are read at import time, so point the app at the benchmark database first
+    os.environ["MONGO_DATABASE"] = args.database
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    if args.workers:
+        os.environ["IMPORT_WORKERS"] = str(args.workers)
+    if args.in_memory:
+        os.environ["DB_VALIDATION_ACTION"] = "off"
+
+    import httpx
+    import database
+    from config import load_settings
+
+    if args.in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+        _patch_mongomock_bulk()
+        memory_client = AsyncMongoMockClient()
+        database.client_factory = lambda *a, **kw: memory_client
+
+    settings = load_settings()
+    await seed(database, settings, args.seed_rows)
+
+    app = importlib.import_module("main").app
+    schema_name = BENCH_SCHEMA["schema_name"]
+    payload = csv_bytes(RowGenerator(SchemaModel(**BENCH_SCHEMA), seed=2, prefix=f"big-{int(time.time())}-"), args.import_rows)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            item_id = (await client.get(f"/{schema_name}/", params={"page": 1, "page_size": 1})).json()[0]["_id"]
+
+            # Idle baseline
+            stop = asyncio.Event()
+            idle_task = asyncio.create_task(probe(client, schema_name, item_id, args.interval, stop))
+            await asyncio.sleep(args.baseline_seconds)
+            stop.set()
+            idle = await idle_task
+
+            # Same probes while the import runs
+            stop = asyncio.Event()
+            busy_task = asyncio.create_task(probe(client, schema_name, item_id, args.interval, stop))
+            start = time.perf_counter()
+            response = await client.post(f"/{schema_name}/import", files={"file": ("big.csv", payload, "text/csv")})
+            import_seconds = time.perf_counter() - start
+            stop.set()
+            busy = await busy_task
+            response.raise_for_status()
+            outcome = response.json()
+
+    report: Dict[str, Any] = {
+        "config": {
+            "backend": "in-memory" if args.in_memory else args.mongo_uri or settings.mongo_uri,
+            "import_rows": args.import_rows,
+            "import_workers": settings.import_workers,
+            "import_chunk_rows": settings.import_chunk_rows,
+            "interval_s": args.interval,
+        },
+        "import": {
+            "elapsed_s": round(import_seconds, 3),
+            "rows_per_s": round(args.import_rows / import_seconds, 1) if import_seconds else 0.0,
+            "inserted": outcome.get("inserted"),
+            "invalid_count": outcome.get("invalid_count"),
+        },
+        "idle": {name: latency_summary(values) for name, values in idle.items()},
+        "during_import": {name: latency_summary(values) for name, values in busy.items()},
+    }
+    report["p95_ratio"] = {
+        name: round(report["during_import"][name]["p95_ms"] / report["idle"][name]["p95_ms"], 2) if report["idle"][name]["p95_ms"] else None
+        for name in ("list", "get")
+    }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Request latency while a large import runs")
+    parser.add_argument("--mongo-uri", default=None, help="MongoDB URI (defaults to MONGO_URI / localhost)")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of a real mongod")
+    parser.add_argument("--database", default="masterlist_bench")
+    parser.add_argument("--seed-rows", type=int, default=1000)
+    parser.add_argument("--import-rows", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=0, help="Import worker processes (defaults to IMPORT_WORKERS)")
+    parser.add_argument("--interval", type=float, default=0.02, help="Pause between probe rounds, seconds")
+    parser.add_argument("--baseline-seconds", type=float, default=2.0)
+    parser.add_argument("--max-ratio", type=float, default=0.0, help="Fail when p95 during the import exceeds this multiple of idle p95")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="masterlist-bench-"))
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as out:
+            out.write(text)
+    if args.max_ratio and any(ratio is not None and ratio > args.max_ratio for ratio in report["p95_ratio"].values()):
+        sys.exit(1)
@@ -0,0 +1,234 @@
+
+#--------------Benchmark: MasterCRUD load and throughput--------------#
+
+# Starts the app in-process (lifespan included) against a local mongod or an
+# in-memory Motor stand-in, seeds a synthetic schema and drives the add, bulk,
+# import, filter, list and export workloads concurrently through httpx.
+# Results are printed (and optionally written) as JSON so runs can be diffed.
+#
+#   python benchmarks/load.py --mongo-uri mongodb://localhost:27017/ --output before.json
+#   python benchmarks/load.py --in-memory --requests 200
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import RowGenerator, csv_bytes, write_mongo
+from models import SchemaModel
+
+BENCH_SCHEMA = {
+    "schema_name": "bench_items",
+    "fields": [
+        {"col_name": "code", "type": "str", "unique": True},
+        {"col_name": "name", "type": "str", "unique": False},
+        {"col_name": "status", "type": "str", "unique": False, "allowed_values": ["active", "inactive", "pending"]},
+        {"col_name": "qty", "type": "int", "unique": False},
+        {"col_name": "price", "type": "float", "unique": False},
+        {"col_name": "details", "type": "dict", "unique": False, "dict_keys": {"city": "str", "pincode": "str"}},
+    ],
+}
+
+STATUSES = ["active", "inactive", "pending"]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+# Run `total` requests of one workload with at most `concurrency` in flight
+async def run_workload(request_fn: Callable[[int], Awaitable[Any]], total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await request_fn(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+# mongomock's bulk builder predates the `sort` argument newer pymongo passes for
+# UpdateOne/ReplaceOne; drop it so bulk_write works against the stand-in
+def _patch_mongomock_bulk() -> None:
+    from mongomock.collection import BulkOperationBuilder
+
+    for name in ("add_update", "add_replace"):
+        original = getattr(BulkOperationBuilder, name)
+
+        def patched(self, *args, _original=original, sort=None, **kwargs):
+            return _original(self, *args, **kwargs)
+
+        setattr(BulkOperationBuilder, name, patched)
+
+
+async def seed(database, settings, rows: int) -> None:
+    database.connect(settings)
+    db = database.db
+    await db.drop_collection(BENCH_SCHEMA["schema_name"])
+    await db["masterlist"].delete_many({"schema_name": BENCH_SCHEMA["schema_name"]})
+    await db["masterlist"].insert_one({**BENCH_SCHEMA, "created_at": datetime.now().strftime("%d/%m/%Y")})
+    generator = RowGenerator(SchemaModel(**BENCH_SCHEMA), seed=1, prefix="seed-")
+    await write_mongo(generator, rows, db[BENCH_SCHEMA["schema_name"]], modified_date=datetime.now().strftime("%d/%m/%Y"))
+    database.close()
+
+
+async def run(args) -> Dict[str, Any]:
+    # Settings are read at import time, so point the app at the benchmark database first
+    os.environ["MONGO_DATABASE"] = args.database
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    if args.in_memory:
+        # The stand-in has no collMod, so run without $jsonSchema validators
+        os.environ["DB_VALIDATION_ACTION"] = "off"
+
+    import httpx
+    import database
+    from config import load_settings
+
+    if args.in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+        _patch_mongomock_bulk()
+        # One shared stand-in so the seeded data survives the lifespan reconnect
+        memory_client = AsyncMongoMockClient()
+        database.client_factory = lambda *a, **kw: memory_client
+
+    settings = load_settings()
+    await seed(database, settings, args.seed_rows)
+
+    app_module = importlib.import_module("main")
+    app = app_module.app
+    schema_name = BENCH_SCHEMA["schema_name"]
+    today = datetime.now().strftime("%d/%m/%Y")
+    run_id = int(time.time())
+    schema = SchemaModel(**BENCH_SCHEMA)
+    add_rows = RowGenerator(schema, prefix=f"add-{run_id}-")
+    bulk_rows = RowGenerator(schema, prefix=f"bulk-{run_id}-", invalid_fraction=args.invalid_fraction)
+    small_import = csv_bytes(RowGenerator(schema, prefix=f"imp-{run_id}-", invalid_fraction=args.invalid_fraction), args.import_rows)
+
+    results: Dict[str, Any] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def add(i):
+                return await client.post(f"/{schema_name}/", json=add_rows.row(i))
+
+            async def bulk(i):
+                payload = csv_bytes(bulk_rows, args.bulk_rows, start=i * args.bulk_rows)
+                return await client.post(f"/{schema_name}/import", files={"file": ("bulk.csv", payload, "text/csv")})
+
+            async def import_small(i):
+                # Re-importing the same file exercises the unique-value rejection path
+                return await client.post(f"/{schema_name}/import", files={"file": ("small.csv", small_import, "text/csv")})
+
+            async def filter_items(i):
+                return await client.post(f"/{schema_name}/filters/", json={"filter": f"status:{STATUSES[i % 3]}"})
+
+            async def list_items(i):
+                return await client.get(f"/{schema_name}/", params={"page": i % 20 + 1, "page_size": 50})
+
+            async def export(i):
+                return await client.post(f"/export/{schema_name}/", params={"date": today})
+
+            workloads = {
+                "add": (add, args.requests),
+                "bulk": (bulk, max(1, args.requests // 50)),
+                "import": (import_small, max(1, args.requests // 10)),
+                "filter": (filter_items, args.requests),
+                "list": (list_items, args.requests),
+                "export": (export, max(1, args.requests // 20)),
+            }
+            selected = {name: spec for name, spec in workloads.items() if name in args.workloads}
+
+            start = time.perf_counter()
+            summaries = await asyncio.gather(*(
+                run_workload(fn, total, args.concurrency) for fn, total in selected.values()
+            ))
+            elapsed = time.perf_counter() - start
+            results = dict(zip(selected.keys(), summaries))
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "config": {
+            "backend": "in-memory" if args.in_memory else args.mongo_uri or settings.mongo_uri,
+            "seed_rows": args.seed_rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "bulk_rows": args.bulk_rows,
+            "import_rows": args.import_rows,
+            "invalid_fraction": args.invalid_fraction,
+        },
+        "workloads": results,
+        "total": {
+            "requests": sum(r["requests"] for r in results.values()),
+            "errors": sum(r["errors"] for r in results.values()),
+            "elapsed_s": round(elapsed, 4),
+        },
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the MasterCRUD API")
+    parser.add_argument("--mongo-uri", default=None, help="MongoDB URI (defaults to MONGO_URI / localhost)")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of a real mongod")
+    parser.add_argument("--database", default="masterlist_bench")
+    parser.add_argument("--seed-rows", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=500, help="Requests for the add/filter/list workloads")
+    parser.add_argument("--concurrency", type=int, default=16, help="In-flight requests per workload")
+    parser.add_argument("--bulk-rows", type=int, default=2000)
+    parser.add_argument("--import-rows", type=int, default=100)
+    parser.add_argument("--invalid-fraction", type=float, default=0.0, help="Fraction of invalid rows in imported files")
+    parser.add_argument("--workloads", nargs="+", default=["add", "bulk", "import", "filter", "list", "export"])
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    # Exports write their CSV next to the working directory, keep that out of the repo
+    os.chdir(tempfile.mkdtemp(prefix="masterlist-bench-"))
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as out:
+            out.write(text)
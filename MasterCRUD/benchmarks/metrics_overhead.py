@@ -0,0 +1,64 @@
+
+#--------------Benchmark: request instrumentation overhead--------------#
+
+# Measures the per-request cost of MetricsMiddleware by driving a trivial ASGI app
+# with and without the middleware. Run from the MasterCRUD directory:
+#   python benchmarks/metrics_overhead.py
+import asyncio
+import json
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+class FakeRoute:
+    path = "/{schema_name}/stats"
+    tags = ["college_details"]
+
+
+async def endpoint(scope, receive, send):
+    # Mimic the router filling in the matched route
+    scope["route"] = FakeRoute
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def drive(app, iterations: int) -> float:
+    start = perf_counter()
+    for _ in range(iterations):
+        await app({"type": "http", "method": "GET", "path": "/college_details/stats"}, receive, send)
+    return perf_counter() - start
+
+
+async def main(iterations: int = 200000):
+    bare = await drive(endpoint, iterations)
+    instrumented = await drive(metrics.MetricsMiddleware(endpoint), iterations)
+
+    start = perf_counter()
+    for _ in range(iterations):
+        metrics.observe_request("GET", "/{schema_name}/stats", "college_details", 200, 0.0123)
+    observe_only = perf_counter() - start
+
+    print(json.dumps({
+        "iterations": iterations,
+        "bare_us_per_request": bare / iterations * 1e6,
+        "instrumented_us_per_request": instrumented / iterations * 1e6,
+        "middleware_overhead_us": (instrumented - bare) / iterations * 1e6,
+        "observe_request_us": observe_only / iterations * 1e6,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
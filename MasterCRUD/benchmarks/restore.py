@@ -0,0 +1,129 @@
+
+#--------------Benchmark: snapshot and restore--------------#
+
+# Moves a seeded schema through GET /admin/snapshot and POST /admin/restore (under a
+# new name) for each snapshot compression, and through the CSV export and import it
+# replaces, reporting rows/s and bytes for each leg. Needs a real mongod: the
+# in-memory stand-in can't read or write raw BSON.
+#
+#   python benchmarks/restore.py --mongo-uri mongodb://localhost:27017/ --rows 200000
+#   python benchmarks/restore.py --rows 50000 --output restore.json
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load import BENCH_SCHEMA, seed
+
+
+def rate(rows: int, seconds: float) -> float:
+    return round(rows / seconds, 1) if seconds else 0.0
+
+
+async def run(args) -> Dict[str, Any]:
+    # Settings are read at import time, so point the app at the benchmark database first
+    os.environ["MONGO_DATABASE"] = args.database
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+    import httpx
+    import database
+    from config import load_settings
+    from content_encoding import ENCODINGS
+
+    settings = load_settings()
+    await seed(database, settings, args.rows)
+
+    app = importlib.import_module("main").app
+    schema_name = BENCH_SCHEMA["schema_name"]
+    report: Dict[str, Any] = {
+        "config": {"backend": args.mongo_uri or settings.mongo_uri, "rows": args.rows, "restore_batch_size": settings.restore_batch_size},
+        "snapshot": {},
+        "csv": {},
+    }
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for compression in ("none", *ENCODINGS):
+                start = time.perf_counter()
+                response = await client.get(f"/admin/snapshot/{schema_name}", params={"compression": compression})
+                snapshot_seconds = time.perf_counter() - start
+                response.raise_for_status()
+                start = time.perf_counter()
+                restored = await client.post(
+                    "/admin/restore",
+                    params={"schema_name": f"{schema_name}_restored", "replace": "true"},
+                    files={"file": ("snapshot.bson", response.content, "application/octet-stream")},
+                )
+                restore_seconds = time.perf_counter() - start
+                restored.raise_for_status()
+                report["snapshot"][compression] = {
+                    "bytes": len(response.content),
+                    "snapshot_s": round(snapshot_seconds, 3),
+                    "snapshot_rows_per_s": rate(args.rows, snapshot_seconds),
+                    "restore_s": round(restore_seconds, 3),
+                    "restore_rows_per_s": rate(restored.json()["documents"], restore_seconds),
+                }
+
+            # The CSV round trip a snapshot replaces, into a fresh copy of the schema
+            copy_name = f"{schema_name}_csv"
+            await client.post("/admin/restore", params={"schema_name": copy_name, "replace": "true"}, files={
+                "file": ("empty.bson", await empty_snapshot(client, schema_name), "application/octet-stream"),
+            })
+            start = time.perf_counter()
+            response = await client.get(f"/export/{schema_name}/", headers={"accept-encoding": "identity"})
+            export_seconds = time.perf_counter() - start
+            response.raise_for_status()
+            start = time.perf_counter()
+            imported = await client.post(f"/{copy_name}/import", files={"file": ("export.csv", response.content, "text/csv")})
+            import_seconds = time.perf_counter() - start
+            imported.raise_for_status()
+            report["csv"] = {
+                "bytes": len(response.content),
+                "export_s": round(export_seconds, 3),
+                "export_rows_per_s": rate(args.rows, export_seconds),
+                "import_s": round(import_seconds, 3),
+                "import_rows_per_s": rate(imported.json().get("inserted", 0), import_seconds),
+            }
+
+    best = max(result["restore_rows_per_s"] for result in report["snapshot"].values())
+    report["restore_speedup_vs_csv_import"] = round(best / report["csv"]["import_rows_per_s"], 2) if report["csv"]["import_rows_per_s"] else None
+    return report
+
+
+# A snapshot with the schema definition only, to create an empty copy of the schema
+async def empty_snapshot(client, schema_name: str) -> bytes:
+    from bson import BSON
+    from snapshots import snapshot_header
+
+    definition = (await client.get(f"/getfields/{schema_name}/")).json()
+    return BSON.encode(snapshot_header(definition, [], 0))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Schema snapshot and restore throughput")
+    parser.add_argument("--mongo-uri", default=None, help="MongoDB URI (defaults to MONGO_URI / localhost)")
+    parser.add_argument("--database", default="masterlist_bench")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="masterlist-bench-"))
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as out:
+            out.write(text)
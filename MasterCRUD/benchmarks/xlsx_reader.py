@@ -0,0 +1,114 @@
+
+#--------------Benchmark: XLSX readers--------------#
+
+# Compares the whole-sheet pd.read_excel path with the streaming read-only reader
+# the importer uses (import_worker.read_xlsx_chunks) on generated workbooks. Each
+# read runs in its own process so the peak RSS reported is that reader's alone.
+#
+#   python benchmarks/xlsx_reader.py
+#   python benchmarks/xlsx_reader.py --rows 10000 100000 --output xlsx.json
+#
+# Workbooks are generated once per size and reused from --workdir on later runs.
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+READERS = ("read_excel", "streaming")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# Runs in the child process: read the workbook the way the importer would and
+# touch every row, so both readers do the same amount of work
+def measure(reader: str, path: str, chunk_rows: int) -> Dict[str, Any]:
+    import pandas as pd
+    from import_worker import read_xlsx_chunks
+
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    rows = 0
+    if reader == "read_excel":
+        workbook = pd.read_excel(path)
+        for offset in range(0, len(workbook), chunk_rows):
+            rows += len(workbook.iloc[offset:offset + chunk_rows])
+    else:
+        for frame in read_xlsx_chunks(path, chunk_rows):
+            rows += len(frame)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+    }
+
+
+def workbook_path(workdir: str, rows: int) -> str:
+    from datagen import RowGenerator, write_xlsx
+    from load import BENCH_SCHEMA
+    from models import SchemaModel
+
+    path = os.path.join(workdir, f"bench_{rows}.xlsx")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        write_xlsx(RowGenerator(SchemaModel(**BENCH_SCHEMA), seed=1), rows, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        print(f"generated {path} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return path
+
+
+def run(args) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"config": {"chunk_rows": args.chunk_rows}, "results": {}}
+    for rows in args.rows:
+        path = workbook_path(args.workdir, rows)
+        result: Dict[str, Any] = {"file_mb": round(os.path.getsize(path) / (1024 * 1024), 2)}
+        for reader in args.readers:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--measure", reader, path, "--chunk-rows", str(args.chunk_rows)],
+                capture_output=True, text=True, check=True,
+            )
+            result[reader] = json.loads(child.stdout)
+        if "read_excel" in result and "streaming" in result:
+            result["speedup"] = round(result["streaming"]["rows_per_s"] / result["read_excel"]["rows_per_s"], 2) if result["read_excel"]["rows_per_s"] else None
+            result["peak_rss_ratio"] = round(result["streaming"]["peak_rss_mb"] / result["read_excel"]["peak_rss_mb"], 2)
+        report["results"][str(rows)] = result
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="XLSX reader throughput and peak memory")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--readers", nargs="+", choices=READERS, default=list(READERS))
+    parser.add_argument("--chunk-rows", type=int, default=5000, help="Rows per chunk, as IMPORT_CHUNK_ROWS")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "masterlist-xlsx-bench"))
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    parser.add_argument("--measure", nargs=2, metavar=("READER", "PATH"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.chunk_rows)))
+        sys.exit(0)
+    os.makedirs(args.workdir, exist_ok=True)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text)
@@ -0,0 +1,58 @@
+
+#--------------Short-lived result cache--------------#
+
+# Keeps computed results (e.g. schema statistics) for a few seconds. Concurrent
+# misses for the same key share one computation instead of all hitting MongoDB.
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if len(self._values) >= self.maxsize and key not in self._values:
+            # Drop the entry closest to expiry to make room
+            oldest = min(self._values, key=lambda k: self._values[k][0])
+            del self._values[oldest]
+        self._values[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._values.pop(key, None)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
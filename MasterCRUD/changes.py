@@ -0,0 +1,168 @@
+
+#--------------Incremental change export--------------#
+
+# Every write stamps the document with _modified_at and every delete leaves a
+# tombstone, both indexed on (timestamp, _id). A mirror asks for the changes after
+# its watermark and gets back the next one, so a sync reads only what changed.
+# The watermark is an opaque token for the last (timestamp, _id) handed out.
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+MODIFIED_AT_FIELD = "_modified_at"
+TOMBSTONES = "masterlist_tombstones"
+
+# Sorts after every ObjectId, for a watermark that has consumed its whole millisecond
+_LAST_ID = ObjectId("f" * 24)
+
+
+class WatermarkError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def stamp() -> datetime:
+    # BSON dates keep milliseconds, truncate so the stored value equals the one compared
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+# A stamp strictly later than `previous`, for writes that must sort after it even
+# within the same millisecond
+def stamp_after(previous: datetime) -> datetime:
+    now = stamp()
+    return now if now > previous else previous + timedelta(milliseconds=1)
+
+
+async def ensure_change_indexes(lcollection) -> None:
+    await lcollection.create_index([(MODIFIED_AT_FIELD, ASCENDING), ("_id", ASCENDING)], name="modified_at")
+
+
+async def ensure_tombstone_indexes(tombstones_collection, tombstone_ttl: int) -> None:
+    await tombstones_collection.create_index(
+        [("schema", ASCENDING), (MODIFIED_AT_FIELD, ASCENDING), ("_id", ASCENDING)], name="schema_modified_at"
+    )
+    # Tombstones expire, a watermark older than that can't be answered (see read_changes)
+    try:
+        await tombstones_collection.create_index([(MODIFIED_AT_FIELD, ASCENDING)], name="expire", expireAfterSeconds=tombstone_ttl)
+    except OperationFailure as exc:
+        # 85: IndexOptionsConflict, the retention setting changed since the index was built
+        if exc.code != 85:
+            raise
+        await tombstones_collection.database.command(
+            "collMod", tombstones_collection.name, index={"name": "expire", "expireAfterSeconds": tombstone_ttl}
+        )
+
+
+# Stamp documents written before change tracking, so a first full sync includes them
+async def backfill_modified_at(lcollection) -> None:
+    await lcollection.update_many({MODIFIED_AT_FIELD: {"$exists": False}}, {"$set": {MODIFIED_AT_FIELD: stamp()}})
+
+
+# Tombstones for `ids`, stamped now or at `modified_at`; `extra` fields are stored
+# alongside, e.g. to find the tombstones of one bulk operation again
+async def record_deletes(tombstones_collection, schema_name: str, ids: List[Any], modified_at: Optional[datetime] = None, extra: Optional[Dict[str, Any]] = None) -> None:
+    if ids:
+        modified_at = modified_at or stamp()
+        await tombstones_collection.insert_many([
+            {"schema": schema_name, "doc_id": doc_id, MODIFIED_AT_FIELD: modified_at, **(extra or {})} for doc_id in ids
+        ])
+
+
+# Identifies the current contents of a schema's collection, for caches of derived
+# results: it moves with every stamped write and delete. Returns the version and the
+# time of the latest change (None when nothing is stamped yet).
+async def data_version(lcollection, tombstones_collection, schema_name: str) -> Tuple[str, Optional[datetime]]:
+    written = await lcollection.find({MODIFIED_AT_FIELD: {"$exists": True}}, {MODIFIED_AT_FIELD: 1}).sort(MODIFIED_AT_FIELD, DESCENDING).limit(1).to_list(length=1)
+    deleted = await tombstones_collection.find({"schema": schema_name}, {MODIFIED_AT_FIELD: 1}).sort(MODIFIED_AT_FIELD, DESCENDING).limit(1).to_list(length=1)
+    # The count also catches deletes made outside the API, which leave no tombstone
+    count = await lcollection.estimated_document_count()
+    latest = [entries[0][MODIFIED_AT_FIELD] if entries else None for entries in (written, deleted)]
+    version = ":".join([str(count), *(value.isoformat() if value else "" for value in latest)])
+    return version, max((value for value in latest if value), default=None)
+
+
+#--------------Watermarks--------------#
+
+def encode_watermark(modified_at: datetime, last_id: ObjectId) -> str:
+    millis = int(modified_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    raw = json.dumps({"t": millis, "id": str(last_id)}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_watermark(token: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        modified_at = datetime.fromtimestamp(raw["t"] / 1000, timezone.utc).replace(tzinfo=None)
+        return modified_at, ObjectId(raw["id"])
+    except (binascii.Error, ValueError, TypeError, KeyError, OverflowError, UnicodeDecodeError):
+        raise WatermarkError(400, "Invalid watermark")
+
+
+def _after(position: Optional[Tuple[datetime, ObjectId]], upper: datetime) -> Dict[str, Any]:
+    if position is None:
+        return {MODIFIED_AT_FIELD: {"$lte": upper}}
+    modified_at, last_id = position
+    return {
+        MODIFIED_AT_FIELD: {"$lte": upper},
+        "$or": [
+            {MODIFIED_AT_FIELD: {"$gt": modified_at}},
+            {MODIFIED_AT_FIELD: modified_at, "_id": {"$gt": last_id}},
+        ],
+    }
+
+
+# Changes after the watermark `since` (everything when None), oldest first, at most
+# `limit` of them. Returns (changes, next watermark, whether more are waiting).
+#
+# Writes are stamped before they commit, so changes younger than `settle_ms` are
+# held back for the next call: a slow write can't land behind a watermark that was
+# already handed out. Deletes older than `tombstone_ttl` are forgotten, so older
+# watermarks get a 410 and the mirror has to start over with a full sync.
+async def read_changes(
+    lcollection,
+    tombstones_collection,
+    schema_name: str,
+    since: Optional[str],
+    limit: int,
+    settle_ms: int,
+    tombstone_ttl: int,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], str, bool]:
+    position = decode_watermark(since) if since else None
+    now = stamp()
+    if position is not None and position[0] < now - timedelta(seconds=tombstone_ttl):
+        raise WatermarkError(410, "Watermark is older than the retained deletes, run a full sync")
+    upper = now - timedelta(milliseconds=settle_ms)
+    if position is not None and position[0] > upper:
+        upper = position[0]
+
+    selector = _after(position, upper)
+    order = [(MODIFIED_AT_FIELD, ASCENDING), ("_id", ASCENDING)]
+    documents = await lcollection.find(selector, projection).sort(order).limit(limit + 1).to_list(length=None)
+    tombstones = await tombstones_collection.find({"schema": schema_name, **selector}).sort(order).limit(limit + 1).to_list(length=None)
+
+    entries = [(document[MODIFIED_AT_FIELD], document["_id"], "upsert", document) for document in documents]
+    entries += [(tombstone[MODIFIED_AT_FIELD], tombstone["_id"], "delete", tombstone) for tombstone in tombstones]
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changes = []
+    for modified_at, _, op, entry in entries:
+        if op == "delete":
+            changes.append({"op": "delete", "_id": str(entry["doc_id"]), "modified_at": modified_at})
+        else:
+            changes.append({"op": "upsert", "_id": str(entry["_id"]), "modified_at": modified_at, "document": entry})
+    if has_more:
+        watermark = encode_watermark(entries[-1][0], entries[-1][1])
+    else:
+        watermark = encode_watermark(upper, _LAST_ID)
+    return changes, watermark, has_more
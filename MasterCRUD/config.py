@@ -0,0 +1,117 @@
+
+#--------------Application settings--------------#
+
+# Settings are read from environment variables so the same code can run against
+# a local mongod, a staging replica set or production without edits
+import os
+from typing import List
+from pydantic import BaseModel
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+class Settings(BaseModel):
+    mongo_uri: str = "mongodb://localhost:27017/"
+    database_name: str = "databasename"
+    # Connection pool sizing, see pymongo's MongoClient for the meaning of each option
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: int = 0
+    wait_queue_timeout_ms: int = 0
+    # Timeouts (milliseconds), 0 keeps the driver default
+    server_selection_timeout_ms: int = 30000
+    connect_timeout_ms: int = 20000
+    socket_timeout_ms: int = 0
+    # Log requests that make more database round trips than this, 0 disables the log
+    db_call_budget: int = 0
+    # Seconds to keep /{schema_name}/stats results
+    stats_cache_ttl: int = 30
+    # What MongoDB does with documents failing the schema's $jsonSchema validator:
+    # "error", "warn", or "off" to not install validators at all
+    db_validation_action: str = "error"
+    # Tenants served besides "default", each in its own database on the shared client.
+    # A tenant is picked with the tenant header or a /t/{tenant}/ path prefix.
+    tenants: List[str] = []
+    tenant_header: str = "x-tenant"
+    # Seconds between per-tenant storage (dbStats) refreshes for /metrics, 0 disables them
+    tenant_stats_interval: int = 60
+    # Where import error reports (CSV) are written, defaults to a directory under the
+    # system temp dir, and how many seconds they can be downloaded for
+    import_report_dir: str = ""
+    import_report_ttl: int = 3600
+    # Worker processes that parse and validate import files, and rows per chunk handed to a worker
+    import_workers: int = min(4, os.cpu_count() or 1)
+    import_chunk_rows: int = 5000
+    # Resumable upload sessions: where chunks are stored, the chunk size offered to
+    # clients (bytes) and how many seconds an unfinished session is kept
+    upload_dir: str = ""
+    upload_chunk_size: int = 8 * 1024 * 1024
+    upload_ttl: int = 86400
+    # Change export (/export/{schema_name}/changes): seconds deletes are remembered
+    # for, and how long (ms) a change is held back so in-flight writes can land first
+    tombstone_ttl: int = 30 * 86400
+    changes_settle_ms: int = 2000
+    # Where finished exports are cached (defaults to a directory under the system temp
+    # dir) and the most bytes the cache may hold before the least used files go
+    export_cache_dir: str = ""
+    export_cache_max_bytes: int = 1024 * 1024 * 1024
+    # Response compression: levels for gzip and zstd, and the smallest streamed JSON
+    # response worth compressing (bytes)
+    gzip_level: int = 6
+    zstd_level: int = 3
+    compress_min_bytes: int = 1024
+    # Documents per insert_many when restoring a snapshot (/admin/restore)
+    restore_batch_size: int = 5000
+    # Live events (/{schema_name}/events): where they come from ("auto" picks change
+    # streams on a replica set, in-process write hooks otherwise), events kept per
+    # schema for clients resuming with Last-Event-ID, the most concurrent subscribers
+    # and seconds between keepalives on an idle stream
+    events_source: str = "auto"
+    events_history: int = 1000
+    events_max_subscribers: int = 100
+    events_heartbeat: int = 15
+
+
+def load_settings() -> Settings:
+    return Settings(
+        mongo_uri=os.environ.get("MONGO_URI", "mongodb://localhost:27017/"),
+        database_name=os.environ.get("MONGO_DATABASE", "databasename"),
+        max_pool_size=_env_int("MONGO_MAX_POOL_SIZE", 100),
+        min_pool_size=_env_int("MONGO_MIN_POOL_SIZE", 0),
+        max_idle_time_ms=_env_int("MONGO_MAX_IDLE_TIME_MS", 0),
+        wait_queue_timeout_ms=_env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 0),
+        server_selection_timeout_ms=_env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000),
+        connect_timeout_ms=_env_int("MONGO_CONNECT_TIMEOUT_MS", 20000),
+        socket_timeout_ms=_env_int("MONGO_SOCKET_TIMEOUT_MS", 0),
+        db_call_budget=_env_int("DB_CALL_BUDGET", 0),
+        stats_cache_ttl=_env_int("STATS_CACHE_TTL", 30),
+        db_validation_action=os.environ.get("DB_VALIDATION_ACTION", "error"),
+        tenants=[name.strip().lower() for name in os.environ.get("TENANTS", "").split(",") if name.strip()],
+        tenant_header=os.environ.get("TENANT_HEADER", "x-tenant").lower(),
+        tenant_stats_interval=_env_int("TENANT_STATS_INTERVAL", 60),
+        import_report_dir=os.environ.get("IMPORT_REPORT_DIR", ""),
+        import_report_ttl=_env_int("IMPORT_REPORT_TTL", 3600),
+        import_workers=_env_int("IMPORT_WORKERS", min(4, os.cpu_count() or 1)),
+        import_chunk_rows=_env_int("IMPORT_CHUNK_ROWS", 5000),
+        upload_dir=os.environ.get("UPLOAD_DIR", ""),
+        upload_chunk_size=_env_int("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024),
+        upload_ttl=_env_int("UPLOAD_TTL", 86400),
+        tombstone_ttl=_env_int("TOMBSTONE_TTL", 30 * 86400),
+        changes_settle_ms=_env_int("CHANGES_SETTLE_MS", 2000),
+        export_cache_dir=os.environ.get("EXPORT_CACHE_DIR", ""),
+        export_cache_max_bytes=_env_int("EXPORT_CACHE_MAX_BYTES", 1024 * 1024 * 1024),
+        gzip_level=_env_int("GZIP_LEVEL", 6),
+        zstd_level=_env_int("ZSTD_LEVEL", 3),
+        compress_min_bytes=_env_int("COMPRESS_MIN_BYTES", 1024),
+        restore_batch_size=_env_int("RESTORE_BATCH_SIZE", 5000),
+        events_source=os.environ.get("EVENTS_SOURCE", "auto"),
+        events_history=_env_int("EVENTS_HISTORY", 1000),
+        events_max_subscribers=_env_int("EVENTS_MAX_SUBSCRIBERS", 100),
+        events_heartbeat=_env_int("EVENTS_HEARTBEAT", 15),
+    )
+
+
+settings = load_settings()
@@ -0,0 +1,121 @@
+
+#--------------Response compression--------------#
+
+# Exports and large list responses are produced piece by piece, so they are
+# compressed the same way: each piece goes through an incremental gzip or zstd
+# encoder as it is generated, picked from the client's Accept-Encoding. zstd is
+# only offered when the zstandard package is installed.
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Preferred first when the client rates them equally
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+# Pick the response encoding for an Accept-Encoding header, None to send it as is
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+# Incremental encoder with compress(data) -> bytes and flush() -> bytes
+def encoder(encoding: Optional[str], gzip_level: int = 6, zstd_level: int = 3):
+    if encoding == "gzip":
+        # wbits 31: gzip header and trailer around the deflate stream
+        return zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=zstd_level).compressobj()
+    return _Identity()
+
+
+async def encode_stream(chunks: AsyncIterator[bytes], encoding: Optional[str], gzip_level: int = 6, zstd_level: int = 3) -> AsyncIterator[bytes]:
+    compressor = encoder(encoding, gzip_level, zstd_level)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+async def _json_array(first: List[bytes], rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield b"[" + b",".join(first)
+    async for item in rest:
+        yield b"," + item
+    yield b"]"
+
+
+# Serialized the way FastAPI's JSONResponse does it, so a streamed list formats
+# datetimes and other values exactly like the single-item routes
+def dumps(value: Any) -> bytes:
+    return json.dumps(
+        jsonable_encoder(value, custom_encoder={ObjectId: str}),
+        ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+# JSON array response for items from an async iterator, streamed instead of built in
+# memory. Arrays shorter than `min_size` bytes are sent in one plain response; larger
+# ones are compressed on the fly when the client accepts an encoding.
+async def json_array_response(
+    items: AsyncIterator[Any],
+    accept_encoding: Optional[str],
+    min_size: int = 1024,
+    gzip_level: int = 6,
+    zstd_level: int = 3,
+) -> Response:
+    encoded = (dumps(item) async for item in items)
+    first: List[bytes] = []
+    size = 0
+    async for item in encoded:
+        first.append(item)
+        size += len(item) + 1
+        if size >= min_size:
+            break
+    else:
+        return Response(b"[" + b",".join(first) + b"]", media_type="application/json", headers={"Vary": "Accept-Encoding"})
+
+    encoding = negotiate(accept_encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = encode_stream(_json_array(first, encoded), encoding, gzip_level, zstd_level)
+    return StreamingResponse(body, media_type="application/json", headers=headers)
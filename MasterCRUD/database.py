@@ -0,0 +1,193 @@
+
+#--------------MongoDB client lifecycle--------------#
+
+# The Motor client is created from Settings when the app starts and closed on
+# shutdown. Every tenant's database hangs off this one client, so they share its
+# connection pool. Collection handles are cached per tenant so routes don't build
+# a new AsyncIOMotorCollection for every request.
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import monitoring
+from config import Settings
+from db_tracing import command_tracer
+from metrics import Counter, Gauge, Histogram, registry
+from tenancy import DEFAULT_TENANT, current_tenant
+
+MASTERLIST = "masterlist"
+
+
+#--------------Connection pool monitoring--------------#
+
+POOL_IN_USE = registry.register(Gauge("mongo_pool_connections_in_use", "Connections currently checked out of the pool", ("address",)))
+POOL_OPEN = registry.register(Gauge("mongo_pool_connections_open", "Connections currently open in the pool", ("address",)))
+POOL_CHECKOUT_FAILURES = registry.register(Counter("mongo_pool_checkout_failures_total", "Failed connection checkouts"))
+POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting to check out a pooled connection", (),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+))
+
+# Listener registered on the client to track how long requests wait for a pooled
+# connection and how many connections are checked out at any time
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Checkout happens synchronously on the driver thread, so the start time
+        # can be kept per thread when the event doesn't carry a duration
+        self._local = threading.local()
+        self.in_use: Dict[str, int] = {}
+        self.open_connections: Dict[str, int] = {}
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _wait_time(self, event) -> float:
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            return duration
+        started = getattr(self._local, "started", None)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self.in_use.pop(address, None)
+            self.open_connections.pop(address, None)
+
+    def connection_created(self, event):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self.open_connections[address] = self.open_connections.get(address, 0) + 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self.open_connections[address] = max(self.open_connections.get(address, 0) - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+            POOL_CHECKOUT_FAILURES.inc()
+
+    def connection_checked_out(self, event):
+        address = "%s:%s" % event.address
+        waited = self._wait_time(event)
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+            POOL_CHECKOUT_WAIT.observe((), waited)
+            self.in_use[address] = self.in_use.get(address, 0) + 1
+
+    def connection_checked_in(self, event):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self.in_use[address] = max(self.in_use.get(address, 0) - 1, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_use": dict(self.in_use),
+                "open_connections": dict(self.open_connections),
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_wait_avg_ms": (self.checkout_wait_total / self.checkouts * 1000) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": self.checkout_wait_max * 1000,
+            }
+
+
+    # Refresh the pool gauges right before /metrics is rendered
+    def collect(self) -> None:
+        with self._lock:
+            for address, count in self.in_use.items():
+                POOL_IN_USE.set((address,), count)
+            for address, count in self.open_connections.items():
+                POOL_OPEN.set((address,), count)
+
+
+pool_monitor = PoolMonitor()
+registry.add_collector(pool_monitor.collect)
+
+# Factory used to build the client; benchmarks swap in an in-memory stand-in
+client_factory = AsyncIOMotorClient
+client: Optional[AsyncIOMotorClient] = None
+# Database of the default tenant
+db: Optional[AsyncIOMotorDatabase] = None
+_database_name = ""
+_databases: Dict[str, AsyncIOMotorDatabase] = {}
+_collections: Dict[Tuple[str, str], AsyncIOMotorCollection] = {}
+
+
+# Build the client from settings, only passing options that were actually configured
+def connect(settings: Settings) -> None:
+    global client, db, _database_name
+    options: Dict[str, Any] = {
+        "maxPoolSize": settings.max_pool_size,
+        "minPoolSize": settings.min_pool_size,
+        "serverSelectionTimeoutMS": settings.server_selection_timeout_ms,
+        "connectTimeoutMS": settings.connect_timeout_ms,
+    }
+    if settings.max_idle_time_ms:
+        options["maxIdleTimeMS"] = settings.max_idle_time_ms
+    if settings.wait_queue_timeout_ms:
+        options["waitQueueTimeoutMS"] = settings.wait_queue_timeout_ms
+    if settings.socket_timeout_ms:
+        options["socketTimeoutMS"] = settings.socket_timeout_ms
+    client = client_factory(settings.mongo_uri, event_listeners=[pool_monitor, command_tracer], **options)
+    _database_name = settings.database_name
+    _databases.clear()
+    _collections.clear()
+    db = get_database(DEFAULT_TENANT)
+
+
+def close() -> None:
+    global client, db
+    _databases.clear()
+    _collections.clear()
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+
+# The default tenant keeps the configured database, others get a suffixed one
+def tenant_database_name(tenant: str) -> str:
+    return _database_name if tenant == DEFAULT_TENANT else f"{_database_name}_{tenant}"
+
+
+# Database of the given tenant, or of the tenant serving the current request
+def get_database(tenant: Optional[str] = None) -> AsyncIOMotorDatabase:
+    tenant = tenant or current_tenant.get()
+    tenant_db = _databases.get(tenant)
+    if tenant_db is None:
+        if client is None:
+            raise RuntimeError("Database client is not connected")
+        tenant_db = _databases[tenant] = client[tenant_database_name(tenant)]
+    return tenant_db
+
+
+# Return the cached collection handle for a schema in the current tenant's database,
+# creating it on first use
+def get_collection(name: str) -> AsyncIOMotorCollection:
+    key = (current_tenant.get(), name)
+    lcollection = _collections.get(key)
+    if lcollection is None:
+        lcollection = _collections[key] = get_database(key[0])[name]
+    return lcollection
@@ -0,0 +1,304 @@
+
+#--------------Synthetic data generator--------------#
+
+# Produces rows shaped like a SchemaModel (types, allowed_values, dict_keys, unique)
+# for benchmarks and import testing. Rows can be streamed into MongoDB, CSV, XLSX
+# or NDJSON, and a controlled fraction of them can be made invalid on purpose to
+# exercise the import error path.
+#
+#   python datagen.py --schema-file college.json -n 100000 --format csv --output college.csv
+#   python datagen.py --schema-name college_details -n 50000 --format mongo --invalid-fraction 0
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import string
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from models import FieldModel, SchemaModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WORDS = [
+    "chennai", "madurai", "coimbatore", "trichy", "salem", "erode", "vellore", "tirunelveli",
+    "arts", "science", "engineering", "commerce", "medical", "law", "management", "design",
+    "north", "south", "east", "west", "central", "new", "old", "main", "park", "lake",
+]
+
+def _dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+class RowGenerator:
+    def __init__(self, schema: SchemaModel, seed: Optional[int] = None, invalid_fraction: float = 0.0, prefix: str = ""):
+        self.schema = schema
+        self.random = random.Random(seed)
+        self.invalid_fraction = invalid_fraction
+        # Prefix keeps unique values distinct between generator runs against the same collection
+        self.prefix = prefix
+        self.columns = [field.col_name for field in schema.fields]
+        self._generators: List[Tuple[str, Callable[[int], Any]]] = [
+            (field.col_name, self._field_generator(field)) for field in schema.fields
+        ]
+        self._mutations = self._available_mutations()
+
+    #--------------Valid values--------------#
+
+    def _value_for_type(self, type_name: str) -> Callable[[int], Any]:
+        rnd = self.random
+        if type_name == "int":
+            return lambda i: rnd.randint(0, 100000)
+        if type_name == "float":
+            return lambda i: round(rnd.uniform(0, 100000), 2)
+        if type_name == "bool":
+            return lambda i: rnd.random() < 0.5
+        if type_name == "list":
+            return lambda i: rnd.sample(WORDS, rnd.randint(1, 3))
+        if type_name == "dict":
+            return lambda i: {"key": rnd.choice(WORDS)}
+        return lambda i: f"{rnd.choice(WORDS)} {rnd.choice(WORDS)}"
+
+    def _field_generator(self, field: FieldModel) -> Callable[[int], Any]:
+        rnd = self.random
+        type_name = field.type if isinstance(field.type, str) else "str"
+        prefix = self.prefix
+
+        if field.allowed_values and type_name == "list":
+            allowed = list(field.allowed_values)
+            return lambda i: rnd.sample(allowed, rnd.randint(1, len(allowed)))
+        if field.allowed_values:
+            allowed = list(field.allowed_values)
+            return lambda i: rnd.choice(allowed)
+        if field.unique:
+            # Derive unique values from the row number so they never collide
+            if type_name == "int":
+                return lambda i: i
+            if type_name == "float":
+                return lambda i: float(i)
+            return lambda i: f"{prefix}{field.col_name}-{i}"
+        if type_name == "dict" and field.dict_keys:
+            key_generators = [(key, self._value_for_type(key_type)) for key, key_type in field.dict_keys.items()]
+            return lambda i: {key: gen(i) for key, gen in key_generators}
+        return self._value_for_type(type_name)
+
+    #--------------Invalid values--------------#
+
+    # Kinds of mistakes that can be injected: a value outside allowed_values, an unknown
+    # dict key, an unparseable dict, a non-numeric int/float, or a duplicated unique value
+
+    def _available_mutations(self) -> List[Tuple[str, FieldModel]]:
+        mutations = []
+        for field in self.schema.fields:
+            if field.allowed_values:
+                mutations.append(("allowed_value", field))
+            if field.type == "dict":
+                mutations.append(("dict_key" if field.dict_keys else "missing_dict", field))
+            if field.type in ("int", "float"):
+                mutations.append(("type", field))
+            if field.unique:
+                mutations.append(("duplicate", field))
+        return mutations
+
+    def _make_invalid(self, row: Dict[str, Any]) -> None:
+        kind, field = self.random.choice(self._mutations)
+        col = field.col_name
+        if kind == "allowed_value":
+            row[col] = "__invalid__"
+        elif kind == "dict_key":
+            row[col] = dict(row[col], __unknown__=self.random.choice(WORDS))
+        elif kind == "missing_dict":
+            row[col] = "{not json"
+        elif kind == "type":
+            row[col] = "".join(self.random.choices(string.ascii_letters, k=6))
+        elif kind == "duplicate":
+            # Reuse the value of the first row, which is always valid
+            row[col] = self._generators[self.columns.index(col)][1](0)
+
+    #--------------Row iteration--------------#
+
+    def row(self, i: int) -> Dict[str, Any]:
+        return {col: gen(i) for col, gen in self._generators}
+
+    # Yield (row, is_valid) pairs for rows start..start+count-1
+    def rows(self, count: int, start: int = 0) -> Iterator[Tuple[Dict[str, Any], bool]]:
+        rnd = self.random
+        fraction = self.invalid_fraction if self._mutations else 0.0
+        for i in range(start, start + count):
+            row = self.row(i)
+            if fraction and i > 0 and rnd.random() < fraction:
+                self._make_invalid(row)
+                yield row, False
+            else:
+                yield row, True
+
+    def batches(self, count: int, batch_size: int = 1000, start: int = 0) -> Iterator[List[Tuple[Dict[str, Any], bool]]]:
+        batch = []
+        for item in self.rows(count, start):
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+#--------------Output sinks--------------#
+
+# Each sink returns (valid_rows, invalid_rows) written
+
+def _cell(value: Any) -> Any:
+    # Nested values are written the way import_data expects to read them back
+    if isinstance(value, (dict, list)):
+        return _dumps(value)
+    return value
+
+
+def _write_csv_rows(out, generator: RowGenerator, count: int, start: int = 0) -> Tuple[int, int]:
+    valid = invalid = 0
+    writer = csv.writer(out)
+    writer.writerow(generator.columns)
+    for batch in generator.batches(count, start=start):
+        writer.writerows([[_cell(row[col]) for col in generator.columns] for row, _ in batch])
+        for _, ok in batch:
+            if ok:
+                valid += 1
+            else:
+                invalid += 1
+    return valid, invalid
+
+
+def write_csv(generator: RowGenerator, count: int, path: str) -> Tuple[int, int]:
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        return _write_csv_rows(out, generator, count)
+
+
+# In-memory CSV payload, used by benchmarks to upload generated files
+def csv_bytes(generator: RowGenerator, count: int, start: int = 0) -> bytes:
+    out = io.StringIO()
+    _write_csv_rows(out, generator, count, start)
+    return out.getvalue().encode()
+
+
+def write_ndjson(generator: RowGenerator, count: int, path: str) -> Tuple[int, int]:
+    valid = invalid = 0
+    with open(path, "wb") as out:
+        for batch in generator.batches(count):
+            out.write(b"".join((_dumps(row) + "\n").encode() for row, _ in batch))
+            for _, ok in batch:
+                if ok:
+                    valid += 1
+                else:
+                    invalid += 1
+    return valid, invalid
+
+
+def write_xlsx(generator: RowGenerator, count: int, path: str) -> Tuple[int, int]:
+    from openpyxl import Workbook
+
+    valid = invalid = 0
+    # write_only mode streams rows to disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(generator.columns)
+    for row, ok in generator.rows(count):
+        sheet.append([_cell(row[col]) for col in generator.columns])
+        if ok:
+            valid += 1
+        else:
+            invalid += 1
+    workbook.save(path)
+    return valid, invalid
+
+
+async def write_mongo(generator: RowGenerator, count: int, lcollection, batch_size: int = 5000, modified_date: Optional[str] = None) -> Tuple[int, int]:
+    from pymongo.errors import BulkWriteError
+
+    valid = invalid = 0
+    for batch in generator.batches(count, batch_size):
+        documents = []
+        for row, ok in batch:
+            if modified_date is not None:
+                row["modified_date"] = modified_date
+            documents.append(row)
+            if ok:
+                valid += 1
+            else:
+                invalid += 1
+        # Unordered so one bad document (e.g. an injected duplicate) doesn't stop the batch;
+        # the documents the server rejected aren't counted as written
+        try:
+            await lcollection.insert_many(documents, ordered=False)
+        except BulkWriteError as err:
+            for error in err.details["writeErrors"]:
+                if batch[error["index"]][1]:
+                    valid -= 1
+                else:
+                    invalid -= 1
+    return valid, invalid
+
+
+#--------------Command line--------------#
+
+async def _load_schema_from_mongo(uri: str, database_name: str, schema_name: str) -> SchemaModel:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(uri)
+    try:
+        document = await client[database_name]["masterlist"].find_one({"schema_name": schema_name})
+    finally:
+        client.close()
+    if not document:
+        raise SystemExit(f"Schema '{schema_name}' not found in {database_name}.masterlist")
+    return SchemaModel(**document)
+
+
+async def _main(args) -> None:
+    if args.schema_file:
+        with open(args.schema_file) as source:
+            schema = SchemaModel(**json.load(source))
+    else:
+        schema = await _load_schema_from_mongo(args.mongo_uri, args.database, args.schema_name)
+
+    generator = RowGenerator(schema, seed=args.seed, invalid_fraction=args.invalid_fraction, prefix=args.prefix)
+    if args.format == "mongo":
+        from datetime import datetime
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(args.mongo_uri)
+        try:
+            lcollection = client[args.database][schema.schema_name]
+            valid, invalid = await write_mongo(generator, args.rows, lcollection, modified_date=datetime.now().strftime("%d/%m/%Y"))
+        finally:
+            client.close()
+    else:
+        output = args.output or f"{schema.schema_name}.{args.format}"
+        writer = {"csv": write_csv, "ndjson": write_ndjson, "xlsx": write_xlsx}[args.format]
+        valid, invalid = writer(generator, args.rows, output)
+    print(json.dumps({"schema": schema.schema_name, "valid_rows": valid, "invalid_rows": invalid}))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic rows for a masterlist schema")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--schema-file", help="JSON file with a schema definition (schema_name + fields)")
+    source.add_argument("--schema-name", help="Read the schema definition from the masterlist collection")
+    parser.add_argument("-n", "--rows", type=int, default=10000)
+    parser.add_argument("--format", choices=["csv", "xlsx", "ndjson", "mongo"], default="csv")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--invalid-fraction", type=float, default=0.0, help="Fraction of rows to make invalid (0-1)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--prefix", default="", help="Prefix for generated unique values")
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--database", default=os.environ.get("MONGO_DATABASE", "databasename"))
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(parse_args()))
@@ -0,0 +1,109 @@
+
+#--------------Per-request MongoDB command tracing--------------#
+
+# Every command the driver sends is attributed to the HTTP request that issued it
+# through a contextvar. Motor copies the caller's context into its executor
+# threads, so the listener sees the same RequestTrace as the route handler.
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+from pymongo import monitoring
+
+logger = logging.getLogger("masterlist.db")
+
+
+class RequestTrace:
+    __slots__ = ("calls", "duration_micros", "commands")
+
+    def __init__(self):
+        self.calls = 0
+        self.duration_micros = 0
+        # Round trips per command name, used to spot N+1 patterns in the budget log
+        self.commands: Dict[str, int] = {}
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+class CommandTracer(monitoring.CommandListener):
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.calls += 1
+            trace.commands[event.command_name] = trace.commands.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.duration_micros += event.duration_micros
+
+    def failed(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.duration_micros += event.duration_micros
+
+
+command_tracer = CommandTracer()
+
+
+def _trace_headers(trace: RequestTrace):
+    return [
+        (b"x-db-calls", str(trace.calls).encode()),
+        (b"x-db-time", ("%.3f" % (trace.duration_micros / 1000)).encode()),
+    ]
+
+
+# ASGI middleware that opens a trace per request, reports it in the X-DB-Calls and
+# X-DB-Time (milliseconds) response headers and logs requests over the round-trip budget.
+# A streamed body (no Content-Length) can still query the database after the headers
+# are out, so the counts go in trailers when the server supports them; otherwise the
+# headers only cover the work done before the first byte and the final count is logged.
+class DbTracingMiddleware:
+    def __init__(self, app, call_budget: int = 0):
+        self.app = app
+        self.call_budget = call_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        trailers = "http.response.trailers" in scope.get("extensions", {})
+        streamed = False
+        reported = 0
+
+        async def send_wrapper(message):
+            nonlocal streamed, reported
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                streamed = not any(name.lower() == b"content-length" for name, _ in headers)
+                if streamed and trailers:
+                    headers.append((b"trailer", b"x-db-calls, x-db-time"))
+                    message["trailers"] = True
+                else:
+                    headers += _trace_headers(trace)
+                    reported = trace.calls
+                message["headers"] = headers
+            elif message["type"] == "http.response.body" and streamed and trailers and not message.get("more_body", False):
+                await send(message)
+                await send({"type": "http.response.trailers", "headers": _trace_headers(trace), "more_trailers": False})
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            if streamed and not trailers and trace.calls > reported:
+                logger.info(
+                    "%s %s made %d database round trips (%.3f ms), %d of them after X-DB-Calls was sent",
+                    scope["method"], scope["path"], trace.calls, trace.duration_micros / 1000, trace.calls - reported,
+                )
+            if self.call_budget and trace.calls > self.call_budget:
+                logger.warning(
+                    "%s %s made %d database round trips (budget %d, %.3f ms): %s",
+                    scope["method"], scope["path"], trace.calls, self.call_budget,
+                    trace.duration_micros / 1000, trace.commands,
+                )
@@ -0,0 +1,215 @@
+
+#--------------Live change events--------------#
+
+# Server-sent events behind /{schema_name}/events. Each (tenant, schema) has a
+# channel holding a short history of recent events, for clients reconnecting with
+# Last-Event-ID, and a bounded queue per connected subscriber. Events come from one
+# of two sources:
+#   hooks           the write routes of this process publish what they wrote; bulk
+#                   writes (imports, restores, migrations) are announced as a single
+#                   "reload" event instead of row by row
+#   change_streams  a MongoDB change stream per watched channel, so writes made by
+#                   other processes or outside the API show up too (replica sets and
+#                   sharded clusters only)
+# Event IDs carry a per-process epoch: an ID from before a restart or from another
+# process can't be resumed, and neither can one whose events have left the history.
+# Those clients, and subscribers too slow to keep up, get a "reload" event telling
+# them to fetch the list again.
+import asyncio
+import itertools
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Sequence, Set, Tuple
+from pymongo.errors import OperationFailure, PyMongoError
+import metrics
+from content_encoding import dumps
+
+EVENT_SOURCES = ("auto", "hooks", "change_streams")
+
+# Events for a single document, which a change stream reports by itself
+DOCUMENT_EVENTS = ("insert", "update", "delete")
+
+# Sent on idle connections so proxies don't time them out
+KEEPALIVE = b": keepalive\n\n"
+
+# Change stream events worth a client event; updates touching only hidden fields are skipped later
+WATCH_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete", "drop", "rename", "invalidate"]}}}]
+
+ChannelKey = Tuple[str, str]
+
+
+class SubscriberLimitError(Exception):
+    pass
+
+
+# Pick the event source for `configured` ("auto" uses change streams when the server supports them)
+async def detect_source(db, configured: str) -> str:
+    if configured not in EVENT_SOURCES:
+        raise ValueError(f"EVENTS_SOURCE must be one of {', '.join(EVENT_SOURCES)}")
+    if configured != "auto":
+        return configured
+    try:
+        hello = await db.command("hello")
+    except (PyMongoError, NotImplementedError):
+        return "hooks"
+    return "change_streams" if hello.get("setName") or hello.get("msg") == "isdbgrid" else "hooks"
+
+
+def format_event(event_id: str, event: str, data: Dict[str, Any]) -> bytes:
+    return b"id: " + event_id.encode() + b"\nevent: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # Set when an event didn't fit in the queue; the client is sent a reload
+        self.lagged = False
+
+    def put(self, message: bytes) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class Channel:
+    def __init__(self, history: int):
+        self.history: Deque[Tuple[int, bytes]] = deque(maxlen=history)
+        # Highest sequence number that is no longer in the history
+        self.dropped_through = 0
+        self.subscribers: Set[Subscriber] = set()
+        self.watcher: Optional[asyncio.Task] = None
+        self.resume_token: Optional[Dict[str, Any]] = None
+
+
+class EventHub:
+    # `prepare(schema_name, document)` turns a stored document into what clients see,
+    # `hidden_fields` are left out of update events from the change stream
+    def __init__(self, history: int, max_subscribers: int, prepare: Callable[[str, Dict[str, Any]], Dict[str, Any]], hidden_fields: Sequence[str] = ()):
+        self.history = history
+        self.max_subscribers = max_subscribers
+        self.prepare = prepare
+        self.hidden_fields = set(hidden_fields)
+        self.source = "hooks"
+        self.epoch = uuid.uuid4().hex[:8]
+        self.subscriber_count = 0
+        self._sequence = itertools.count(1)
+        self._channels: Dict[ChannelKey, Channel] = {}
+
+    def _channel(self, key: ChannelKey) -> Channel:
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._channels[key] = Channel(self.history)
+        return channel
+
+    def _event_id(self, sequence: int) -> str:
+        return f"{self.epoch}-{sequence}"
+
+    def publish(self, key: ChannelKey, event: str, data: Dict[str, Any]) -> None:
+        channel = self._channel(key)
+        sequence = next(self._sequence)
+        message = format_event(self._event_id(sequence), event, data)
+        if len(channel.history) == channel.history.maxlen:
+            channel.dropped_through = channel.history[0][0]
+        channel.history.append((sequence, message))
+        for subscriber in channel.subscribers:
+            subscriber.put(message)
+        metrics.EVENTS_PUBLISHED.inc((key[1], event))
+
+    # Publish from a write route. With change streams a document write arrives through the
+    # stream instead, but reloads (schema changes, migrations, imports) only come from here.
+    def publish_local(self, key: ChannelKey, event: str, data: Dict[str, Any]) -> None:
+        if self.source == "hooks" or event not in DOCUMENT_EVENTS:
+            self.publish(key, event, data)
+
+    def _reload(self, reason: str) -> bytes:
+        return format_event(self._event_id(next(self._sequence)), "reload", {"reason": reason})
+
+    # Register a subscriber, queued with the events after `last_event_id` when they can
+    # be replayed and a reload otherwise. Raises SubscriberLimitError when full.
+    def subscribe(self, key: ChannelKey, last_event_id: Optional[str], lcollection=None) -> Subscriber:
+        if self.subscriber_count >= self.max_subscribers:
+            raise SubscriberLimitError(f"Too many event subscribers (limit {self.max_subscribers})")
+        channel = self._channel(key)
+        subscriber = Subscriber(self.history)
+        if last_event_id:
+            epoch, _, sequence = last_event_id.partition("-")
+            last = int(sequence) if epoch == self.epoch and sequence.isdigit() else None
+            if last is None or last < channel.dropped_through:
+                subscriber.put(self._reload("resume"))
+            else:
+                for event_sequence, message in channel.history:
+                    if event_sequence > last:
+                        subscriber.put(message)
+        channel.subscribers.add(subscriber)
+        self.subscriber_count += 1
+        metrics.EVENT_SUBSCRIBERS.inc((key[1],))
+        if self.source == "change_streams" and lcollection is not None and channel.watcher is None:
+            channel.watcher = asyncio.create_task(self._watch(key, channel, lcollection))
+        return subscriber
+
+    def unsubscribe(self, key: ChannelKey, subscriber: Subscriber) -> None:
+        channel = self._channel(key)
+        channel.subscribers.discard(subscriber)
+        self.subscriber_count -= 1
+        metrics.EVENT_SUBSCRIBERS.inc((key[1],), -1)
+        # The stream is resumed from channel.resume_token when someone subscribes again
+        if not channel.subscribers and channel.watcher is not None:
+            channel.watcher.cancel()
+            channel.watcher = None
+
+    # SSE body for a subscriber, with a keepalive comment every `heartbeat` idle seconds
+    async def stream(self, key: ChannelKey, subscriber: Subscriber, heartbeat: float) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                if subscriber.lagged:
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.lagged = False
+                    yield self._reload("lagged")
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            self.unsubscribe(key, subscriber)
+
+    #--------------Change stream source--------------#
+
+    async def _watch(self, key: ChannelKey, channel: Channel, lcollection) -> None:
+        while True:
+            try:
+                async with lcollection.watch(WATCH_PIPELINE, resume_after=channel.resume_token) as changes:
+                    async for change in changes:
+                        channel.resume_token = changes.resume_token
+                        self._publish_change(key, change)
+                # The stream ends after an invalidate (collection dropped or renamed over)
+                channel.resume_token = None
+            except OperationFailure:
+                if channel.resume_token is not None:
+                    # The resume point has left the oplog, whatever happened since is unknown
+                    channel.resume_token = None
+                    self.publish(key, "reload", {"reason": "history lost"})
+                await asyncio.sleep(1)
+            except PyMongoError:
+                await asyncio.sleep(1)
+
+    def _publish_change(self, key: ChannelKey, change: Dict[str, Any]) -> None:
+        operation = change["operationType"]
+        if operation in ("drop", "rename"):
+            self.publish(key, "reload", {"reason": "collection replaced"})
+            return
+        if operation == "invalidate":
+            return
+        doc_id = str(change["documentKey"]["_id"])
+        if operation == "delete":
+            self.publish(key, "delete", {"_id": doc_id})
+        elif operation == "insert":
+            self.publish(key, "insert", {"_id": doc_id, "document": self.prepare(key[1], change["fullDocument"])})
+        elif operation == "replace":
+            self.publish(key, "update", {"_id": doc_id, "fields": self.prepare(key[1], change["fullDocument"])})
+        else:
+            updated = change["updateDescription"]["updatedFields"]
+            fields = {name: value for name, value in updated.items() if name.split(".")[0] not in self.hidden_fields}
+            if fields:
+                self.publish(key, "update", {"_id": doc_id, "fields": fields})
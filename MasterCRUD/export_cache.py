@@ -0,0 +1,135 @@
+
+#--------------Export file cache--------------#
+
+# Finished exports are kept on local disk, keyed by what was asked for (schema,
+# filters, fields, format) and the data version of the schema, so a repeated export
+# is sent straight from the file (with Range support) until the data changes.
+# Files of an older data version are dropped on the next lookup, and the cache as a
+# whole is trimmed to a byte budget, least recently used first.
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Temp files left behind by a crashed export are removed after this many seconds
+STALE_TEMP_SECONDS = 3600
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+class ExportCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    # Cache file for an export of `schema_name` (per tenant) at data version `version`.
+    # Files of other versions of the same schema are removed on the way.
+    def entry_path(self, tenant: str, schema_name: str, version: str, key: Dict[str, Any], extension: str) -> str:
+        schema_dir = os.path.join(self.directory, tenant, schema_name)
+        os.makedirs(schema_dir, exist_ok=True)
+        prefix = _digest(version)[:16]
+        for entry in os.scandir(schema_dir):
+            if not entry.name.startswith(prefix) and not entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        return os.path.join(schema_dir, f"{prefix}-{_digest(key)}.{extension}")
+
+    def temp_path(self, path: str) -> str:
+        return f"{path}.{uuid.uuid4().hex}.tmp"
+
+    # True when the file is cached; a hit counts as a use for LRU eviction
+    def hit(self, path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    # Private hard link to a cached file for one response, so the download survives the
+    # entry being evicted or dropped for a newer data version while it is sent. The link
+    # ends in .tmp, which lookups and eviction leave alone; the caller removes it.
+    # Raises FileNotFoundError when the entry is already gone.
+    def checkout(self, path: str) -> str:
+        link = self.temp_path(path)
+        try:
+            os.link(path, link)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Filesystems without hard links get a copy
+            shutil.copyfile(path, link)
+        return link
+
+    # Return the cached file at `path`, producing it with `produce(temp_path)` on a miss.
+    # `produce` returns the number of rows written; with zero rows nothing is cached
+    # and None is returned. Concurrent misses for the same file share one export.
+    async def get_or_create(self, path: str, produce: Callable[[str], Awaitable[int]]) -> Tuple[Optional[str], bool]:
+        if self.hit(path):
+            return path, True
+        pending = self._pending.get(path)
+        if pending is not None:
+            return await asyncio.shield(pending), True
+        future = asyncio.get_running_loop().create_future()
+        self._pending[path] = future
+        temp_path = self.temp_path(path)
+        try:
+            rows = await produce(temp_path)
+            if rows:
+                os.replace(temp_path, path)
+                await asyncio.to_thread(self.evict, path)
+                result = path
+            else:
+                result = None
+            future.set_result(result)
+            return result, False
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self._pending[path]
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # Remove least recently used files until the cache fits in max_bytes. `keep` is
+    # the file just written, which is never evicted.
+    def evict(self, keep: Optional[str] = None) -> int:
+        entries = []
+        total = 0
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    if stat.st_mtime < cutoff:
+                        os.remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
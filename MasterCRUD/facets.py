@@ -0,0 +1,95 @@
+
+#--------------Facet counters--------------#
+
+# One counter document per (schema, field, value) for every allowed_values field.
+# Inserts, updates, imports and deletes adjust the counters with $inc, so reading
+# the facets of a schema costs one indexed query over its facet values instead of
+# a count_documents per value.
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+from models import FieldModel
+
+FACETS = "masterlist_facets"
+
+
+def facet_fields(fields: List[FieldModel]) -> List[FieldModel]:
+    return [field for field in fields if field.allowed_values]
+
+
+def _values(value: Any) -> Iterable[Any]:
+    # List fields count once per element; only plain scalars can be facet values
+    values = value if isinstance(value, list) else (value,)
+    return [v for v in values if isinstance(v, (str, int, float, bool))]
+
+
+# Counter deltas for going from `old` to `new` (either may be None for insert/delete)
+def facet_deltas(fields: List[FieldModel], old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Counter:
+    deltas: Counter = Counter()
+    for field in facet_fields(fields):
+        if old is not None and field.col_name in old:
+            for value in _values(old[field.col_name]):
+                deltas[(field.col_name, value)] -= 1
+        if new is not None and field.col_name in new:
+            for value in _values(new[field.col_name]):
+                deltas[(field.col_name, value)] += 1
+    return deltas
+
+
+def facet_counts(fields: List[FieldModel], documents: Iterable[Dict[str, Any]]) -> Counter:
+    counts: Counter = Counter()
+    for document in documents:
+        counts.update(facet_deltas(fields, None, document))
+    return counts
+
+
+async def ensure_facet_indexes(facets_collection) -> None:
+    await facets_collection.create_index(
+        [("schema", ASCENDING), ("field", ASCENDING), ("value", ASCENDING)], name="schema_field_value", unique=True
+    )
+
+
+async def apply_facet_deltas(facets_collection, schema_name: str, deltas: Counter) -> None:
+    operations = [
+        UpdateOne({"schema": schema_name, "field": field, "value": value}, {"$inc": {"count": delta}}, upsert=True)
+        for (field, value), delta in deltas.items()
+        if delta
+    ]
+    if operations:
+        await facets_collection.bulk_write(operations, ordered=False)
+
+
+async def read_facets(facets_collection, schema_name: str, fields: List[FieldModel]) -> Dict[str, Dict[str, int]]:
+    # Start from every allowed value so empty buckets are reported as 0
+    facets: Dict[str, Dict[str, int]] = {
+        field.col_name: {value: 0 for value in field.allowed_values} for field in facet_fields(fields)
+    }
+    async for counter in facets_collection.find({"schema": schema_name}, {"_id": 0, "field": 1, "value": 1, "count": 1}):
+        if counter["field"] in facets:
+            facets[counter["field"]][str(counter["value"])] = counter["count"]
+    return facets
+
+
+# Recount every facet from the schema's documents and overwrite the counters
+async def reconcile_facets(lcollection, facets_collection, schema_name: str, fields: List[FieldModel]) -> Dict[str, Dict[str, int]]:
+    counts: Counter = Counter()
+    for field in facet_fields(fields):
+        pipeline: List[Dict[str, Any]] = []
+        if field.type == "list":
+            pipeline.append({"$unwind": f"${field.col_name}"})
+        pipeline.append({"$group": {"_id": f"${field.col_name}", "count": {"$sum": 1}}})
+        async for bucket in lcollection.aggregate(pipeline):
+            if bucket["_id"] is not None:
+                counts[(field.col_name, bucket["_id"])] = bucket["count"]
+
+    operations: List[Any] = [
+        UpdateOne({"schema": schema_name, "field": field, "value": value}, {"$set": {"count": count}}, upsert=True)
+        for (field, value), count in counts.items()
+    ]
+    # Remove counters for values (or fields) that no longer occur
+    async for counter in facets_collection.find({"schema": schema_name}, {"field": 1, "value": 1}):
+        if (counter["field"], counter["value"]) not in counts:
+            operations.append(DeleteOne({"_id": counter["_id"]}))
+    if operations:
+        await facets_collection.bulk_write(operations, ordered=False)
+    return await read_facets(facets_collection, schema_name, fields)
@@ -0,0 +1,354 @@
+
+#--------------Import worker processes--------------#
+
+# Parsing and row validation for imports run in a process pool, away from the event
+# loop. One worker splits the file into fixed-size chunks spooled to disk, each chunk
+# is prepared by whichever worker is free as soon as it lands, and only the
+# ready-to-write documents and the rejected rows travel back. Nothing here touches
+# the database.
+import ast
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from models import FieldModel
+from search import SEARCH_KEYS_FIELD, search_keys
+from migrations import SCHEMA_VERSION_FIELD
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    # Plain Python values with None for blank cells, so documents encode to BSON as is
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+# Stream the first sheet of a workbook in `chunk_rows`-row DataFrames. openpyxl's
+# read-only mode parses the sheet XML as it goes, so memory stays flat with the
+# row count instead of growing with the whole workbook as pd.read_excel does.
+def read_xlsx_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        # Same column names pd.read_excel would give blank header cells
+        columns = [str(name) if name is not None else f"Unnamed: {index}" for index, name in enumerate(header)]
+        width = len(columns)
+        chunk = []
+        blank = 0
+        for row in rows:
+            # Rows can come back shorter or longer than the header
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            # Sheets often end in formatted but empty rows. Like read_excel, blank rows
+            # are dropped at the end only, so row numbers in error reports still line up.
+            if all(value is None for value in row):
+                blank += 1
+                continue
+            for item in [(None,) * width] * blank + [row]:
+                chunk.append(item)
+                if len(chunk) == chunk_rows:
+                    yield pd.DataFrame.from_records(chunk, columns=columns)
+                    chunk = []
+            blank = 0
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+COLUMNS_FILE = "columns.json"
+
+
+def chunk_path(spool_dir: str, index: int) -> str:
+    return os.path.join(spool_dir, f"{index:06d}.pkl")
+
+
+def _write_columns(spool_dir: str, columns: List[str]) -> None:
+    path = os.path.join(spool_dir, COLUMNS_FILE)
+    with open(path + ".tmp", "w") as out:
+        json.dump(columns, out)
+    os.replace(path + ".tmp", path)
+
+
+# Parse the uploaded file and spool it as pickled chunks of `chunk_rows` rows, each
+# moved into place under its index once complete, so the parent can hand it to
+# another worker while the rest of the file is parsed (see imports.ChunkSpool). The
+# file's columns land in COLUMNS_FILE before the first chunk. Returns the number of
+# chunks. CSV `text_columns` are read as strings, so codes like 00123 keep their
+# leading zeros.
+def split_file(path: str, filename: str, spool_dir: str, chunk_rows: int, text_columns: Sequence[str] = ()) -> int:
+    if filename.endswith(".csv"):
+        frames = pd.read_csv(path, chunksize=chunk_rows, dtype={col_name: str for col_name in text_columns})
+    else:
+        frames = read_xlsx_chunks(path, chunk_rows)
+
+    count = 0
+    for index, frame in enumerate(frames):
+        if index == 0:
+            _write_columns(spool_dir, [str(col_name) for col_name in frame.columns])
+        target = chunk_path(spool_dir, index)
+        frame.to_pickle(target + ".tmp", compression=None)
+        os.replace(target + ".tmp", target)
+        count += 1
+    if count == 0:
+        _write_columns(spool_dir, [])
+    return count
+
+
+#--------------Column coercion--------------#
+
+# Each chunk is converted column by column to the type its FieldModel declares,
+# so documents are stored with the BSON type the schema promises instead of
+# whatever pandas inferred (numpy scalars, floats for int columns with blanks).
+# Blank cells become None for every type and are not coercion failures; cells
+# that can't be converted are flagged in a boolean mask and the row is rejected.
+TRUE_VALUES = ("true", "t", "yes", "y", "1", "1.0")
+FALSE_VALUES = ("false", "f", "no", "n", "0", "0.0")
+BOOLEAN_VALUES = {**{value: True for value in TRUE_VALUES}, **{value: False for value in FALSE_VALUES}}
+INT64_MAX = 2 ** 63 - 1
+
+
+def _coerce_int(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    numbers = pd.to_numeric(column, errors="coerce").astype("Float64")
+    # Whole numbers only, within the range BSON long can hold
+    ok = numbers.notna() & (numbers % 1 == 0) & (numbers.abs() <= INT64_MAX)
+    ok = ok.fillna(False).astype(bool)
+    values = pd.Series(pd.NA, index=column.index, dtype="Int64")
+    values[ok] = numbers[ok].astype("Int64")
+    return values, ~ok
+
+
+def _coerce_float(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    values = pd.to_numeric(column, errors="coerce").astype("Float64")
+    # to_numeric turns infinities into floats too, which BSON can store
+    return values, values.isna()
+
+
+def _coerce_bool(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    values = column.astype(str).str.strip().str.lower().map(BOOLEAN_VALUES).astype("boolean")
+    return values, values.isna()
+
+
+def _coerce_str(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    # Numeric cells (XLSX stores numbers natively) are written back the way they'd be typed
+    if pd.api.types.is_float_dtype(column):
+        whole = (column % 1 == 0).fillna(False).astype(bool)
+        values = column.astype(str).astype("string")
+        values[whole] = column[whole].astype("int64").astype(str)
+        return values, pd.Series(False, index=column.index)
+    return column.astype("string"), pd.Series(False, index=column.index)
+
+
+def _coerce_list(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    # List cells are written as JSON (["a", "b"]) or the way a list prints; each
+    # distinct cell text is parsed once, like dict cells (see parse_dict_columns)
+    codes, cells = pd.factorize(column, use_na_sentinel=True)
+    parsed = [parse_list(cell) if isinstance(cell, str) else None for cell in cells.tolist()]
+    values = pd.Series(
+        [None if code < 0 or parsed[code] is None else list(parsed[code]) for code in codes.tolist()],
+        index=column.index, dtype=object,
+    )
+    return values, values.isna()
+
+
+COERCERS = {
+    "int": _coerce_int,
+    "float": _coerce_float,
+    "bool": _coerce_bool,
+    "str": _coerce_str,
+    "list": _coerce_list,
+}
+
+
+# Convert the schema's columns of `df` to their declared types. Returns the converted
+# frame and a mask with a column per coerced field, True where a non-blank cell
+# couldn't be converted. Missing columns and other types are left to row validation.
+def coerce_frame(df: pd.DataFrame, fields: List[FieldModel]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    coerced = df.copy()
+    failed = {}
+    for field in fields:
+        coerce = COERCERS.get(field.type) if isinstance(field.type, str) else None
+        if coerce is None or field.col_name not in df.columns:
+            continue
+        column = df[field.col_name]
+        blank = column.isna().to_numpy()
+        if pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):
+            # Whitespace-only text counts as blank
+            blank = blank | (column.astype(str).str.strip().eq("").to_numpy() & ~blank)
+            column = column.mask(blank)
+        values, bad = coerce(column)
+        coerced[field.col_name] = values.mask(bad | blank)
+        failed[field.col_name] = bad.to_numpy() & ~blank
+    return coerced, pd.DataFrame(failed, index=df.index)
+
+
+# Row offset -> coercion errors, for the rows with at least one failed cell
+def coercion_errors(failed: pd.DataFrame) -> Dict[int, List[str]]:
+    if failed.empty:
+        return {}
+    mask = failed.to_numpy()
+    rows, cols = np.nonzero(mask)
+    errors: Dict[int, List[str]] = {}
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        errors.setdefault(row, []).append(f"Invalid type for {failed.columns[col]}")
+    return errors
+
+
+#--------------Dict and list columns--------------#
+
+# Dict and list cells are written either as JSON or in Python notation
+# ({'city': 'Chennai'}, ['a', 'b']), the way they print. Each distinct cell text in a column is parsed once per
+# chunk, since exports repeat the same nested values across many rows.
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _loads_quoted(text: str) -> Any:
+    # Python notation with JSON literals ({'open': true}), accepted by earlier imports
+    return _json_loads(text.replace("'", '"'))
+
+
+# The `kind` (dict or list) written in `text`, None when it isn't one in either
+# notation. Without double quotes in the text, swapping the quotes is exact and much
+# faster than literal_eval; with them it could merge strings, so it's only the last resort.
+def _parse_cell(text: str, kind: type) -> Any:
+    parsers = (_json_loads, ast.literal_eval, _loads_quoted) if '"' in text else (_json_loads, _loads_quoted, ast.literal_eval)
+    for loads in parsers:
+        try:
+            value = loads(text)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            continue
+        return value if isinstance(value, kind) else None
+    return None
+
+
+def parse_dict(text: str) -> Optional[Dict[str, Any]]:
+    return _parse_cell(text, dict)
+
+
+def parse_list(text: str) -> Optional[List[Any]]:
+    return _parse_cell(text, list)
+
+
+# Parse the chunk's dict columns. Returns col_name -> parsed value per row and
+# row offset -> errors. Blank cells are None, and an error when `validate` is set;
+# validated imports also reject keys missing from the field's dict_keys.
+def parse_dict_columns(df: pd.DataFrame, fields: List[FieldModel], validate: bool) -> Tuple[Dict[str, List[Any]], Dict[int, List[str]]]:
+    values: Dict[str, List[Any]] = {}
+    errors: Dict[int, List[str]] = {}
+    for field in fields:
+        if field.type != "dict" or field.col_name not in df.columns:
+            continue
+        col_name = field.col_name
+        known = set(field.dict_keys) if validate and field.dict_keys else None
+        codes, cells = pd.factorize(df[col_name], use_na_sentinel=True)
+
+        parsed: List[Optional[Dict[str, Any]]] = []
+        cell_errors: List[List[str]] = []
+        for cell in cells.tolist():
+            value = cell if isinstance(cell, dict) else parse_dict(cell) if isinstance(cell, str) else None
+            parsed.append(value)
+            if value is None:
+                cell_errors.append([f"Invalid JSON format for column: {col_name}"])
+            elif known is not None and not value.keys() <= known:
+                cell_errors.append([f"Invalid key for {col_name}: {key}" for key in sorted(value.keys() - known)])
+            else:
+                cell_errors.append([])
+        blank_errors = [f"Invalid JSON format for column: {col_name}"] if validate else []
+
+        column = []
+        used = bytearray(len(cells))
+        for offset, code in enumerate(codes.tolist()):
+            if code < 0:
+                column.append(None)
+                cell_error = blank_errors
+            else:
+                # Repeated cells share one parse, later rows get their own copy
+                value = parsed[code]
+                if used[code] and value is not None:
+                    value = dict(value)
+                used[code] = 1
+                column.append(value)
+                cell_error = cell_errors[code]
+            if cell_error:
+                errors.setdefault(offset, []).extend(cell_error)
+        values[col_name] = column
+    return values, errors
+
+
+#--------------Row preparation--------------#
+
+def _check_record(record: Dict[str, Any], fields: List[FieldModel]) -> Tuple[Dict[str, Any], List[str]]:
+    item_data: Dict[str, Any] = {}
+    error_details = []
+    for field in fields:
+        col_name = field.col_name
+        if col_name not in record:
+            error_details.append(f"Missing column: {col_name}")
+            continue
+        # Nested dictionaries are parsed and checked column-wise, see parse_dict_columns
+        if field.type == "dict":
+            continue
+        value = record[col_name]
+        # Validate field with allowed values if the key exists (every item, for lists)
+        if field.allowed_values is not None:
+            if field.type == "list":
+                if isinstance(value, list) and any(item not in field.allowed_values for item in value):
+                    error_details.append(f"Invalid value for {col_name}")
+            elif value not in field.allowed_values:
+                error_details.append(f"Invalid value for {col_name}")
+        item_data[col_name] = value
+    return item_data, error_details
+
+
+# Prepare one spooled chunk: `start` is the file position of its first row. Validated
+# imports check every row against the schema; trusted imports only coerce types and
+# parse dict cells, and leave the rest to the collection validator. Uniqueness is
+# checked by the caller.
+def prepare_chunk(
+    chunk_path: str,
+    start: int,
+    fields: List[FieldModel],
+    validate: bool,
+    schema_version: int,
+    modified_date: str,
+) -> Dict[str, Any]:
+    raw = pd.read_pickle(chunk_path)
+    os.remove(chunk_path)
+    df, failed = coerce_frame(raw, fields)
+    type_errors = coercion_errors(failed)
+    dict_values, dict_errors = parse_dict_columns(df, fields, validate)
+    if "modified_date" in df.columns:
+        df["modified_date"] = modified_date
+
+    documents = []
+    positions = []
+    invalid = []
+    for offset, record in enumerate(_records(df)):
+        errors = type_errors.get(offset, []) + dict_errors.get(offset, [])
+        if validate:
+            document, check_errors = _check_record(record, fields)
+            errors += check_errors
+        else:
+            document = record
+        if errors:
+            # Report the cells as uploaded, not the blanks they were coerced to
+            if offset in type_errors:
+                record = _records(raw.iloc[offset:offset + 1])[0]
+            invalid.append((start + offset, record, errors))
+            continue
+        for col_name, column in dict_values.items():
+            document[col_name] = column[offset]
+        document["modified_date"] = modified_date
+        document[SEARCH_KEYS_FIELD] = search_keys(fields, document)
+        document[SCHEMA_VERSION_FIELD] = schema_version
+        documents.append(document)
+        positions.append(start + offset)
+    return {"documents": documents, "positions": positions, "invalid": invalid}
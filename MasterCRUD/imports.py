@@ -0,0 +1,410 @@
+
+#--------------Import write modes--------------#
+
+# Imports either insert every row (the default) or upsert/replace rows keyed on the
+# schema's first unique field, so re-uploading a refreshed masterlist updates it in place.
+# Duplicates inside the file are caught with a hash set before the database is touched.
+import asyncio
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Sequence, Tuple
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from models import FieldModel
+from validators import BSON_TYPES
+from facets import apply_facet_deltas, facet_deltas, facet_fields
+import import_worker
+
+logger = logging.getLogger("masterlist.imports")
+
+IMPORT_MODES = ("insert", "upsert", "replace")
+KEY_INDEX_PREFIX = "import_key_"
+
+
+def unique_fields(fields: List[FieldModel]) -> List[str]:
+    return [field.col_name for field in fields if field.unique]
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+# Unique index on the field upserts are keyed on, so concurrent imports can't both
+# insert the same key. Only values of the field's type are indexed, leaving out
+# documents without one. A collection that already holds duplicates keeps working
+# without the index until they are cleaned up.
+async def ensure_key_index(lcollection, fields: List[FieldModel]) -> None:
+    keys = unique_fields(fields)
+    key_name = keys[0] if keys else None
+    name = f"{KEY_INDEX_PREFIX}{key_name}"
+    partial = None
+    if key_name is not None:
+        key_type = next(field.type for field in fields if field.col_name == key_name)
+        # Partial indexes take a single $type, "number" covers every numeric BSON type
+        if key_type in ("int", "float"):
+            partial = {key_name: {"$type": "number"}}
+        elif key_type in BSON_TYPES:
+            partial = {key_name: {"$type": BSON_TYPES[key_type][0]}}
+        else:
+            partial = {key_name: {"$exists": True}}
+
+    # Drop the index of a previous key field, or of the same field under another type
+    indexes = await lcollection.list_indexes().to_list(length=None)
+    for index in indexes:
+        if index["name"].startswith(KEY_INDEX_PREFIX) and (index["name"] != name or index.get("partialFilterExpression") != partial):
+            await lcollection.drop_index(index["name"])
+    if key_name is None:
+        return
+    try:
+        await lcollection.create_index([(key_name, ASCENDING)], name=name, unique=True, partialFilterExpression=partial)
+    except OperationFailure as exc:
+        # 11000: the collection already holds duplicate keys
+        if exc.code != 11000:
+            raise
+        logger.warning("No unique index on %s.%s: %s", lcollection.name, key_name, exc)
+
+
+# Remembers the unique values seen so far in a file, so a repeated value is caught
+# with a set lookup before any database traffic. Fed batch by batch in file order.
+class DuplicateTracker:
+    def __init__(self, keys: List[str]):
+        self.seen: Dict[str, set] = {name: set() for name in keys}
+
+    # Errors for a document repeating an earlier unique value, empty when it is new
+    def check(self, document: Dict[str, Any]) -> List[str]:
+        errors = []
+        values = []
+        for name, seen in self.seen.items():
+            value = document.get(name)
+            if value is None or not isinstance(value, Hashable):
+                continue
+            if value in seen:
+                errors.append(f"Duplicate {name} in file")
+            values.append((seen, value))
+        if not errors:
+            for seen, value in values:
+                seen.add(value)
+        return errors
+
+
+# Upsert (or replace) documents keyed on the first unique field, in unordered
+# bulk_write batches. Returns the insert/update counts and the (position, error) of
+# rejected documents. A document is rejected when its key is blank, when one of its
+# other unique values belongs to a different stored document, or when the collection
+# validator refuses it.
+# `retired` fields (see migrations.retired_fields) are unset by upserts, so a stored
+# document still at an older version ends up with only the current fields.
+async def upsert_documents(
+    lcollection,
+    facets_collection,
+    schema_name: str,
+    fields: List[FieldModel],
+    documents: List[Dict[str, Any]],
+    replace: bool = False,
+    batch_size: int = 1000,
+    retired: Sequence[str] = (),
+) -> Tuple[Dict[str, int], List[Tuple[int, str]]]:
+    keys = unique_fields(fields)
+    key_name = keys[0]
+    projection = {name: 1 for name in keys + [field.col_name for field in facet_fields(fields)]}
+    counts = {"inserted": 0, "updated": 0}
+    errors: List[Tuple[int, str]] = []
+
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+
+        # One query per batch for every stored document sharing a unique value with the batch
+        stored: Dict[Any, Dict[str, Any]] = {}
+        holders: Dict[str, Dict[Any, Any]] = {name: {} for name in keys}
+        query = {"$or": [{name: {"$in": list({document.get(name) for document in batch})}} for name in keys]}
+        async for existing in lcollection.find(query, projection):
+            stored[existing.get(key_name)] = existing
+            for name in keys:
+                holders[name][existing.get(name)] = existing["_id"]
+
+        operations = []
+        positions = []
+        deltas: List[Counter] = []
+        for offset, document in enumerate(batch):
+            # A blank key would select (and overwrite) the one stored document without a key
+            if _blank(document.get(key_name)):
+                errors.append((start + offset, f"{key_name} is required to match rows on"))
+                continue
+            target = stored.get(document.get(key_name))
+            target_id = target["_id"] if target is not None else None
+            conflict = next((name for name in keys[1:] if holders[name].get(document.get(name), target_id) != target_id), None)
+            if conflict:
+                errors.append((start + offset, f"{conflict} must be unique"))
+                continue
+            selector = {key_name: document.get(key_name)}
+            if replace:
+                operations.append(ReplaceOne(selector, document, upsert=True))
+            else:
+                update = {"$set": document}
+                unset = {name: "" for name in retired if name not in document}
+                if unset:
+                    update["$unset"] = unset
+                operations.append(UpdateOne(selector, update, upsert=True))
+            positions.append(start + offset)
+            deltas.append(facet_deltas(fields, target, document))
+
+        if not operations:
+            continue
+        failed = set()
+        try:
+            result = await lcollection.bulk_write(operations, ordered=False)
+            counts["inserted"] += result.upserted_count
+            counts["updated"] += result.matched_count
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                failed.add(error["index"])
+                errors.append((positions[error["index"]], error.get("errmsg", "Rejected by the database")))
+            counts["inserted"] += exc.details.get("nUpserted", 0)
+            counts["updated"] += exc.details.get("nMatched", 0)
+
+        total: Counter = Counter()
+        for index, delta in enumerate(deltas):
+            if index not in failed:
+                total.update(delta)
+        await apply_facet_deltas(facets_collection, schema_name, total)
+
+    errors.sort()
+    return counts, errors
+
+
+#--------------Process pool--------------#
+
+# Parsing and validation run in a bounded pool of worker processes (see
+# import_worker), so a large upload doesn't stall the event loop. Workers are
+# spawned rather than forked, the parent has driver threads running.
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def import_executor(workers: int) -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+# Drop a pool a worker died in (OOM, a crash in a parser); the next import starts a fresh one
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_import_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# How often to look for chunks the splitting worker has finished
+SPOOL_POLL = 0.02
+
+
+# The chunks of an upload being split by a worker (import_worker.split_file), picked
+# up as each one lands in the spool directory
+class ChunkSpool:
+    def __init__(self, future: asyncio.Future, spool_dir: str, executor: ProcessPoolExecutor):
+        self.future = future
+        self.spool_dir = spool_dir
+        self.executor = executor
+        self.next_index = 0
+        # An abandoned split's error is of no interest, don't log it as unretrieved
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    # Paths of the chunks that landed since the last call, in file order
+    def ready(self) -> List[str]:
+        paths = []
+        while os.path.exists(path := import_worker.chunk_path(self.spool_dir, self.next_index)):
+            paths.append(path)
+            self.next_index += 1
+        return paths
+
+    # Whether the split is over and every chunk was picked up; raises what the split raised
+    def finished(self) -> bool:
+        return self.future.done() and self.future.result() == self.next_index
+
+    async def columns(self) -> List[str]:
+        path = os.path.join(self.spool_dir, import_worker.COLUMNS_FILE)
+        try:
+            while not os.path.exists(path):
+                if self.future.done():
+                    # Written before the split returns
+                    self.future.result()
+                    break
+                await asyncio.wait([self.future], timeout=SPOOL_POLL)
+        except BrokenProcessPool:
+            _discard_executor(self.executor)
+            raise
+        with open(path) as source:
+            return json.load(source)
+
+
+# Start splitting the file in a worker process into chunks spooled under `spool_dir`
+def start_split(
+    path: str, filename: str, spool_dir: str, chunk_rows: int, workers: int, fields: Sequence[FieldModel] = (),
+) -> ChunkSpool:
+    loop = asyncio.get_running_loop()
+    text_columns = [field.col_name for field in fields if field.type in ("str", "dict")]
+    executor = import_executor(workers)
+    try:
+        future = loop.run_in_executor(executor, import_worker.split_file, path, filename, spool_dir, chunk_rows, text_columns)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise
+    return ChunkSpool(future, spool_dir, executor)
+
+
+# Prepare the chunks across the pool as the split produces them and yield the
+# results in file order. At most two chunks per worker are in flight, which bounds
+# the memory held here.
+async def prepared_batches(
+    spool: ChunkSpool,
+    chunk_rows: int,
+    fields: List[FieldModel],
+    validate: bool,
+    schema_version: int,
+    modified_date: str,
+    workers: int,
+) -> AsyncIterator[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    executor = spool.executor
+    landed: List[str] = []
+    pending: List[asyncio.Future] = []
+    submitted = 0
+    try:
+        while True:
+            landed += spool.ready()
+            while landed and len(pending) < workers * 2:
+                pending.append(loop.run_in_executor(
+                    executor, import_worker.prepare_chunk,
+                    landed.pop(0), submitted * chunk_rows, fields, validate, schema_version, modified_date,
+                ))
+                submitted += 1
+            if pending and pending[0].done():
+                yield pending.pop(0).result()
+                continue
+            if not pending and not landed and spool.finished():
+                return
+            # Until the oldest chunk is prepared or the split ends, checking for new chunks meanwhile
+            waiting = [future for future in (pending[:1] + [spool.future]) if not future.done()]
+            if waiting:
+                await asyncio.wait(waiting, timeout=SPOOL_POLL, return_when=asyncio.FIRST_COMPLETED)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+#--------------Import error reports--------------#
+
+# Invalid rows are streamed to a CSV file as they are found instead of being
+# collected into the response. The report is downloaded by import ID until it
+# expires; the response itself only carries counts and a few samples. Rows are
+# checked in several passes (parsing, in-file duplicates, the database), so the
+# report lists them in the order they were found with their file row number, while
+# the samples are always the lowest-numbered invalid rows, in row order.
+IMPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+SAMPLE_SIZE = 5
+
+
+class ImportErrorReport:
+    def __init__(self, directory: str, columns: Sequence[str], sample_size: int = SAMPLE_SIZE):
+        self.import_id = uuid.uuid4().hex
+        self.path = os.path.join(directory, f"{self.import_id}.csv")
+        self.columns = list(columns)
+        self.sample_size = sample_size
+        self.count = 0
+        self.samples: List[Dict[str, Any]] = []
+        self._file = None
+        self._writer = None
+
+    # `row` is the 1-based data row in the uploaded file (the header line not counted)
+    def add(self, row: int, data: Dict[str, Any], errors: List[str]) -> None:
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["row", "errors", *self.columns])
+        values = {col_name: _clean(data.get(col_name)) for col_name in self.columns}
+        self._writer.writerow([row, "; ".join(errors), *(_cell(value) for value in values.values())])
+        self.count += 1
+        if len(self.samples) < self.sample_size or row < self.samples[-1]["row"]:
+            self.samples.append({"row": row, "errors": errors, "data": values})
+            self.samples.sort(key=lambda sample: sample["row"])
+            del self.samples[self.sample_size:]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summary(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {"invalid_count": self.count, "invalid_samples": self.samples}
+        if self.count:
+            summary["import_id"] = self.import_id
+        return summary
+
+
+def _clean(value: Any) -> Any:
+    # Empty cells come back from pandas as NaN, and numbers as numpy scalars
+    if isinstance(value, float) and value != value:
+        return None
+    if hasattr(value, "item") and not isinstance(value, (dict, list, str)):
+        return value.item()
+    return value
+
+
+def _cell(value: Any) -> Any:
+    # Nested values are written back the way they are uploaded
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return "" if value is None else value
+
+
+# Path of a stored report, None when the ID is malformed, unknown or expired
+def report_path(directory: str, import_id: str, ttl: int) -> Optional[str]:
+    if not IMPORT_ID.match(import_id):
+        return None
+    path = os.path.join(directory, f"{import_id}.csv")
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            os.remove(path)
+            return None
+    except OSError:
+        return None
+    return path
+
+
+# Remove reports older than `ttl` seconds
+def purge_reports(directory: str, ttl: int) -> int:
+    removed = 0
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.endswith(".csv") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -3,25 +3,145 @@
 
 
 # Import necessary modules and libraries
-from typing import List, Dict, Any, Union, Optional, Type
-from fastapi import FastAPI, HTTPException, Body, Query,File, UploadFile
-from pydantic import BaseModel, create_model
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import List, Dict, Any, Optional, Type, Tuple
+from fastapi import FastAPI, HTTPException, Body, Query,File, UploadFile, Header, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError, create_model
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from contextlib import asynccontextmanager
+from functools import partial
+from datetime import datetime, timedelta
 from bson import ObjectId
 import pandas as pd
 import json
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import tempfile
+import shutil
+import os
+import database
+import metrics
+from db_tracing import DbTracingMiddleware
+from config import settings
+from database import MASTERLIST, get_collection
+from models import FieldModel, SchemaModel, FilterData, FilterItem
+from cache import TTLCache
+from stats import compute_stats
+from search import SEARCH_KEYS_FIELD, backfill_search_keys, ensure_search_indexes, prefix_search, search_keys, string_fields, text_search
+from facets import FACETS, apply_facet_deltas, ensure_facet_indexes, facet_counts, facet_deltas, facet_fields, read_facets, reconcile_facets
+from validators import apply_validator, compile_json_schema, document_errors
+from migrations import MIGRATIONS, SCHEMA_VERSION_FIELD, create_migration, ensure_migration_indexes, pending_migrations, plan_migration, retired_fields, start_migrations, upgrade_document, upgrade_stored_document, version_query
+from imports import IMPORT_MODES, DuplicateTracker, ImportErrorReport, ensure_key_index, prepared_batches, purge_reports, report_path, shutdown_import_executor, start_split, unique_fields, upsert_documents
+from uploads import UploadError, assemble, create_session, load_session, purge_sessions, received_chunks, remove_session, write_chunk
+from tenancy import DEFAULT_TENANT, TenantMiddleware, TenantSchemaCache, current_tenant, report_storage
+from changes import MODIFIED_AT_FIELD, TOMBSTONES, WatermarkError, backfill_modified_at, data_version, ensure_change_indexes, ensure_tombstone_indexes, read_changes, record_deletes, stamp, stamp_after
+from events import EventHub, SubscriberLimitError, detect_source
+from export_cache import ExportCache
+from content_encoding import ENCODINGS, encoder, json_array_response, negotiate
+from snapshots import RAW_OPTIONS, SNAPSHOT_EXTENSIONS, SnapshotError, open_snapshot, read_batches, read_header, snapshot_header, snapshot_stream
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+
+# Create the MongoDB client on startup, generate the schema routes and close the client on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect(settings)
+    event_hub.source = await detect_source(database.get_database(DEFAULT_TENANT), settings.events_source)
+    tenants = [DEFAULT_TENANT, *settings.tenants]
+    for tenant in tenants:
+        # Background jobs started here (migrations, backfills) keep the tenant's context
+        token = current_tenant.set(tenant)
+        try:
+            await ensure_facet_indexes(get_collection(FACETS))
+            await ensure_migration_indexes(get_collection(MIGRATIONS))
+            await ensure_tombstone_indexes(get_collection(TOMBSTONES), settings.tombstone_ttl)
+            await setup_routes()
+        finally:
+            current_tenant.reset(token)
+    storage_reporter = None
+    if settings.tenant_stats_interval:
+        storage_reporter = asyncio.create_task(report_storage(tenants, database.get_database, settings.tenant_stats_interval))
+    yield
+    if storage_reporter is not None:
+        storage_reporter.cancel()
+    shutdown_import_executor()
+    database.close()
+
+# Internal bookkeeping fields that are never returned to clients
+HIDDEN_FIELDS = {SEARCH_KEYS_FIELD: 0, MODIFIED_AT_FIELD: 0}
+
+# Collections the app keeps its own data in, and the marker of a restore's staging
+# collection; neither can be used as a schema name
+INTERNAL_COLLECTIONS = {MASTERLIST, FACETS, MIGRATIONS, TOMBSTONES}
+RESTORE_STAGING = "__restore_"
+
+def reserved_schema_name(name: str) -> bool:
+    return name in INTERNAL_COLLECTIONS or name.startswith("system.") or RESTORE_STAGING in name
+
+# Keep references to background jobs so they aren't garbage collected mid-run
+background_tasks = set()
+
+def run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Unfinished migrations per (tenant, schema), used to upgrade old documents on read
+schema_upgraders: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+
+# Bring a stored document to the current schema version and drop the version stamp
+def prepare_document(schema_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    upgraders = schema_upgraders.get((current_tenant.get(), schema_name))
+    if upgraders and (document.get(SCHEMA_VERSION_FIELD) or 1) < upgraders[-1]["to_version"]:
+        upgrade_document(document, upgraders)
+    document.pop(SCHEMA_VERSION_FIELD, None)
+    return document
+
+# A stored document as sent in live events
+def event_document(schema_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    document = {key: value for key, value in document.items() if key not in (SEARCH_KEYS_FIELD, MODIFIED_AT_FIELD)}
+    document["_id"] = str(document["_id"])
+    return prepare_document(schema_name, document)
+
+# Live change events behind /{schema_name}/events
+event_hub = EventHub(settings.events_history, settings.events_max_subscribers, event_document, [SEARCH_KEYS_FIELD, MODIFIED_AT_FIELD, SCHEMA_VERSION_FIELD])
+
+# Tell the current tenant's subscribers about a write (see events.py for when this is a no-op)
+def publish_event(schema_name: str, event: str, data: Dict[str, Any]) -> None:
+    event_hub.publish_local((current_tenant.get(), schema_name), event, data)
+
+# Documents from a cursor as they are returned to clients
+async def response_items(schema_name: str, cursor):
+    async for document in cursor:
+        document["_id"] = str(document["_id"])
+        yield prepare_document(schema_name, document)
+
+# Per-schema statistics are cached briefly since dashboards poll them, keyed by (tenant, schema)
+stats_cache = TTLCache(ttl=settings.stats_cache_ttl)
+
+# Schema definitions and their request models, per tenant
+schema_cache = TenantSchemaCache()
+
+# Pydantic model that request bodies for a schema are validated with
+def schema_request_model(schema: SchemaModel) -> Type[BaseModel]:
+    return create_model(schema.schema_name, **{field.col_name: (field.type, ...) for field in schema.fields})
+
+# Schema definition and request model for the current tenant, 404 when the tenant doesn't have the schema
+async def get_tenant_schema(schema_name: str) -> Tuple[SchemaModel, Type[BaseModel]]:
+    entry = schema_cache.get(schema_name)
+    if entry is None:
+        schema_data = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
+        if not schema_data:
+            raise HTTPException(status_code=404, detail="Schema not found")
+        schema = SchemaModel(**schema_data)
+        entry = (schema, schema_request_model(schema))
+        schema_cache.set(schema_name, *entry)
+    return entry
 
 # Initialize FastAPI app
-app = FastAPI(title="MASTERLIST")
-
-# Initialize MongoDB client and database
-client = AsyncIOMotorClient("mongodb://localhost:27017/")
-db = client["databasename"]
-collection = db["masterlist"]
+app = FastAPI(title="MASTERLIST", lifespan=lifespan)
 
 # Add CORS middleware for cross-origin resource sharing
 app.add_middleware(
@@ -32,29 +152,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-#--------------Basemodels--------------#
-
-# Define Pydantic models for database schema and fields
-class FieldModel(BaseModel):
-    col_name: str
-    type: Union[str, int, float, bool, Dict[str, Any]]
-    unique: Optional[bool]
-    allowed_values: Optional[List[str]] = None
-    dict_keys: Optional[Dict[str, str]] = None
-
-class SchemaModel(BaseModel):
-    schema_name: str
-    fields: List[FieldModel]
-
-class FilterData(BaseModel):
-    filter: str
+# Attribute database round trips to each request (X-DB-Calls / X-DB-Time headers)
+app.add_middleware(DbTracingMiddleware, call_budget=settings.db_call_budget)
 
-class FilterItem:
-    def __init__(self, field: str, value: str):
-        self.field = field
-        self.value = value
+# Record request counts, latency and errors per route template and schema
+app.add_middleware(metrics.MetricsMiddleware)
 
-    
+# Route each request to its tenant's database (outermost, so the /t/{tenant} prefix is
+# stripped before routing and the tenant is set for everything below)
+app.add_middleware(TenantMiddleware, tenants=settings.tenants, header=settings.tenant_header)
 
 #--------------Adding a New Schema--------------#
 
@@ -71,11 +177,13 @@ async def add_schema(schema_data: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
     # Check for spaces in schema_name
     if " " in schema_name:
         raise HTTPException(status_code=400, detail="Schema name cannot contain spaces")
+    if reserved_schema_name(schema_name):
+        raise HTTPException(status_code=400, detail=f"'{schema_name}' is reserved and cannot be used as a schema name")
 
     fields = schema_data["fields"]
 
     # Check if schema with the same name already exists
-    existing_schema = await collection.find_one({"schema_name": schema_name})
+    existing_schema = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
     if existing_schema:
         raise HTTPException(status_code=400, detail="Schema with the same name already exists")
 
@@ -97,7 +205,10 @@ async def add_schema(schema_data: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
         "fields": processed_fields,
         "created_at": datetime.now().strftime("%d/%m/%Y")
     }
-    await collection.insert_one(schema_dict)
+    await get_collection(MASTERLIST).insert_one(schema_dict)
+
+    # Create the collection with its validator and search indexes, and serve it right away
+    await generate_routes_from_schema(SchemaModel(**schema_dict))
 
     return {"message": "Schema added successfully"}
 
@@ -107,25 +218,41 @@ async def add_schema(schema_data: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
 
 # Route to replace fields in a schema
 @app.put("/replacefields/{schema_name}", tags=["Common routes"])
-async def replace_schema_fields(schema_name: str, new_fields: List[Dict[str, Any]]) -> Dict[str, str]:
+async def replace_schema_fields(schema_name: str, new_fields: List[Dict[str, Any]]) -> Dict[str, Any]:
     # Check if the schema exists
-    existing_schema = await collection.find_one({"schema_name": schema_name})
+    existing_schema = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
     if not existing_schema:
         # If schema does not exist, raise an HTTPException
         raise HTTPException(status_code=404, detail="Schema not found")
+    # Work out how existing documents change (renamed_from / default on the new fields)
+    stored_fields, plan = plan_migration(existing_schema["fields"], new_fields)
+    old_version = existing_schema.get("version", 1)
+    new_version = old_version + 1
+
     # Prepare the new schema data
     new_schema_data = {
         "schema_name": schema_name,
         "created_at": datetime.now().strftime("%d/%m/%Y"),
-        "fields": new_fields
+        "fields": stored_fields,
+        "version": new_version
     }
     # Replace the existing schema with the new schema data
-    await collection.replace_one(
+    await get_collection(MASTERLIST).replace_one(
         {"schema_name": schema_name},
         new_schema_data
     )
+    # Record the migration; the background migrator rewrites old documents in batches
+    total = await get_collection(schema_name).count_documents({SCHEMA_VERSION_FIELD: version_query(old_version)})
+    await create_migration(get_collection(MIGRATIONS), schema_name, old_version, new_version, plan, total)
+
+    # Serve the new field list right away instead of after a restart; this also
+    # installs the new validator and search indexes and starts the migrator
+    stats_cache.invalidate((current_tenant.get(), schema_name))
+    await prepare_schema(SchemaModel(**new_schema_data))
+    publish_event(schema_name, "reload", {"reason": "schema", "version": new_version})
+
     # Return a success message
-    return {"message": f"Schema '{schema_name}' fields replaced successfully"}
+    return {"message": f"Schema '{schema_name}' fields replaced successfully", "version": new_version}
 
 
 #--------------Generate routing for adding data inside schema--------------#
@@ -134,7 +261,7 @@ async def replace_schema_fields(schema_name: str, new_fields: List[Dict[str, Any
 async def get_schemas() -> List[SchemaModel]:
     schemas = []
     # Iterate over documents in the collection
-    async for document in collection.find({}):
+    async for document in get_collection(MASTERLIST).find({}):
         # Convert each document to a SchemaModel object and append to the list
         schema = SchemaModel(**document)
         schemas.append(schema)
@@ -148,53 +275,163 @@ async def setup_routes():
     for schema in schemas:
         await generate_routes_from_schema(schema)
 
-# Add event handler to set up routes on startup
-app.add_event_handler("startup", setup_routes)
+# Refresh data derived from documents once a migration has rewritten them
+async def after_migration(schema_name: str) -> None:
+    schema_upgraders[(current_tenant.get(), schema_name)] = await pending_migrations(get_collection(MIGRATIONS), schema_name)
+    schema_data = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
+    if schema_data:
+        field_models = SchemaModel(**schema_data).fields
+        await backfill_search_keys(get_collection(schema_name), field_models, rebuild=True)
+        await reconcile_facets(get_collection(schema_name), get_collection(FACETS), schema_name, field_models)
+        publish_event(schema_name, "reload", {"reason": "migration"})
 
 # Function to find an existing item in a schema
 async def find_existing_item(schema_name: str, col_name: str, value: Any) -> Optional[Dict[str, Any]]:
     # Find an item in the schema collection by column name and value
-    item = await collection.find_one({col_name: value})
+    item = await get_collection(MASTERLIST).find_one({col_name: value})
     return item
 
+# Schema names whose routes are registered; the routes are shared by all tenants
+registered_schemas = set()
+
 # Function to generate routes for a given schema
 async def generate_routes_from_schema(schema: SchemaModel):
-    # Extract schema name and fields
+    await prepare_schema(schema)
+    if schema.schema_name not in registered_schemas:
+        registered_schemas.add(schema.schema_name)
+        metrics.known_schemas.add(schema.schema_name)
+        register_schema_routes(schema.schema_name)
+
+# Bring the current tenant's collection for a schema in line with its definition
+async def prepare_schema(schema: SchemaModel):
     schema_name = schema.schema_name
-    fields = {field.col_name: field for field in schema.fields}
+    schema_cache.invalidate(schema_name)
 
-    # Dynamically create a Pydantic model for the schema
-    CustomModel = create_model(schema_name, **{field.col_name: (field.type, ...) for field in fields.values()})
+    # Pick up unfinished migrations (e.g. after a restart) and keep migrating in the background
+    upgraders = schema_upgraders[(current_tenant.get(), schema_name)] = await pending_migrations(get_collection(MIGRATIONS), schema_name)
+    if upgraders:
+        start_migrations(get_collection(schema_name), get_collection(MIGRATIONS), schema_name, on_done=lambda: after_migration(schema_name))
 
+    # Keep the collection's validator in line with the stored definition
+    await apply_validator(database.get_database(), schema_name, schema.fields, settings.db_validation_action)
+
+    # Make sure the search indexes exist and documents written before them get search keys
+    await ensure_search_indexes(get_collection(schema_name), schema.fields)
+    run_in_background(backfill_search_keys(get_collection(schema_name), schema.fields))
+
+    # Unique index on the key upsert/replace imports match rows on
+    await ensure_key_index(get_collection(schema_name), schema.fields)
+
+    # Index the modification stamps behind /export/{schema_name}/changes
+    await ensure_change_indexes(get_collection(schema_name))
+    run_in_background(backfill_modified_at(get_collection(schema_name)))
+
+    # Build the facet counters from scratch the first time a schema is served
+    if facet_fields(schema.fields) and not await get_collection(FACETS).find_one({"schema": schema_name}):
+        run_in_background(reconcile_facets(get_collection(schema_name), get_collection(FACETS), schema_name, schema.fields))
+
+# Register the routes for a schema. Handlers look the schema up for the request's
+# tenant, so one set of routes serves every tenant that has a schema of this name.
+def register_schema_routes(schema_name: str):
 
     @app.get(f"/{schema_name}/", response_model=List[Dict[str, Any]], tags=[schema_name])
-    async def get_items(page: int = Query(0, ge=0), page_size: int = Query(10, gt=0)) -> List[Dict[str, Any]]:
+    async def get_items(request: Request, page: int = Query(0, ge=0), page_size: int = Query(10, gt=0)) -> List[Dict[str, Any]]:
+        await get_tenant_schema(schema_name)
         # Pagination parameters
         skip = (page - 1) * page_size
         # Retrieve items from the schema collection
-        items_cursor = db[schema_name].find({}).skip(skip).limit(page_size)
-        # Convert cursor to list of items
-        items = await items_cursor.to_list(length=None)
-        # Convert ObjectId to string and include it in the response
-        for item in items:
-            item['_id'] = str(item['_id'])
-        return items
-
+        items_cursor = get_collection(schema_name).find({}, HIDDEN_FIELDS).skip(skip).limit(page_size)
+        # Stream the page, compressed when it is large and the client accepts it
+        return await json_array_response(
+            response_items(schema_name, items_cursor), request.headers.get("accept-encoding"),
+            settings.compress_min_bytes, settings.gzip_level, settings.zstd_level,
+        )
+
+
+    # Route to summarise the schema's data (registered before /{id} so "stats" isn't taken as an ID)
+    @app.get(f"/{schema_name}/stats", tags=[schema_name])
+    async def get_stats() -> Dict[str, Any]:
+        schema, _ = await get_tenant_schema(schema_name)
+        # The aggregation runs inside MongoDB, only the summary comes back
+        return await stats_cache.get_or_compute(
+            (current_tenant.get(), schema_name), lambda: compute_stats(get_collection(schema_name), schema_name, schema.fields)
+        )
+
+
+    # Route to search the schema's string fields, either ranked full-text or prefix (typeahead)
+    @app.get(f"/{schema_name}/search", tags=[schema_name])
+    async def search_items(
+        q: str = Query(..., min_length=1),
+        fields: Optional[str] = Query(None, description="Comma separated string fields to search, defaults to all (text mode only)"),
+        mode: str = Query("text", pattern="^(text|prefix)$"),
+        page: int = Query(1, gt=0),
+        page_size: int = Query(10, gt=0, le=100),
+    ) -> Dict[str, Any]:
+        schema, _ = await get_tenant_schema(schema_name)
+        prepare = partial(prepare_document, schema_name)
+        if mode == "prefix":
+            # Prefix keys are shared by all string fields, so they can't be narrowed to some
+            if fields:
+                raise HTTPException(status_code=400, detail="fields is not supported with mode=prefix")
+            return await prefix_search(get_collection(schema_name), q, page, page_size, HIDDEN_FIELDS, prepare)
+        subset = None
+        if fields:
+            subset = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = set(subset) - set(string_fields(schema.fields))
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Not searchable string fields: {', '.join(sorted(unknown))}")
+        return await text_search(get_collection(schema_name), q, subset, page, page_size, HIDDEN_FIELDS, prepare)
+
+
+    # Route to read the per-value counts of every allowed_values field
+    @app.get(f"/{schema_name}/facets", tags=[schema_name])
+    async def get_facets() -> Dict[str, Any]:
+        schema, _ = await get_tenant_schema(schema_name)
+        return await read_facets(get_collection(FACETS), schema_name, schema.fields)
+
+
+    # Route to rebuild the facet counters from the schema's documents
+    @app.post(f"/{schema_name}/facets/reconcile", tags=[schema_name])
+    async def rebuild_facets() -> Dict[str, Any]:
+        schema, _ = await get_tenant_schema(schema_name)
+        return await reconcile_facets(get_collection(schema_name), get_collection(FACETS), schema_name, schema.fields)
+
+
+    # Inserts, updates and deletes as server-sent events, instead of polling the list.
+    # Reconnecting clients resume after their Last-Event-ID; a "reload" event means
+    # events were missed or written in bulk and the list should be fetched again.
+    @app.get(f"/{schema_name}/events", tags=[schema_name])
+    async def stream_events(last_event_id: Optional[str] = Header(None)) -> StreamingResponse:
+        await get_tenant_schema(schema_name)
+        key = (current_tenant.get(), schema_name)
+        try:
+            subscriber = event_hub.subscribe(key, last_event_id, get_collection(schema_name))
+        except SubscriberLimitError as exc:
+            raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(settings.events_heartbeat)})
+        return StreamingResponse(
+            event_hub.stream(key, subscriber, settings.events_heartbeat),
+            media_type="text/event-stream",
+            # Keep proxies from buffering or caching the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
 
     # Route to get an item by ID for the specified schema
-    @app.get(f"/{schema_name}/{{id}}", response_model=CustomModel, tags=[schema_name])
-    async def get_item_by_id(id: str) -> CustomModel:
+    @app.get(f"/{schema_name}/{{id}}", tags=[schema_name])
+    async def get_item_by_id(id: str) -> Dict[str, Any]:
+        _, RequestModel = await get_tenant_schema(schema_name)
         # Find item by ID in the schema collection
-        item = await db[schema_name].find_one({"_id": ObjectId(id)})
+        item = await get_collection(schema_name).find_one({"_id": ObjectId(id)}, HIDDEN_FIELDS)
         if item:
-            return item
+            # Only the schema's fields are returned
+            return RequestModel(**prepare_document(schema_name, item)).dict()
         else:
             raise HTTPException(status_code=404, detail=f"Item not found for ID: {id}")
 
 
     @app.post(f"/{schema_name}/filters/", response_model=List[Dict[str, Any]], tags=[schema_name])
-    async def get_items_by_fields(filter_data: FilterData = Body(...)) -> List[Dict[str, Any]]:
+    async def get_items_by_fields(request: Request, filter_data: FilterData = Body(...)) -> List[Dict[str, Any]]:
+        await get_tenant_schema(schema_name)
         filter_str = filter_data.filter
         filter_items = parse_filter_string(filter_str)
         
@@ -202,163 +439,175 @@ async def generate_routes_from_schema(schema: SchemaModel):
         for item in filter_items:
             query[item.field] = item.value
 
-        items = []
-        async for document in db[schema_name].find(query):
-            document["_id"] = str(document["_id"])
-            items.append(document)
-
-        return items
+        # Matches can be the whole collection, stream them instead of building the list
+        return await json_array_response(
+            response_items(schema_name, get_collection(schema_name).find(query, HIDDEN_FIELDS)),
+            request.headers.get("accept-encoding"), settings.compress_min_bytes, settings.gzip_level, settings.zstd_level,
+        )
 
     @app.post(f"/{schema_name}/", tags=[schema_name])
-    async def add_item(item_data: CustomModel = Body(...)) -> Dict[str, Any]:
-            async def fetch_schema_definition(schema_name: str) -> SchemaModel:
-                # Fetch the schema definition from the database
-                schema_definition = await collection.find_one({"schema_name": schema_name})
-                if schema_definition:
-                    return SchemaModel(**schema_definition)
-                else:
-                    raise HTTPException(status_code=404, detail="Schema not found")
-
-            # Retrieve the schema definition
-            schema_definition = await fetch_schema_definition(schema_name)
+    async def add_item(item_data: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
+            # Retrieve the tenant's schema definition and validate the body with its model
+            schema_definition, RequestModel = await get_tenant_schema(schema_name)
+            try:
+                item_data = RequestModel(**item_data)
+            except ValidationError as exc:
+                raise RequestValidationError(exc.errors())
 
             # Add the "modified_date" field with the current date
             modified_date = datetime.now().strftime("%d/%m/%Y")
             item_data_dict = item_data.dict()
             item_data_dict["modified_date"] = modified_date
 
-            # Validate uniqueness constraints, allowed values, and dict field keys
+            # Validate uniqueness constraints
             for field in schema_definition.fields:
                 if field.unique:
-                    existing_item = await db[schema_name].find_one({field.col_name: item_data_dict[field.col_name]})
+                    existing_item = await get_collection(schema_name).find_one({field.col_name: item_data_dict[field.col_name]})
                     if existing_item:
                         raise HTTPException(status_code=400, detail=f"{field.col_name} must be unique")
 
-                if field.allowed_values:
-                    if item_data_dict[field.col_name] not in field.allowed_values:
-                        raise HTTPException(status_code=400, detail=f"Invalid value for {field.col_name}")
+            # Types, allowed values and dict keys are checked against the same rules as the collection validator
+            errors = document_errors(compile_json_schema(schema_definition.fields), item_data_dict)
+            if errors:
+                raise HTTPException(status_code=400, detail=errors[0])
 
-                if field.type == "dict" and field.dict_keys:
-                    field_value = item_data_dict.get(field.col_name, {})
-                    for key in field_value.keys():
-                        if key not in field.dict_keys:
-                            raise HTTPException(status_code=400, detail=f"Invalid key for {field.col_name}: {key}")
+            # Store the normalized keys used by prefix search and the schema version written under
+            item_data_dict[SEARCH_KEYS_FIELD] = search_keys(schema_definition.fields, item_data_dict)
+            item_data_dict[SCHEMA_VERSION_FIELD] = schema_definition.version
+            item_data_dict[MODIFIED_AT_FIELD] = stamp()
 
             # Insert the item data into the collection
-            await db[schema_name].insert_one(item_data_dict)
+            await get_collection(schema_name).insert_one(item_data_dict)
+            await apply_facet_deltas(get_collection(FACETS), schema_name, facet_deltas(schema_definition.fields, None, item_data_dict))
+            publish_event(schema_name, "insert", {"_id": str(item_data_dict["_id"]), "document": event_document(schema_name, item_data_dict)})
             return {"message": "Item added successfully"}
 
 
 
     @app.post(f"/{schema_name}/import", tags=[schema_name])
-    async def import_data(file: UploadFile = File(...)):
-        # Retrieve the schema definition
-        schema_definition = await collection.find_one({"schema_name": schema_name})
-        if not schema_definition:
-            raise HTTPException(status_code=404, detail="Schema not found")
-
-        # Read Excel or CSV file
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file.file)
-        elif file.filename.endswith('.xlsx'):
-            df = pd.read_excel(file.file)
-        else:
+    async def import_data(
+        file: UploadFile = File(...),
+        trusted: bool = Query(False, description="Skip row-by-row checks and let the collection validator reject bad rows"),
+        mode: str = Query("insert", pattern=f"^({'|'.join(IMPORT_MODES)})$", description="insert new rows, or upsert/replace rows keyed on the first unique field"),
+    ):
+        path = await asyncio.to_thread(save_upload, file)
+        try:
+            return await run_import(schema_name, file.filename, path, trusted, mode)
+        finally:
+            os.remove(path)
+
+
+    # Resumable upload: create a session, PUT numbered chunks, then commit to import the file
+    @app.post(f"/{schema_name}/uploads", tags=[schema_name])
+    async def create_upload(
+        filename: str = Body(..., embed=True),
+        size: Optional[int] = Body(None, embed=True, ge=0),
+    ) -> Dict[str, Any]:
+        await get_tenant_schema(schema_name)
+        if not filename.endswith(IMPORT_EXTENSIONS):
             raise HTTPException(status_code=400, detail="Only Excel (xlsx) or CSV files are allowed")
+        directory = upload_directory()
+        purge_sessions(directory, settings.upload_ttl)
+        session = create_session(directory, schema_name, filename, size, settings.upload_chunk_size)
+        return {"upload_id": session["upload_id"], "chunk_size": session["chunk_size"], "expires_in": settings.upload_ttl}
 
-        # Check if "modified_date" column exists in DataFrame
-        if "modified_date" in df.columns:
-            # Replace values in "modified_date" column with today's date
-            df["modified_date"] = datetime.now().strftime('%d/%m/%Y')
-
-        # Validate data against schema
-        valid_data = []
-        invalid_data = []
-        for _, row in df.iterrows():
-            item_data = {}
-            invalid_item = False
-            error_details = []
-
-            # Validate each field against schema
-            for field in schema_definition['fields']:
-                col_name = field['col_name']
-                if col_name not in row:
-                    invalid_item = True
-                    error_details.append(f"Missing column: {col_name}")
-                    continue
-
-                # Check if the field is a nested dictionary
-                if field['type'] == 'dict':
-                    try:
-                        item_data[col_name] = json.loads(row[col_name].replace("'", '"'))
-                    except json.JSONDecodeError:
-                        invalid_item = True
-                        error_details.append(f"Invalid JSON format for column: {col_name}")
-                else:
-                    # Validate field with allowed values if the key exists
-                    if 'allowed_values' in field and row[col_name] not in field['allowed_values']:
-                        invalid_item = True
-                        error_details.append(f"Invalid value for {col_name}")
-
-                    # Validate field with unique constraint
-                    if field.get('unique'):
-                        existing_item = await db[schema_name].find_one({col_name: row[col_name]})
-                        if existing_item:
-                            invalid_item = True
-                            error_details.append(f"{col_name} must be unique")
-
-                    # Validate dict field keys
-                    if field['type'] == 'dict' and field['dict_keys']:
-                        field_value = json.loads(row[col_name].replace("'", '"'))
-                        for key in field_value.keys():
-                            if key not in field['dict_keys']:
-                                invalid_item = True
-                                error_details.append(f"Invalid key for {col_name}: {key}")
-
-                    item_data[col_name] = row[col_name]
 
-            # Add the "modified_date" field with the current date
-            item_data["modified_date"] = datetime.now().strftime("%d/%m/%Y")
+    # Chunks already received, so an interrupted client knows what to send again
+    @app.get(f"/{schema_name}/uploads/{{upload_id}}", tags=[schema_name])
+    async def get_upload(upload_id: str) -> Dict[str, Any]:
+        session, session_dir = open_upload(schema_name, upload_id)
+        chunks = received_chunks(session_dir)
+        return {**session, "received": sorted(chunks), "received_bytes": sum(chunks.values())}
 
-            # If the item is valid, add it to valid_data, otherwise to invalid_data
-            if invalid_item:
-                invalid_data.append({"data": row.to_dict(), "errors": error_details})
-            else:
-                valid_data.append(item_data)
-
-        # Insert valid data into the collection
-        if valid_data:
-            await db[schema_name].insert_many(valid_data)
-        if len(invalid_data) == 0:
-            s = "All"
-        elif len(valid_data) == 0:
-            s = "No"
-        else:
-            s = "Some"
-        return {"message": f"{s} datas imported ", "invalid_data": invalid_data}
+
+    @app.put(f"/{schema_name}/uploads/{{upload_id}}/{{index}}", tags=[schema_name])
+    async def put_upload_chunk(upload_id: str, index: int, request: Request, x_chunk_sha256: Optional[str] = Header(None, description="Hex SHA-256 of the chunk, checked when sent")) -> Dict[str, Any]:
+        session, session_dir = open_upload(schema_name, upload_id)
+        try:
+            size = await write_chunk(session, session_dir, index, request.stream(), x_chunk_sha256)
+        except UploadError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        return {"index": index, "size": size}
+
+
+    @app.post(f"/{schema_name}/uploads/{{upload_id}}/commit", tags=[schema_name])
+    async def commit_upload(
+        upload_id: str,
+        total_chunks: int = Body(..., embed=True, gt=0),
+        sha256: Optional[str] = Body(None, embed=True, description="Hex SHA-256 of the whole file"),
+        trusted: bool = Query(False, description="Skip row-by-row checks and let the collection validator reject bad rows"),
+        mode: str = Query("insert", pattern=f"^({'|'.join(IMPORT_MODES)})$", description="insert new rows, or upsert/replace rows keyed on the first unique field"),
+    ) -> Dict[str, Any]:
+        session, session_dir = open_upload(schema_name, upload_id)
+        try:
+            path = await asyncio.to_thread(assemble, session, session_dir, total_chunks, sha256)
+        except UploadError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        try:
+            return await run_import(schema_name, session["filename"], path, trusted, mode)
+        finally:
+            remove_session(session_dir)
 
 
 
             
-    @app.post(f"/export/{schema_name}/", tags=[schema_name])
-    async def export_csv(date: str = Query(..., title="Date", description="Date in the format DD/MM/YYYY")):
+    # Export as CSV or JSON. Results are cached on disk until the schema's data changes,
+    # and served with Range support so interrupted downloads can resume.
+    # The file is compressed as it is written when the client accepts gzip or zstd, or
+    # downloaded as a .gz file with download=gzip.
+    @app.api_route(f"/export/{schema_name}/", methods=["GET", "POST"], tags=[schema_name])
+    async def export_csv(
+        request: Request,
+        date: Optional[str] = Query(None, title="Date", description="Only rows modified on this date (DD/MM/YYYY), all rows when left out"),
+        fields: Optional[str] = Query(None, description="Comma-separated columns to export, all columns when left out"),
+        format: str = Query("csv", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+        download: Optional[str] = Query(None, pattern="^gzip$", description="gzip: download a .gz file instead of the plain export"),
+    ):
+        schema, _ = await get_tenant_schema(schema_name)
+        columns = export_columns(schema, fields)
+        suffix = date.replace("/", "_") if date else "all"
+        filename = f"{schema_name}_{suffix}.{format}"
+        media_type = EXPORT_FORMATS[format]
+        headers = {"Vary": "Accept-Encoding"}
+        if download:
+            encoding = download
+            filename += ".gz"
+            media_type = "application/gzip"
+        else:
+            encoding = negotiate(request.headers.get("accept-encoding"))
+            if encoding:
+                headers["Content-Encoding"] = encoding
+
+        path, result = await export_file(schema, date, columns, format, encoding)
+        metrics.EXPORT_CACHE.inc((schema_name, result))
+        metrics.EXPORT_BYTES.inc((schema_name,), os.path.getsize(path))
+        headers["X-Export-Cache"] = result
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers, background=BackgroundTask(os.remove, path))
+
+
+    # Inserts, updates and deletes after a watermark, for mirrors that sync incrementally.
+    # Start without `since` for a full sync, then pass back the returned watermark.
+    @app.get(f"/export/{schema_name}/changes", tags=[schema_name])
+    async def export_changes(
+        since: Optional[str] = Query(None, description="Watermark returned by the previous call"),
+        limit: int = Query(1000, gt=0, le=10000),
+    ) -> Dict[str, Any]:
+        await get_tenant_schema(schema_name)
         try:
-            # Call the export_data_to_csv function to export data to CSV
-            csv_filename = await export_data_to_csv(schema_name, date)
-            
-            # Read the contents of the CSV file
-            with open(csv_filename, 'r') as file:
-                csv_content = file.read()
-            
-            # Create a temporary file to write the CSV content
-            with tempfile.NamedTemporaryFile(mode='w+t', suffix='.csv', delete=False) as temp_file:
-                temp_file.write(csv_content)
-                temp_filename = temp_file.name
-            
-            # Return the temporary file as a FileResponse
-            return FileResponse(temp_filename, media_type="text/csv", filename=f"{schema_name}_{date}.csv")
-        except Exception as e:
-            # Handle any exceptions and return appropriate response
-            return {"error": str(e)}
+            changes, watermark, has_more = await read_changes(
+                get_collection(schema_name), get_collection(TOMBSTONES), schema_name, since, limit,
+                settings.changes_settle_ms, settings.tombstone_ttl, projection={SEARCH_KEYS_FIELD: 0},
+            )
+        except WatermarkError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        for change in changes:
+            if "document" in change:
+                document = change["document"]
+                document["_id"] = str(document["_id"])
+                document.pop(MODIFIED_AT_FIELD, None)
+                prepare_document(schema_name, document)
+        metrics.EXPORT_ROWS.inc((schema_name,), len(changes))
+        return {"changes": changes, "watermark": watermark, "has_more": has_more}
 
 
     @app.put(f"/{schema_name}/{{id}}", tags=[schema_name])
@@ -370,11 +619,30 @@ async def generate_routes_from_schema(schema: SchemaModel):
             raise HTTPException(status_code=400, detail="Invalid ObjectId")
 
         # Get the collection for the schema
-        lcollection = db[schema_name]
+        lcollection = get_collection(schema_name)
         # Find the schema definition
-        schema_definition = await collection.find_one({"schema_name": schema_name})
+        schema_definition = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
 
         if schema_definition:
+            field_models = SchemaModel(**schema_definition).fields
+            facet_field_names = {field.col_name for field in facet_fields(field_models)}
+
+            # The merged document is checked against the collection validator's rules. As with
+            # validationLevel "moderate", problems the stored document already had don't block the update.
+            stored = await lcollection.find_one({"_id": object_id})
+            # A document still at an older version is brought up to date first, so the fields set
+            # below aren't renamed over or dropped when the migrator gets to it
+            upgraders = schema_upgraders.get((current_tenant.get(), schema_name))
+            if stored is not None and upgraders and (stored.get(SCHEMA_VERSION_FIELD) or 1) < upgraders[-1]["to_version"]:
+                await upgrade_stored_document(lcollection, object_id, upgraders)
+                stored = upgrade_document(stored, upgraders)
+            if stored is not None:
+                validator = compile_json_schema(field_models)
+                existing_errors = set(document_errors(validator, stored))
+                errors = [error for error in document_errors(validator, {**stored, **updated_fields}) if error not in existing_errors]
+                if errors:
+                    raise HTTPException(status_code=400, detail=errors[0])
+
             for field_name, updated_value in updated_fields.items():
                 # Check if the field exists in the schema's fields
                 field_exists = any(field["col_name"] == field_name for field in schema_definition["fields"])
@@ -403,13 +671,52 @@ async def generate_routes_from_schema(schema: SchemaModel):
                         if "dict_keys" in field and not all(key in updated_value for key in field["dict_keys"]):
                             raise HTTPException(status_code=400, detail=f"Missing keys for {field_name}. Required keys are: {', '.join(field['dict_keys'])}")
 
-                # Update the field
-                await lcollection.update_one({"_id": object_id}, {"$set": {field_name: updated_value}})
-
+                # Update the field, taking the previous value atomically for facet fields
+                try:
+                    if field_name in facet_field_names:
+                        previous = await lcollection.find_one_and_update(
+                            {"_id": object_id}, {"$set": {field_name: updated_value, MODIFIED_AT_FIELD: stamp()}},
+                            projection={field_name: 1}, return_document=ReturnDocument.BEFORE,
+                        )
+                        if previous is not None:
+                            await apply_facet_deltas(get_collection(FACETS), schema_name, facet_deltas(field_models, previous, {field_name: updated_value}))
+                    else:
+                        await lcollection.update_one({"_id": object_id}, {"$set": {field_name: updated_value, MODIFIED_AT_FIELD: stamp()}})
+                except OperationFailure as exc:
+                    # 121: DocumentValidationFailure, e.g. the schema changed since the check above
+                    if exc.code != 121:
+                        raise
+                    raise HTTPException(status_code=400, detail={"message": "Document failed validation", "details": (exc.details or {}).get("errInfo", {}).get("details")})
+
+            # Refresh the prefix search keys when a string field changed
+            if set(updated_fields) & set(string_fields(field_models)):
+                document = await lcollection.find_one({"_id": object_id})
+                if document:
+                    await lcollection.update_one({"_id": object_id}, {"$set": {SEARCH_KEYS_FIELD: search_keys(field_models, document)}})
+
+            publish_event(schema_name, "update", {"_id": id, "fields": updated_fields})
             return {"message": f"Fields updated successfully for item with ID '{id}' in collection '{schema_name}'"}
         else:
             return {"message": f"Schema '{schema_name}' not found"}
 
+
+    @app.delete(f"/{schema_name}/{{id}}", tags=[schema_name])
+    async def delete_schema_item(id: str) -> Dict[str, str]:
+        try:
+            # Convert ID to ObjectId
+            object_id = ObjectId(id)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail="Invalid ObjectId")
+
+        schema, _ = await get_tenant_schema(schema_name)
+        deleted = await get_collection(schema_name).find_one_and_delete({"_id": object_id})
+        if not deleted:
+            raise HTTPException(status_code=404, detail=f"Item not found for ID: {id}")
+        await apply_facet_deltas(get_collection(FACETS), schema_name, facet_deltas(schema.fields, deleted, None))
+        await record_deletes(get_collection(TOMBSTONES), schema_name, [object_id])
+        publish_event(schema_name, "delete", {"_id": id})
+        return {"message": f"Item with ID '{id}' deleted from collection '{schema_name}'"}
+
     # @app.post(f"/export/{schema_name}/", tags=[schema_name])
     # async def export_csv(date: str = Query(..., title="Date", description="Date in the format DD/MM/YYYY")):
     #     try:
@@ -431,7 +738,7 @@ async def generate_routes_from_schema(schema: SchemaModel):
 @app.get("/getfields/{schema_name}/", tags=["Common routes"])
 async def get_schema_field(schema_name: str) -> Dict[str, Any]:
     # Find the schema in the collection
-    schema_data = await collection.find_one({"schema_name": schema_name})
+    schema_data = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
     if not schema_data:
         # If schema not found, raise an HTTPException
         raise HTTPException(status_code=404, detail="Schema not found")
@@ -445,9 +752,9 @@ async def get_schema_field(schema_name: str) -> Dict[str, Any]:
 @app.get("/get-schema-names-with-date/", tags=["Common routes"])
 async def get_schema_names_with_date(page: int = Query(1, gt=0), page_size: int = Query(10, gt=0)) -> Dict[str, Any]:
     skip = (page - 1) * page_size
-    schemas_cursor = collection.find({}, {"schema_name": 1, "created_at": 1, "_id": 0}).skip(skip).limit(page_size)
+    schemas_cursor = get_collection(MASTERLIST).find({}, {"schema_name": 1, "created_at": 1, "_id": 0}).skip(skip).limit(page_size)
     schemas = await schemas_cursor.to_list(length=None)
-    total_schemas = await collection.count_documents({})
+    total_schemas = await get_collection(MASTERLIST).count_documents({})
     total_pages = -(-total_schemas // page_size)  # Ceiling division to calculate total pages
     return {
         "schemas": schemas,
@@ -457,34 +764,440 @@ async def get_schema_names_with_date(page: int = Query(1, gt=0), page_size: int
     }
 
 
-#--------------Function for exporting data as csv,xlsx,xls--------------#
-async def export_data_to_csv(schema_name: str, date: str) -> str:
+#--------------Import error report download--------------#
+@app.get("/imports/{import_id}/errors", tags=["Common routes"])
+async def get_import_errors(import_id: str) -> FileResponse:
+    path = report_path(error_report_directory(), import_id, settings.import_report_ttl)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Import report not found or expired")
+    return FileResponse(path, media_type="text/csv", filename=f"import_{import_id}_errors.csv")
+
+
+#--------------Schema migration progress--------------#
+@app.get("/migrations/{schema_name}", tags=["Common routes"])
+async def get_schema_migrations(schema_name: str) -> List[Dict[str, Any]]:
+    cursor = get_collection(MIGRATIONS).find({"schema_name": schema_name}, {"_id": 0}).sort("to_version", -1)
+    return await cursor.to_list(length=None)
+
+
+#--------------Schema snapshot and restore--------------#
+
+SNAPSHOT_MEDIA_TYPES = {None: "application/octet-stream", "gzip": "application/gzip", "zstd": "application/zstd"}
+
+# The schema definition and all of its documents as one BSON stream (see snapshots.py),
+# for moving a masterlist between environments with its types intact. Compressed
+# with zstd when available, gzip otherwise, unless another compression is asked for.
+@app.get("/admin/snapshot/{schema_name}", tags=["Admin"])
+async def get_schema_snapshot(
+    schema_name: str,
+    compression: Optional[str] = Query(None, pattern="^(zstd|gzip|none)$"),
+) -> StreamingResponse:
+    schema_data = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
+    if not schema_data:
+        raise HTTPException(status_code=404, detail="Schema not found")
+    encoding = ENCODINGS[0] if compression is None else None if compression == "none" else compression
+    if encoding not in (None, *ENCODINGS):
+        raise HTTPException(status_code=400, detail=f"{encoding} compression is not available on this server")
+
+    lcollection = get_collection(schema_name)
+    migrations = await pending_migrations(get_collection(MIGRATIONS), schema_name)
+    header = snapshot_header(schema_data, migrations, await lcollection.count_documents({}))
+    filename = f"{schema_name}{SNAPSHOT_EXTENSIONS[encoding]}"
+    return StreamingResponse(
+        snapshot_stream(lcollection, header, encoding, settings.gzip_level, settings.zstd_level, offload=asyncio.to_thread),
+        media_type=SNAPSHOT_MEDIA_TYPES[encoding],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Load a snapshot as a schema, under its own name or `schema_name`. The documents are
+# bulk inserted into a staging collection that replaces the schema's collection in
+# one rename, then the validator and indexes are built over the loaded data. An
+# existing schema is only overwritten with replace=true.
+@app.post("/admin/restore", tags=["Admin"])
+async def restore_schema_snapshot(
+    file: UploadFile = File(...),
+    schema_name: Optional[str] = Query(None, description="Restore under this name instead of the snapshot's"),
+    replace: bool = Query(False, description="Replace the schema and its documents if it already exists"),
+) -> Dict[str, Any]:
     try:
-        lcollection = db[schema_name]
-        data_cursor = lcollection.find({"modified_date": date})
+        stream = open_snapshot(file.file)
+        header = await asyncio.to_thread(read_header, stream)
+    except SnapshotError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    schema_data = header["schema"]
+    name = (schema_name or schema_data.get("schema_name") or "").lower()
+    if not name or " " in name:
+        raise HTTPException(status_code=400, detail="Schema name cannot be empty or contain spaces")
+    # Checked before anything is staged: replacing would rename over the collection
+    if reserved_schema_name(name):
+        raise HTTPException(status_code=400, detail=f"'{name}' is reserved and cannot be used as a schema name")
+    schema_data["schema_name"] = name
+    try:
+        schema = SchemaModel(**schema_data)
+    except ValidationError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid schema in snapshot: {exc}")
 
-        # Convert the cursor to a list of documents
-        data = await data_cursor.to_list(length=None)
+    lcollection = get_collection(name)
+    exists = await get_collection(MASTERLIST).find_one({"schema_name": name}) or await lcollection.find_one({}, {"_id": 1})
+    if exists and not replace:
+        raise HTTPException(status_code=400, detail="Schema with the same name already exists")
 
-        if not data:
-            raise HTTPException(status_code=404, detail="No data found for the provided date")
+    staging_name = f"{name}{RESTORE_STAGING}{ObjectId()}"
+    staging = get_collection(staging_name)
+    tombstoned_at = None
+    renamed = False
+    try:
+        await database.get_database().create_collection(staging_name)
+        restored = await load_snapshot(staging.with_options(codec_options=RAW_OPTIONS), stream)
+        # Documents written before the restore must not be replayed after it by change
+        # mirrors. The restored documents are stamped strictly after the tombstones: a
+        # snapshot restored over its own schema brings back the same _ids, and a delete
+        # sorting after their upsert would lose them.
+        replaced = 0
+        if exists:
+            tombstoned_at = stamp()
+            replaced = await tombstone_documents(name, tombstoned_at, staging_name)
+        restored_at = stamp_after(tombstoned_at) if tombstoned_at else stamp()
+        await staging.update_many({}, {"$set": {MODIFIED_AT_FIELD: restored_at}})
+        await staging.rename(name, dropTarget=True)
+        renamed = True
+    except (SnapshotError, BulkWriteError) as exc:
+        raise HTTPException(status_code=400, detail=f"Snapshot could not be restored: {exc}")
+    finally:
+        # Whatever stopped the restore, the documents it tombstoned are still there
+        if tombstoned_at is not None and not renamed:
+            await get_collection(TOMBSTONES).delete_many({"schema": name, "restore": staging_name})
+        await staging.drop()
+
+    # The snapshot's unfinished migrations continue here; facet counters are rebuilt
+    migrations = [{**migration, "schema_name": name, "status": "pending"} for migration in header.get("migrations", [])]
+    await get_collection(MIGRATIONS).delete_many({"schema_name": name})
+    if migrations:
+        await get_collection(MIGRATIONS).insert_many(migrations)
+    await get_collection(FACETS).delete_many({"schema": name})
+    await get_collection(MASTERLIST).replace_one({"schema_name": name}, schema_data, upsert=True)
+
+    stats_cache.invalidate((current_tenant.get(), name))
+    # Validator, search and change indexes are built now that the documents are in
+    await generate_routes_from_schema(schema)
+    publish_event(name, "reload", {"reason": "restore"})
+    return {"message": f"Schema '{name}' restored", "schema_name": name, "documents": restored, "replaced": replaced}
+
+
+# Insert the documents of a snapshot stream in batches; reading and decompressing the
+# next batch overlaps with inserting the current one
+async def load_snapshot(raw_collection, stream) -> int:
+    batches = read_batches(stream, settings.restore_batch_size)
+    pending = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+    restored = 0
+    try:
+        while True:
+            batch = await pending
+            if batch is None:
+                return restored
+            pending = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            await raw_collection.insert_many(batch, ordered=False)
+            restored += len(batch)
+    finally:
+        if not pending.done():
+            await asyncio.wait([pending])
+
+
+# Record deletes, all stamped `modified_at`, for every document currently in a
+# schema's collection. They are tagged with the restore's staging collection so a
+# failed restore can take them back.
+async def tombstone_documents(schema_name: str, modified_at: datetime, staging_name: str) -> int:
+    count = 0
+    batch = []
+    tag = {"restore": staging_name}
+    async for document in get_collection(schema_name).find({}, {"_id": 1}):
+        batch.append(document["_id"])
+        if len(batch) == settings.restore_batch_size:
+            await record_deletes(get_collection(TOMBSTONES), schema_name, batch, modified_at, tag)
+            count += len(batch)
+            batch = []
+    await record_deletes(get_collection(TOMBSTONES), schema_name, batch, modified_at, tag)
+    return count + len(batch)
+
+
+#--------------Connection pool statistics--------------#
+@app.get("/pool-stats/", tags=["Common routes"])
+async def get_pool_stats() -> Dict[str, Any]:
+    # Checkout wait times and in-use connection counts collected by the pool listener
+    return database.pool_monitor.snapshot()
+
+
+#--------------Prometheus metrics--------------#
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+#--------------Import pipeline--------------#
+
+IMPORT_EXTENSIONS = (".csv", ".xlsx")
+
+# Import an uploaded CSV/XLSX file stored at `path`; shared by the direct upload
+# route and committed resumable uploads. Parsing and row checks run in the worker
+# pool, this side only checks uniqueness and writes the prepared batches.
+async def run_import(schema_name: str, filename: str, path: str, trusted: bool, mode: str) -> Dict[str, Any]:
+    # Retrieve the schema definition
+    schema_definition = await get_collection(MASTERLIST).find_one({"schema_name": schema_name})
+    if not schema_definition:
+        raise HTTPException(status_code=404, detail="Schema not found")
+    if not filename.endswith(IMPORT_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Only Excel (xlsx) or CSV files are allowed")
+
+    field_models = SchemaModel(**schema_definition).fields
+    schema_version = schema_definition.get("version", 1)
+    if mode != "insert" and not unique_fields(field_models):
+        raise HTTPException(status_code=400, detail=f"Schema '{schema_name}' has no unique fields to key {mode} imports on")
+
+    spool_dir = tempfile.mkdtemp(prefix="masterlist-import-")
+    try:
+        # Chunks are validated and written while the rest of the file is still being parsed
+        spool = start_split(path, filename, spool_dir, settings.import_chunk_rows, settings.import_workers, field_models)
+        columns = await spool.columns()
+        batches = prepared_batches(
+            spool, settings.import_chunk_rows, field_models, not trusted, schema_version,
+            datetime.now().strftime("%d/%m/%Y"), settings.import_workers,
+        )
+        # Invalid rows go to a downloadable CSV report as they are found
+        report = open_error_report(columns)
+        try:
+            counts = await write_batches(schema_name, field_models, mode, batches, report)
+        finally:
+            report.close()
+    except BrokenProcessPool:
+        # The pool is replaced for the next import (see imports.py)
+        raise HTTPException(status_code=503, detail="An import worker crashed, try the import again")
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    if counts["inserted"] or counts["updated"]:
+        publish_event(schema_name, "reload", {"reason": "import", **counts})
+    return import_result(schema_name, counts, report)
+
+
+# Copy an UploadFile to a temporary file the worker processes can open
+def save_upload(file: UploadFile) -> str:
+    suffix = os.path.splitext(file.filename or "")[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        shutil.copyfileobj(file.file, target, 1024 * 1024)
+    return target.name
 
-        # Convert the data to a DataFrame
-        df = pd.DataFrame(data)
 
-        # Format date to ensure a valid file name
-        formatted_date = date.replace('/', '_')
+#--------------Resumable upload sessions--------------#
 
-        # Generate file name based on schema name and date
-        csv_filename = f"{schema_name}_{formatted_date}.csv"
+def upload_directory() -> str:
+    base = settings.upload_dir or os.path.join(tempfile.gettempdir(), "masterlist-uploads")
+    return os.path.join(base, current_tenant.get())
 
-        # Export the DataFrame to a CSV file
-        df.to_csv(csv_filename, index=False)
 
-        return csv_filename
-    except Exception as e:
-        # Handle any exceptions and raise an HTTPException
-        raise HTTPException(status_code=500, detail=str(e))
+def open_upload(schema_name: str, upload_id: str) -> Tuple[Dict[str, Any], str]:
+    try:
+        return load_session(upload_directory(), upload_id, schema_name, settings.upload_ttl)
+    except UploadError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+
+#--------------Writing prepared batches--------------#
+
+# Write the batches coming back from the worker pool. Repeated unique values in the
+# file are dropped with a hash set, unique values already stored are found with one
+# $in query per unique field, and the rest is inserted unordered (or upserted) so
+# the collection's $jsonSchema validator rejects what is left of the bad rows.
+async def write_batches(schema_name: str, field_models: List[FieldModel], mode: str, batches, report: ImportErrorReport) -> Dict[str, int]:
+    lcollection = get_collection(schema_name)
+    duplicates = DuplicateTracker(unique_fields(field_models))
+    counts = {"inserted": 0, "updated": 0}
+    # Old-version fields an upsert has to drop, or the migrator would skip the document with them
+    retired = retired_fields(schema_upgraders.get((current_tenant.get(), schema_name)) or [], [field.col_name for field in field_models])
+
+    async for batch in batches:
+        for position, data, errors in batch["invalid"]:
+            report.add(position + 1, data, errors)
+
+        documents, positions = [], []
+        for document, position in zip(batch["documents"], batch["positions"]):
+            errors = duplicates.check(document)
+            if errors:
+                report.add(position + 1, document, errors)
+            else:
+                documents.append(document)
+                positions.append(position)
+        if not documents:
+            continue
+        modified_at = stamp()
+        for document in documents:
+            document[MODIFIED_AT_FIELD] = modified_at
+
+        if mode != "insert":
+            batch_counts, rejected = await upsert_documents(
+                lcollection, get_collection(FACETS), schema_name, field_models, documents, replace=mode == "replace",
+                retired=retired,
+            )
+            counts["inserted"] += batch_counts["inserted"]
+            counts["updated"] += batch_counts["updated"]
+            for index, error in rejected:
+                report.add(positions[index] + 1, documents[index], [error])
+            continue
+
+        for field in field_models:
+            if field.unique and documents:
+                values = [document.get(field.col_name) for document in documents]
+                taken = set(await lcollection.distinct(field.col_name, {field.col_name: {"$in": values}}))
+                if taken:
+                    kept, kept_positions = [], []
+                    for document, position in zip(documents, positions):
+                        if document.get(field.col_name) in taken:
+                            report.add(position + 1, document, [f"{field.col_name} must be unique"])
+                        else:
+                            kept.append(document)
+                            kept_positions.append(position)
+                    documents, positions = kept, kept_positions
+
+        inserted = documents
+        if documents:
+            try:
+                await lcollection.insert_many(documents, ordered=False)
+            except BulkWriteError as exc:
+                failed = {error["index"]: error for error in exc.details.get("writeErrors", [])}
+                inserted = [document for index, document in enumerate(documents) if index not in failed]
+                for index, error in sorted(failed.items()):
+                    report.add(positions[index] + 1, documents[index], [error.get("errmsg", "Rejected by the database")])
+            await apply_facet_deltas(get_collection(FACETS), schema_name, facet_counts(field_models, inserted))
+        counts["inserted"] += len(inserted)
+    return counts
+
+
+#--------------Import error reports--------------#
+
+def error_report_directory() -> str:
+    base = settings.import_report_dir or os.path.join(tempfile.gettempdir(), "masterlist-import-errors")
+    return os.path.join(base, current_tenant.get())
+
+
+# Start an error report for an upload, clearing out expired ones on the way
+def open_error_report(columns) -> ImportErrorReport:
+    directory = error_report_directory()
+    purge_reports(directory, settings.import_report_ttl)
+    return ImportErrorReport(directory, [str(col_name) for col_name in columns])
+
+
+# Record the import metrics and build the response: counts and a few sample errors,
+# the full list is downloaded from /imports/{import_id}/errors
+def import_result(schema_name: str, counts: Dict[str, int], report: ImportErrorReport) -> Dict[str, Any]:
+    imported = counts["inserted"] + counts["updated"]
+    metrics.IMPORT_ROWS.inc((schema_name, "valid"), imported)
+    metrics.IMPORT_ROWS.inc((schema_name, "invalid"), report.count)
+    if report.count == 0:
+        s = "All"
+    elif imported == 0:
+        s = "No"
+    else:
+        s = "Some"
+    result = {"message": f"{s} datas imported ", **counts, **report.summary()}
+    if report.count:
+        result["error_report"] = f"/imports/{report.import_id}/errors"
+    return result
+
+
+#--------------Function for exporting data as csv,xlsx,xls--------------#
+
+EXPORT_FORMATS = {"csv": "text/csv", "json": "application/json"}
+
+export_cache = ExportCache(
+    settings.export_cache_dir or os.path.join(tempfile.gettempdir(), "masterlist-exports"),
+    settings.export_cache_max_bytes,
+)
+
+
+# Columns asked for in `fields`, None for all of them; 400 on columns the schema doesn't have
+def export_columns(schema: SchemaModel, fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    columns = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    known = {field.col_name for field in schema.fields} | {"_id", "modified_date"}
+    unknown = [name for name in columns if name not in known]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown export fields: {', '.join(unknown)}")
+    return columns
+
+
+# Export file for the request and how it was obtained: "hit" or "miss" for the cache,
+# "bypass" for a one-off file while recent writes are still settling (see
+# changes.read_changes), which could otherwise be cached under a version they miss.
+# Either way the returned file belongs to the request and is removed once sent; a
+# cached entry is handed out as a private link (ExportCache.checkout).
+EXPORT_CACHE_ATTEMPTS = 3
+
+async def export_file(schema: SchemaModel, date: Optional[str], columns: Optional[List[str]], fmt: str, encoding: Optional[str]) -> Tuple[str, str]:
+    schema_name = schema.schema_name
+    version, last_change = await data_version(get_collection(schema_name), get_collection(TOMBSTONES), schema_name)
+    query = {"modified_date": date} if date else {}
+
+    async def produce(path: str) -> int:
+        return await write_export(schema, query, columns, fmt, encoding, path)
+
+    if last_change is not None and stamp() - last_change < timedelta(milliseconds=settings.changes_settle_ms):
+        path = os.path.join(tempfile.gettempdir(), f"masterlist-export-{ObjectId()}.{fmt}")
+        if not await produce(path):
+            if os.path.exists(path):
+                os.remove(path)
+            raise HTTPException(status_code=404, detail="No data found for the provided date")
+        return path, "bypass"
+
+    for _ in range(EXPORT_CACHE_ATTEMPTS):
+        path = export_cache.entry_path(
+            current_tenant.get(), schema_name, f"{schema.version}:{version}", {"date": date, "fields": columns, "format": fmt, "encoding": encoding}, fmt,
+        )
+        path, cached = await export_cache.get_or_create(path, produce)
+        if path is None:
+            raise HTTPException(status_code=404, detail="No data found for the provided date")
+        try:
+            return export_cache.checkout(path), "hit" if cached else "miss"
+        except FileNotFoundError:
+            # Evicted or replaced by a newer version since the lookup, treat it as a miss
+            version, _ = await data_version(get_collection(schema_name), get_collection(TOMBSTONES), schema_name)
+    raise HTTPException(status_code=503, detail="The export kept changing while it was prepared, try again")
+
+
+# Write the matching documents, in the current schema shape, to `path` in batches of
+# EXPORT_BATCH_ROWS, through the `encoding` compressor. Returns the row count.
+# Columns default to _id, the schema's fields and modified_date.
+EXPORT_BATCH_ROWS = 5000
+
+async def write_export(schema: SchemaModel, query: Dict[str, Any], columns: Optional[List[str]], fmt: str, encoding: Optional[str], path: str) -> int:
+    schema_name = schema.schema_name
+    columns = columns or ["_id", *(field.col_name for field in schema.fields), "modified_date"]
+    compressor = encoder(encoding, settings.gzip_level, settings.zstd_level)
+    rows = 0
+    with open(path, "wb") as file:
+        batch = []
+        async for document in get_collection(schema_name).find(query, HIDDEN_FIELDS):
+            batch.append(prepare_document(schema_name, document))
+            if len(batch) == EXPORT_BATCH_ROWS:
+                # Formatting and compression are CPU work, keep them off the event loop
+                await asyncio.to_thread(write_export_batch, file, compressor, batch, columns, fmt, rows == 0)
+                rows += len(batch)
+                batch = []
+        if batch or rows:
+            await asyncio.to_thread(write_export_batch, file, compressor, batch, columns, fmt, rows == 0, True)
+            rows += len(batch)
+    metrics.EXPORT_ROWS.inc((schema_name,), rows)
+    return rows
+
+
+def write_export_batch(file, compressor, batch: List[Dict[str, Any]], columns: List[str], fmt: str, first: bool, last: bool = False) -> None:
+    if fmt == "json":
+        body = ",".join(json.dumps({name: document.get(name) for name in columns}, default=str) for document in batch)
+        data = ("[" if first else ("," if batch else "")) + body + ("]" if last else "")
+    else:
+        data = pd.DataFrame(batch, columns=columns).to_csv(index=False, header=first) if batch else ""
+    file.write(compressor.compress(data.encode("utf-8")))
+    if last:
+        file.write(compressor.flush())
 
 
 
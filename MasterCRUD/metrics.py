@@ -0,0 +1,182 @@
+
+#--------------Prometheus metrics--------------#
+
+# A small in-process metrics registry rendered in the Prometheus text format.
+# Everything is updated from the event loop thread (or under the caller's lock),
+# so the hot path is a dict lookup and a few additions.
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, List, Sequence, Set, Tuple
+
+# Latency buckets in seconds, from fast single-document reads up to large imports
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (last one is +Inf), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        # Counts are stored per bucket and made cumulative when rendered
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Collectors are called right before rendering to refresh gauges from other state
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter("masterlist_requests_total", "HTTP requests by route template, schema and status", ("method", "route", "schema", "status")))
+REQUEST_ERRORS = registry.register(Counter("masterlist_request_errors_total", "HTTP requests that ended in a server error", ("method", "route", "schema")))
+REQUEST_LATENCY = registry.register(Histogram("masterlist_request_duration_seconds", "HTTP request latency by route template and schema", ("method", "route", "schema")))
+IMPORT_ROWS = registry.register(Counter("masterlist_import_rows_total", "Rows processed by imports", ("schema", "result")))
+EXPORT_ROWS = registry.register(Counter("masterlist_export_rows_total", "Rows written by exports", ("schema",)))
+EXPORT_BYTES = registry.register(Counter("masterlist_export_bytes_total", "Bytes streamed by exports", ("schema",)))
+EXPORT_CACHE = registry.register(Counter("masterlist_export_cache_total", "Export requests by cache result (hit, miss, bypass)", ("schema", "result")))
+EVENT_SUBSCRIBERS = registry.register(Gauge("masterlist_event_subscribers", "Connected /events subscribers", ("schema",)))
+EVENTS_PUBLISHED = registry.register(Counter("masterlist_events_published_total", "Change events published to /events subscribers", ("schema", "event")))
+
+
+#--------------Request instrumentation--------------#
+
+# Work out the (route, schema) labels from the matched route. Generated routes are
+# tagged with their schema name, which is folded back into a {schema_name} template
+# so the same route aggregates across schemas. Common routes carry it as a path parameter.
+_generated_labels: Dict[int, Tuple[str, str]] = {}
+
+# Schema names that have routes, added as schemas are registered. A path parameter
+# naming anything else gets UNKNOWN_SCHEMA, so clients can't mint new series.
+known_schemas: Set[str] = set()
+UNKNOWN_SCHEMA = "unknown"
+
+
+def _route_labels(scope) -> Tuple[str, str]:
+    route = scope.get("route")
+    if route is None:
+        return "unmatched", ""
+    schema = scope.get("path_params", {}).get("schema_name")
+    if schema is not None:
+        return route.path, schema if schema in known_schemas else UNKNOWN_SCHEMA
+    labels = _generated_labels.get(id(route))
+    if labels is None:
+        tags = getattr(route, "tags", None)
+        if tags and tags[0] != "Common routes":
+            schema = tags[0]
+            labels = (route.path.replace(f"/{schema}/", "/{schema_name}/", 1), schema)
+        else:
+            labels = (route.path, "")
+        _generated_labels[id(route)] = labels
+    return labels
+
+
+def observe_request(method: str, route: str, schema: str, status: int, elapsed: float) -> None:
+    REQUESTS.inc((method, route, schema, str(status)))
+    REQUEST_LATENCY.observe((method, route, schema), elapsed)
+    if status >= 500:
+        REQUEST_ERRORS.inc((method, route, schema))
+
+
+# Plain ASGI middleware, cheaper than BaseHTTPMiddleware and safe for streamed responses
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route, schema = _route_labels(scope)
+            observe_request(scope["method"], route, schema, status[0], perf_counter() - start)
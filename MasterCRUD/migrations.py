@@ -0,0 +1,181 @@
+
+#--------------Schema versioning and data migration--------------#
+
+# Every change to a schema's fields bumps its version. Documents are stamped with
+# the version they were written under, and a background migrator rewrites older
+# documents in batches with server-side update_many ($rename, $unset, $set of
+# defaults). Until it finishes, reads upgrade old documents in memory.
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import ASCENDING
+from changes import MODIFIED_AT_FIELD, stamp
+
+SCHEMA_VERSION_FIELD = "_schema_version"
+MIGRATIONS = "masterlist_migrations"
+
+# Value given to a newly added field when the schema doesn't provide a "default"
+TYPE_DEFAULTS = {"str": "", "int": 0, "float": 0.0, "bool": False, "list": [], "dict": {}}
+
+
+# Compare the old and new field lists. New fields may carry "renamed_from" (the old
+# column name) and "default" (value for existing documents). Returns the field list
+# to store and the migration plan.
+def plan_migration(old_fields: List[Dict[str, Any]], new_fields: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    old_names = {field["col_name"] for field in old_fields}
+    stored_fields = []
+    rename: Dict[str, str] = {}
+    defaults: Dict[str, Any] = {}
+    for field in new_fields:
+        field = dict(field)
+        renamed_from = field.pop("renamed_from", None)
+        if renamed_from and renamed_from in old_names and renamed_from != field["col_name"]:
+            rename[renamed_from] = field["col_name"]
+        elif field["col_name"] not in old_names:
+            defaults[field["col_name"]] = field.get("default", TYPE_DEFAULTS.get(field.get("type"), None))
+        stored_fields.append(field)
+
+    new_names = {field["col_name"] for field in stored_fields}
+    unset = sorted(name for name in old_names if name not in new_names and name not in rename)
+    return stored_fields, {"rename": rename, "unset": unset, "defaults": defaults}
+
+
+def version_query(version: int) -> Any:
+    # Documents written before versioning existed have no stamp and count as version 1
+    return {"$in": [None, 1]} if version == 1 else version
+
+
+# Bring a document written under an older version up to date in memory, for reads
+# that happen while the migrator is still running
+def upgrade_document(document: Dict[str, Any], migrations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    version = document.get(SCHEMA_VERSION_FIELD) or 1
+    for migration in migrations:
+        if migration["from_version"] != version:
+            continue
+        plan = migration["plan"]
+        for old, new in plan["rename"].items():
+            if old in document:
+                document[new] = document.pop(old)
+        for name in plan["unset"]:
+            document.pop(name, None)
+        for name, default in plan["defaults"].items():
+            document.setdefault(name, default)
+        version = migration["to_version"]
+    document[SCHEMA_VERSION_FIELD] = version
+    return document
+
+
+# Fields the pending migrations rename away or drop, minus those the current version
+# still has. A write that brings an old document to the current shape unsets them.
+def retired_fields(migrations: List[Dict[str, Any]], current_names: List[str]) -> List[str]:
+    names = set()
+    for migration in migrations:
+        names.update(migration["plan"]["rename"])
+        names.update(migration["plan"]["unset"])
+    return sorted(names - set(current_names))
+
+
+# The update_many body the migrator applies for one migration (defaults excepted,
+# they are only set where the field is missing)
+def _plan_update(migration: Dict[str, Any]) -> Dict[str, Any]:
+    plan = migration["plan"]
+    update: Dict[str, Any] = {"$set": {SCHEMA_VERSION_FIELD: migration["to_version"]}}
+    if plan["rename"]:
+        update["$rename"] = plan["rename"]
+    if plan["unset"]:
+        update["$unset"] = {name: "" for name in plan["unset"]}
+    return update
+
+
+# Migrate one stored document now instead of waiting for the runner, before a write
+# that uses the current field names. Each step only matches while the document is
+# still at its from_version, so racing the runner's batches is harmless.
+async def upgrade_stored_document(lcollection, document_id: Any, migrations: List[Dict[str, Any]]) -> None:
+    for migration in migrations:
+        selector = {"_id": document_id, SCHEMA_VERSION_FIELD: version_query(migration["from_version"])}
+        for name, default in migration["plan"]["defaults"].items():
+            await lcollection.update_one({**selector, name: {"$exists": False}}, {"$set": {name: default}})
+        update = _plan_update(migration)
+        update["$set"][MODIFIED_AT_FIELD] = stamp()
+        await lcollection.update_one(selector, update)
+
+
+async def ensure_migration_indexes(migrations_collection) -> None:
+    await migrations_collection.create_index([("schema_name", ASCENDING), ("to_version", ASCENDING)], name="schema_version", unique=True)
+
+
+async def create_migration(migrations_collection, schema_name: str, from_version: int, to_version: int, plan: Dict[str, Any], total: int) -> Dict[str, Any]:
+    migration = {
+        "schema_name": schema_name,
+        "from_version": from_version,
+        "to_version": to_version,
+        "plan": plan,
+        "status": "pending",
+        "total": total,
+        "migrated": 0,
+        "created_at": datetime.now(),
+    }
+    await migrations_collection.insert_one(migration)
+    return migration
+
+
+async def pending_migrations(migrations_collection, schema_name: str) -> List[Dict[str, Any]]:
+    cursor = migrations_collection.find({"schema_name": schema_name, "status": {"$ne": "done"}}).sort("to_version", ASCENDING)
+    return await cursor.to_list(length=None)
+
+
+async def _migrate_batches(lcollection, migrations_collection, migration: Dict[str, Any], batch_size: int) -> None:
+    plan = migration["plan"]
+    update = _plan_update(migration)
+
+    await migrations_collection.update_one({"_id": migration["_id"]}, {"$set": {"status": "running", "started_at": datetime.now()}})
+    selector = {SCHEMA_VERSION_FIELD: version_query(migration["from_version"])}
+    while True:
+        ids = [document["_id"] async for document in lcollection.find(selector, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        batch = {"_id": {"$in": ids}}
+        # Defaults first, only where the field is missing, then renames/unsets and the version stamp
+        for name, default in plan["defaults"].items():
+            await lcollection.update_many({**batch, name: {"$exists": False}}, {"$set": {name: default}})
+        # Rewritten documents count as changed for incremental exports
+        update["$set"][MODIFIED_AT_FIELD] = stamp()
+        await lcollection.update_many(batch, update)
+        await migrations_collection.update_one({"_id": migration["_id"]}, {"$inc": {"migrated": len(ids)}})
+        # Let request handlers in between batches
+        await asyncio.sleep(0)
+    await migrations_collection.update_one({"_id": migration["_id"]}, {"$set": {"status": "done", "finished_at": datetime.now()}})
+
+
+#--------------Background runner--------------#
+
+# Keyed by the collection's full name, so the same schema in two tenant databases
+# gets its own runner
+_runners: Dict[str, asyncio.Task] = {}
+_wakeups = set()
+
+
+# Apply the schema's pending migrations in version order. `on_done` is awaited after
+# each finished migration (e.g. to refresh derived data and in-memory upgraders).
+async def _run(lcollection, migrations_collection, schema_name: str, batch_size: int, on_done: Optional[Callable[[], Awaitable[None]]]) -> None:
+    key = lcollection.full_name
+    while True:
+        _wakeups.discard(key)
+        migrations = await pending_migrations(migrations_collection, schema_name)
+        if not migrations:
+            # A migration created while we were looking triggers another pass
+            if key in _wakeups:
+                continue
+            return
+        await _migrate_batches(lcollection, migrations_collection, migrations[0], batch_size)
+        if on_done is not None:
+            await on_done()
+
+
+def start_migrations(lcollection, migrations_collection, schema_name: str, batch_size: int = 1000, on_done: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+    key = lcollection.full_name
+    runner = _runners.get(key)
+    if runner is not None and not runner.done():
+        _wakeups.add(key)
+        return
+    _runners[key] = asyncio.create_task(_run(lcollection, migrations_collection, schema_name, batch_size, on_done))
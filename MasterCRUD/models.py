@@ -0,0 +1,27 @@
+
+#--------------Basemodels--------------#
+
+# Pydantic models for the schema definitions stored in the masterlist collection
+from typing import List, Dict, Any, Union, Optional
+from pydantic import BaseModel
+
+# Define Pydantic models for database schema and fields
+class FieldModel(BaseModel):
+    col_name: str
+    type: Union[str, int, float, bool, Dict[str, Any]]
+    unique: Optional[bool]
+    allowed_values: Optional[List[str]] = None
+    dict_keys: Optional[Dict[str, str]] = None
+
+class SchemaModel(BaseModel):
+    schema_name: str
+    fields: List[FieldModel]
+    version: int = 1
+
+class FilterData(BaseModel):
+    filter: str
+
+class FilterItem:
+    def __init__(self, field: str, value: str):
+        self.field = field
+        self.value = value
@@ -0,0 +1,118 @@
+
+#--------------Multiple search--------------#
+
+# Full-text search over a schema's string fields, backed by a MongoDB text index
+# that is kept in line with the schema definition, and a prefix (typeahead) mode
+# backed by a normalized lowercase key array stored on each document.
+import re
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional
+from pymongo import ASCENDING, TEXT, UpdateOne
+from models import FieldModel
+
+TEXT_INDEX_NAME = "search_text"
+SEARCH_KEYS_FIELD = "_search_keys"
+SEARCH_KEYS_INDEX_NAME = "search_keys"
+
+_whitespace = re.compile(r"\s+")
+
+
+def string_fields(fields: List[FieldModel]) -> List[str]:
+    return [field.col_name for field in fields if field.type == "str"]
+
+
+def normalize(value: str) -> str:
+    # Lowercase, strip accents and collapse whitespace so "  Tamil Nadu" matches "tamil na"
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return _whitespace.sub(" ", value).strip().lower()
+
+
+# Keys for prefix search: each string value in full plus each of its words
+def search_keys(fields: List[FieldModel], document: Dict[str, Any]) -> List[str]:
+    keys = set()
+    for col_name in string_fields(fields):
+        value = document.get(col_name)
+        if not isinstance(value, str):
+            continue
+        value = normalize(value)
+        if value:
+            keys.add(value)
+            keys.update(value.split(" "))
+    return sorted(keys)
+
+
+#--------------Index management--------------#
+
+async def ensure_search_indexes(lcollection, fields: List[FieldModel]) -> None:
+    columns = string_fields(fields)
+    # A collection can only have one text index, replace it when the string fields change
+    indexes = await lcollection.list_indexes().to_list(length=None)
+    for index in indexes:
+        if index["name"] == TEXT_INDEX_NAME and sorted(index.get("weights", {})) != sorted(columns):
+            await lcollection.drop_index(TEXT_INDEX_NAME)
+    if columns:
+        await lcollection.create_index(
+            [(col_name, TEXT) for col_name in columns], name=TEXT_INDEX_NAME, default_language="none"
+        )
+    await lcollection.create_index([(SEARCH_KEYS_FIELD, ASCENDING)], name=SEARCH_KEYS_INDEX_NAME)
+
+
+# Fill in search keys for documents written before search existed (or before the schema changed)
+async def backfill_search_keys(lcollection, fields: List[FieldModel], batch_size: int = 1000, rebuild: bool = False) -> int:
+    query = {} if rebuild else {SEARCH_KEYS_FIELD: {"$exists": False}}
+    projection = {col_name: 1 for col_name in string_fields(fields)}
+    updated = 0
+    batch = []
+    async for document in lcollection.find(query, projection or {"_id": 1}):
+        batch.append(UpdateOne({"_id": document["_id"]}, {"$set": {SEARCH_KEYS_FIELD: search_keys(fields, document)}}))
+        if len(batch) == batch_size:
+            await lcollection.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await lcollection.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+
+#--------------Queries--------------#
+
+# Both queries leave out the `hidden` fields and pass each hit through `prepare`, the
+# way the list route returns documents
+
+async def text_search(lcollection, q: str, subset: Optional[List[str]], page: int, page_size: int, hidden: Dict[str, int], prepare: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"$text": {"$search": q}}
+    if subset:
+        # The text index covers every string field; narrow the indexed candidates to
+        # documents where one of the chosen fields contains one of the terms
+        terms = [term for term in q.split() if term]
+        query["$or"] = [
+            {col_name: {"$regex": re.escape(term), "$options": "i"}} for col_name in subset for term in terms
+        ]
+    score = {"score": {"$meta": "textScore"}}
+    cursor = (
+        lcollection.find(query, {**score, **hidden})
+        .sort([("score", {"$meta": "textScore"})])
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    items = await cursor.to_list(length=None)
+    for item in items:
+        item["_id"] = str(item["_id"])
+        prepare(item)
+    total = await lcollection.count_documents(query)
+    return {"items": items, "total": total, "page": page, "page_size": page_size}
+
+
+async def prefix_search(lcollection, q: str, page: int, page_size: int, hidden: Dict[str, int], prepare: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    prefix = normalize(q)
+    # An anchored, case-sensitive regex on the normalized keys becomes an index range scan
+    query = {SEARCH_KEYS_FIELD: {"$regex": "^" + re.escape(prefix)}}
+    # Sorted on _id so pages don't overlap or skip hits between requests
+    cursor = lcollection.find(query, hidden).sort("_id", ASCENDING).skip((page - 1) * page_size).limit(page_size)
+    items = await cursor.to_list(length=None)
+    for item in items:
+        item["_id"] = str(item["_id"])
+        prepare(item)
+    return {"items": items, "page": page, "page_size": page_size}
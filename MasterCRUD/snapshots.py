@@ -0,0 +1,139 @@
+
+#--------------Schema snapshots--------------#
+
+# A snapshot is a stream of BSON documents: a header with the schema definition and
+# its unfinished migrations, then every stored document as is (bookkeeping fields
+# included), optionally gzip or zstd compressed. Documents are passed through as raw
+# BSON both ways, so types survive the trip and nothing is decoded or re-validated
+# on the way. Indexes aren't carried: the restore builds them from the definition
+# once the documents are in.
+import gzip
+import struct
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, List, Optional
+from bson import BSON
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from content_encoding import encoder, zstandard
+
+SNAPSHOT_FORMAT = "masterlist-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSIONS = {None: ".bson", "gzip": ".bson.gz", "zstd": ".bson.zst"}
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# Send compressed pieces of about this many bytes
+FLUSH_BYTES = 1024 * 1024
+# Largest document MongoDB stores, plus room for the header
+MAX_DOCUMENT_BYTES = 17 * 1024 * 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_header(schema_data: Dict[str, Any], migrations: List[Dict[str, Any]], count: int) -> Dict[str, Any]:
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "schema": {key: value for key, value in schema_data.items() if key != "_id"},
+        "migrations": [{key: value for key, value in migration.items() if key != "_id"} for migration in migrations],
+        "count": count,
+    }
+
+
+# Snapshot bytes for `header` followed by every document of `lcollection`. Compression
+# of each ~1 MB piece runs through `offload` (e.g. asyncio.to_thread) when given.
+async def snapshot_stream(lcollection, header: Dict[str, Any], encoding: Optional[str], gzip_level: int = 6, zstd_level: int = 3, offload=None) -> AsyncIterator[bytes]:
+    compressor = encoder(encoding, gzip_level, zstd_level)
+    raw_collection = lcollection.with_options(codec_options=RAW_OPTIONS)
+
+    async def emit(data: bytes) -> bytes:
+        if offload is not None and encoding is not None:
+            return await offload(compressor.compress, data)
+        return compressor.compress(data)
+
+    buffer = bytearray(BSON.encode(header))
+    async for document in raw_collection.find({}):
+        buffer += document.raw
+        if len(buffer) >= FLUSH_BYTES:
+            data = await emit(bytes(buffer))
+            buffer.clear()
+            if data:
+                yield data
+    data = await emit(bytes(buffer))
+    tail = data + compressor.flush()
+    if tail:
+        yield tail
+
+
+#--------------Reading a snapshot--------------#
+
+# Wrap an uploaded snapshot file in a decompressing reader, detected from its first bytes
+def open_snapshot(file: BinaryIO) -> BinaryIO:
+    magic = file.read(4)
+    file.seek(0)
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    if magic == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise SnapshotError("zstd snapshots need the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(file)
+    return file
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            raise SnapshotError("Snapshot is truncated")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+# Next raw BSON document from the stream, None at the end
+def read_document(stream: BinaryIO) -> Optional[RawBSONDocument]:
+    prefix = stream.read(4)
+    if not prefix:
+        return None
+    if len(prefix) < 4:
+        prefix += _read_exact(stream, 4 - len(prefix))
+    (size,) = struct.unpack("<i", prefix)
+    if size < 5 or size > MAX_DOCUMENT_BYTES:
+        raise SnapshotError("Snapshot is corrupt")
+    return RawBSONDocument(prefix + _read_exact(stream, size - 4), RAW_OPTIONS)
+
+
+def read_header(stream: BinaryIO) -> Dict[str, Any]:
+    try:
+        document = read_document(stream)
+        header = BSON(document.raw).decode() if document is not None else None
+    except (SnapshotError, OSError, EOFError, ValueError):
+        raise SnapshotError("Not a snapshot file")
+    if not header or header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not a snapshot file")
+    if header.get("version", 0) > SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot version {header['version']} is newer than this server supports")
+    return header
+
+
+# Documents after the header, in lists of up to `batch_size`. Blocking, meant to be
+# stepped from a worker thread.
+def read_batches(stream: BinaryIO, batch_size: int) -> Iterator[List[RawBSONDocument]]:
+    batch = []
+    while True:
+        try:
+            document = read_document(stream)
+        except (OSError, EOFError) as exc:
+            raise SnapshotError(f"Snapshot is corrupt: {exc}")
+        if document is None:
+            break
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
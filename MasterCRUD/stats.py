@@ -0,0 +1,85 @@
+
+#--------------Schema statistics--------------#
+
+# Builds one aggregation pipeline that summarises every field of a schema inside
+# MongoDB: null counts for all fields, counts per value for allowed_values fields
+# and min/max/avg/percentiles for int and float fields.
+from datetime import datetime
+from typing import Any, Dict, List
+from pymongo.errors import OperationFailure
+from models import FieldModel
+
+PERCENTILES = [0.5, 0.9, 0.95, 0.99]
+
+# $percentile needs MongoDB 7.0; older servers fall back to min/max/avg only
+_percentiles_supported = True
+
+
+def _is_numeric(field: FieldModel) -> bool:
+    return field.type in ("int", "float")
+
+
+def build_stats_pipeline(fields: List[FieldModel], with_percentiles: bool = True) -> List[Dict[str, Any]]:
+    # Output keys are positional (f0, f1, ...) because column names may contain dots
+    summary: Dict[str, Any] = {"_id": None, "total": {"$sum": 1}}
+    for index, field in enumerate(fields):
+        column = f"${field.col_name}"
+        summary[f"f{index}_nulls"] = {"$sum": {"$cond": [{"$eq": [{"$ifNull": [column, None]}, None]}, 1, 0]}}
+        if _is_numeric(field):
+            summary[f"f{index}_min"] = {"$min": column}
+            summary[f"f{index}_max"] = {"$max": column}
+            summary[f"f{index}_avg"] = {"$avg": column}
+            if with_percentiles:
+                summary[f"f{index}_pct"] = {"$percentile": {"input": column, "p": PERCENTILES, "method": "approximate"}}
+
+    facets: Dict[str, Any] = {"summary": [{"$group": summary}]}
+    for index, field in enumerate(fields):
+        if field.allowed_values:
+            branch: List[Dict[str, Any]] = []
+            if field.type == "list":
+                branch.append({"$unwind": f"${field.col_name}"})
+            branch.append({"$group": {"_id": f"${field.col_name}", "count": {"$sum": 1}}})
+            facets[f"f{index}_buckets"] = branch
+    return [{"$facet": facets}]
+
+
+def _shape_result(schema_name: str, fields: List[FieldModel], result: Dict[str, Any]) -> Dict[str, Any]:
+    summary = result["summary"][0] if result.get("summary") else {"total": 0}
+    shaped: Dict[str, Any] = {}
+    for index, field in enumerate(fields):
+        field_stats: Dict[str, Any] = {"nulls": summary.get(f"f{index}_nulls", 0)}
+        if _is_numeric(field):
+            field_stats["min"] = summary.get(f"f{index}_min")
+            field_stats["max"] = summary.get(f"f{index}_max")
+            field_stats["avg"] = summary.get(f"f{index}_avg")
+            values = summary.get(f"f{index}_pct")
+            if values:
+                field_stats["percentiles"] = {f"p{int(p * 100)}": value for p, value in zip(PERCENTILES, values)}
+        if field.allowed_values:
+            # Report every allowed value, including the ones with no records yet
+            buckets = {value: 0 for value in field.allowed_values}
+            for bucket in result.get(f"f{index}_buckets", []):
+                buckets[str(bucket["_id"])] = bucket["count"]
+            field_stats["buckets"] = buckets
+        shaped[field.col_name] = field_stats
+    return {
+        "schema_name": schema_name,
+        "total": summary.get("total", 0),
+        "fields": shaped,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+async def compute_stats(lcollection, schema_name: str, fields: List[FieldModel]) -> Dict[str, Any]:
+    global _percentiles_supported
+    if _percentiles_supported:
+        try:
+            results = await lcollection.aggregate(build_stats_pipeline(fields)).to_list(length=1)
+            return _shape_result(schema_name, fields, results[0] if results else {})
+        except OperationFailure as exc:
+            # 168: unrecognized expression, 15952: unknown group operator
+            if exc.code not in (168, 15952):
+                raise
+            _percentiles_supported = False
+    results = await lcollection.aggregate(build_stats_pipeline(fields, with_percentiles=False)).to_list(length=1)
+    return _shape_result(schema_name, fields, results[0] if results else {})
@@ -0,0 +1,121 @@
+
+#--------------Tenant resolution--------------#
+
+# Each business unit (tenant) gets its own database on the shared Motor client, so
+# all tenants draw from one connection pool. The tenant is taken from a /t/{tenant}/
+# path prefix or the tenant header and kept in a contextvar for the request, which
+# get_collection reads to pick the tenant's database.
+import asyncio
+import logging
+import re
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from fastapi.responses import JSONResponse
+from metrics import Counter, Gauge, Histogram, registry
+from models import SchemaModel
+
+logger = logging.getLogger("masterlist.tenancy")
+
+DEFAULT_TENANT = "default"
+TENANT_PREFIX = "/t/"
+TENANT_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,47}$")
+
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+TENANT_REQUESTS = registry.register(Counter("masterlist_tenant_requests_total", "HTTP requests by tenant and status", ("tenant", "status")))
+TENANT_LATENCY = registry.register(Histogram("masterlist_tenant_request_duration_seconds", "HTTP request latency by tenant", ("tenant",)))
+TENANT_STORAGE_BYTES = registry.register(Gauge("masterlist_tenant_storage_bytes", "Data size of the tenant's database (dbStats dataSize)", ("tenant",)))
+TENANT_DOCUMENTS = registry.register(Gauge("masterlist_tenant_documents", "Documents in the tenant's database (dbStats objects)", ("tenant",)))
+
+
+# Pick the tenant for a request. Returns (tenant, path with the prefix removed),
+# tenant is None when the prefix or header names an invalid tenant.
+def resolve_tenant(path: str, headers: Iterable[Tuple[bytes, bytes]], header_name: bytes) -> Tuple[Optional[str], str]:
+    if path.startswith(TENANT_PREFIX):
+        tenant, _, rest = path[len(TENANT_PREFIX):].partition("/")
+        return (tenant if TENANT_NAME.match(tenant) else None), "/" + rest
+    for name, value in headers:
+        if name == header_name:
+            tenant = value.decode("latin-1").strip().lower()
+            return (tenant if TENANT_NAME.match(tenant) else None), path
+    return DEFAULT_TENANT, path
+
+
+# ASGI middleware that sets current_tenant for the request and records per-tenant
+# request counts and latency. Unknown tenants get a 404 without reaching the routes.
+class TenantMiddleware:
+    def __init__(self, app, tenants: Iterable[str] = (), header: str = "x-tenant"):
+        self.app = app
+        self.tenants = {DEFAULT_TENANT, *tenants}
+        self.header = header.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The path includes any root_path the server mounted the app under
+        root_path = scope.get("root_path", "")
+        route_path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+        tenant, path = resolve_tenant(route_path, scope.get("headers", []), self.header)
+        if tenant not in self.tenants:
+            response = JSONResponse({"detail": "Unknown tenant"}, status_code=404)
+            await response(scope, receive, send)
+            return
+        if path != route_path:
+            # The /t/{tenant} prefix becomes part of root_path, so routes match the rest
+            # of the path while request.url, url_for and the docs keep the prefix
+            prefix = TENANT_PREFIX + route_path[len(TENANT_PREFIX):].partition("/")[0]
+            full_path = root_path + prefix + path
+            scope = dict(scope, root_path=root_path + prefix, path=full_path, raw_path=full_path.encode("utf-8"))
+
+        start = perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        token = current_tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_tenant.reset(token)
+            TENANT_REQUESTS.inc((tenant, str(status[0])))
+            TENANT_LATENCY.observe((tenant,), perf_counter() - start)
+
+
+#--------------Per-tenant schema cache--------------#
+
+# Schema definitions (and their request models) per tenant, so routes don't read
+# the masterlist collection on every request. Entries are dropped when a schema changes.
+class TenantSchemaCache:
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Tuple[SchemaModel, Any]]] = {}
+
+    def get(self, schema_name: str) -> Optional[Tuple[SchemaModel, Any]]:
+        return self._entries.get(current_tenant.get(), {}).get(schema_name)
+
+    def set(self, schema_name: str, schema: SchemaModel, model: Any) -> None:
+        self._entries.setdefault(current_tenant.get(), {})[schema_name] = (schema, model)
+
+    def invalidate(self, schema_name: str) -> None:
+        self._entries.get(current_tenant.get(), {}).pop(schema_name, None)
+
+
+#--------------Per-tenant storage metrics--------------#
+
+# Refresh the storage gauges from each tenant's dbStats every `interval` seconds
+async def report_storage(tenants: Iterable[str], get_database: Callable[[str], Any], interval: int) -> None:
+    while True:
+        for tenant in tenants:
+            try:
+                stats = await get_database(tenant).command("dbStats")
+            except Exception:
+                logger.warning("dbStats failed for tenant %s", tenant, exc_info=True)
+                continue
+            TENANT_STORAGE_BYTES.set((tenant,), stats.get("dataSize", 0))
+            TENANT_DOCUMENTS.set((tenant,), stats.get("objects", 0))
+        await asyncio.sleep(interval)
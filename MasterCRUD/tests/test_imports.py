@@ -0,0 +1,170 @@
+
+#--------------Import preparation--------------#
+
+# The import worker's parsing and coercion, run in-process on small files: what
+# prepare_chunk keeps must be what the collection validator accepts. Then the
+# process pool: chunks are prepared while the file is still being split, results
+# come back in file order, and a pool a worker died in is replaced.
+#
+#   python -m pytest tests
+import asyncio
+import os
+import signal
+import threading
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from models import FieldModel
+from validators import compile_json_schema, document_errors
+import import_worker
+import imports
+
+LIST_FIELDS = [
+    FieldModel(col_name="code", type="str", unique=True),
+    FieldModel(col_name="tags", type="list", unique=False),
+    FieldModel(col_name="grades", type="list", unique=False, allowed_values=["a", "b"]),
+]
+LIST_ROWS = [
+    ("c1", '["x", "y"]', '["a"]'),
+    ("c2", "['x', 'z']", "['a', 'b']"),
+    ("c3", "[1, 2.5, true, null]", "[]"),
+    ("c4", "not a list", '["a"]'),
+    ("c5", '{"x": 1}', '["a"]'),
+    ("c6", '["x"]', '["c"]'),
+]
+
+
+def _write_csv(path, header, rows):
+    import csv
+
+    with open(path, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _write_xlsx(path, header, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _prepare(tmp_path, filename, fields, validate):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    text_columns = [field.col_name for field in fields if field.type in ("str", "dict")]
+    count = import_worker.split_file(str(tmp_path / filename), filename, str(spool), 4, text_columns)
+    documents, invalid = [], []
+    for index in range(count):
+        batch = import_worker.prepare_chunk(import_worker.chunk_path(str(spool), index), index * 4, fields, validate, 1, "01/01/2024")
+        documents += batch["documents"]
+        invalid += batch["invalid"]
+    return documents, invalid
+
+
+@pytest.mark.parametrize("filename,write", [("list.csv", _write_csv), ("list.xlsx", _write_xlsx)])
+@pytest.mark.parametrize("validate", [True, False], ids=["validated", "trusted"])
+def test_list_columns(tmp_path, filename, write, validate):
+    write(tmp_path / filename, ["code", "tags", "grades"], LIST_ROWS)
+    documents, invalid = _prepare(tmp_path, filename, LIST_FIELDS, validate)
+
+    by_code = {document["code"]: document for document in documents}
+    assert by_code["c1"]["tags"] == ["x", "y"]
+    assert by_code["c2"]["tags"] == ["x", "z"]
+    assert by_code["c3"]["tags"] == [1, 2.5, True, None]
+    assert by_code["c3"]["grades"] == []
+    # Cells that aren't lists are rejected in both modes
+    assert {row["code"] for _, row, _ in invalid} >= {"c4", "c5"}
+    # Items outside allowed_values are caught here when validating, by the database otherwise
+    assert ("c6" in by_code) != validate
+
+    validator = compile_json_schema(LIST_FIELDS)
+    for code, document in by_code.items():
+        if code != "c6":
+            assert document_errors(validator, document) == []
+
+
+#--------------Process pool--------------#
+
+POOL_FIELDS = [FieldModel(col_name="code", type="str", unique=True), FieldModel(col_name="qty", type="int", unique=False)]
+
+
+@pytest.fixture
+def pool():
+    yield
+    imports.shutdown_import_executor()
+
+
+def _write_rows(path, rows):
+    _write_csv(path, ["code", "qty"], [(f"c{index}", index if index % 7 else "bad") for index in range(rows)])
+
+
+async def _run_import(path, spool_dir, chunk_rows, workers, on_batch=None):
+    spool = imports.start_split(str(path), path.name, str(spool_dir), chunk_rows, workers, POOL_FIELDS)
+    columns = await spool.columns()
+    batches = []
+    async for batch in imports.prepared_batches(spool, chunk_rows, POOL_FIELDS, True, 1, "01/01/2024", workers):
+        batches.append((batch, spool.future.done()))
+        if on_batch is not None:
+            on_batch(len(batches))
+    return columns, batches
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+def test_chunks_prepared_while_splitting(tmp_path, pool):
+    # The upload is fed through a pipe that stalls after the first part until a
+    # prepared batch has come back, which only happens if chunks reach validation
+    # before the split is over
+    path = tmp_path / "rows.csv"
+    os.mkfifo(path)
+    first_batch = threading.Event()
+
+    def feed():
+        with open(path, "w") as out:
+            out.write("code,qty\n" + "".join(f"c{index},{index if index % 7 else 'bad'}\n" for index in range(30000)))
+            out.flush()
+            first_batch.wait(60)
+            out.write("".join(f"c{index},{index if index % 7 else 'bad'}\n" for index in range(30000, 40000)))
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    try:
+        columns, batches = asyncio.run(_run_import(path, spool_dir, 1000, 3, lambda count: first_batch.set()))
+    finally:
+        first_batch.set()
+        feeder.join()
+
+    assert columns == ["code", "qty"]
+    assert not batches[0][1]
+    # In file order, every row once
+    positions = []
+    for batch, _ in batches:
+        positions += sorted(batch["positions"] + [position for position, _, _ in batch["invalid"]])
+    assert positions == list(range(40000))
+    assert all(position % 7 == 0 for batch, _ in batches for position, _, _ in batch["invalid"])
+
+
+def test_broken_pool_is_replaced(tmp_path, pool):
+    _write_rows(tmp_path / "rows.csv", 8000)
+
+    def kill_workers(count):
+        if count == 1:
+            for pid in list(imports._executor._processes):
+                os.kill(pid, signal.SIGKILL)
+
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(_run_import(tmp_path / "rows.csv", spool_dir, 500, 2, kill_workers))
+    assert imports._executor is None
+
+    spool_dir = tmp_path / "spool2"
+    spool_dir.mkdir()
+    _, batches = asyncio.run(_run_import(tmp_path / "rows.csv", spool_dir, 500, 2))
+    assert sum(len(batch["positions"]) + len(batch["invalid"]) for batch, _ in batches) == 8000
@@ -0,0 +1,105 @@
+
+#--------------Validator agreement--------------#
+
+# document_errors must accept and reject exactly what the compiled $jsonSchema does.
+# Every field shape below is checked against the expected verdict in Python, and,
+# when MONGO_TEST_URI points at a mongod, against the server itself by inserting
+# each document into a collection carrying the compiled validator.
+#
+#   python -m pytest tests
+#   MONGO_TEST_URI=mongodb://localhost:27017/ python -m pytest tests
+import os
+import uuid
+import pytest
+from models import FieldModel
+from validators import compile_json_schema, document_errors
+
+# (shape, fields, documents the validator accepts, documents it rejects)
+SHAPES = [
+    ("str", [{"col_name": "value", "type": "str"}],
+     [{"value": "text"}, {"value": ""}],
+     [{"value": 5}, {"value": None}, {"value": ["text"]}]),
+    ("int", [{"col_name": "value", "type": "int"}],
+     [{"value": 5}, {"value": -3}, {"value": 2 ** 40}],
+     [{"value": 5.5}, {"value": "5"}, {"value": True}, {"value": None}]),
+    ("float", [{"col_name": "value", "type": "float"}],
+     [{"value": 5.5}, {"value": 5}, {"value": 2 ** 40}],
+     [{"value": "5.5"}, {"value": False}, {"value": None}]),
+    ("bool", [{"col_name": "value", "type": "bool"}],
+     [{"value": True}, {"value": False}],
+     [{"value": 1}, {"value": "true"}, {"value": None}]),
+    ("list", [{"col_name": "value", "type": "list"}],
+     [{"value": []}, {"value": [1, "a", None]}],
+     [{"value": "a"}, {"value": {"a": 1}}]),
+    ("dict", [{"col_name": "value", "type": "dict"}],
+     [{"value": {}}, {"value": {"any": [1]}}],
+     [{"value": []}, {"value": "a"}]),
+    ("untyped", [{"col_name": "value", "type": {"nested": "str"}}],
+     [{"value": "a"}, {"value": 1}, {"value": None}],
+     []),
+    ("allowed_values", [{"col_name": "value", "type": "str", "allowed_values": ["a", "b"]}],
+     [{"value": "a"}, {"value": "b"}],
+     [{"value": "c"}, {"value": "A"}, {"value": 1}]),
+    ("list_items", [{"col_name": "value", "type": "list", "allowed_values": ["a", "b"]}],
+     [{"value": []}, {"value": ["a"]}, {"value": ["b", "a", "a"]}],
+     [{"value": ["c"]}, {"value": ["a", "c"]}, {"value": "a"}]),
+    ("dict_keys", [{"col_name": "value", "type": "dict", "dict_keys": {"x": "str", "n": "int", "any": "date"}}],
+     [{"value": {}}, {"value": {"x": "1"}}, {"value": {"x": "1", "n": 2, "any": [1]}}],
+     [{"value": {"x": 1}}, {"value": {"n": "2"}}, {"value": {"y": "1"}}, {"value": {"x": "1", "extra": 1}}]),
+    ("required", [{"col_name": "name", "type": "str"}, {"col_name": "age", "type": "int"}],
+     [{"name": "a", "age": 1}, {"name": "a", "age": 1, "modified_date": "01/01/2024"}],
+     [{"name": "a"}, {"age": 1}, {}]),
+]
+
+
+def _cases():
+    cases = []
+    for shape, fields, accepted, rejected in SHAPES:
+        for index, document in enumerate(accepted):
+            cases.append(pytest.param(fields, document, True, id=f"{shape}-accepts-{index}"))
+        for index, document in enumerate(rejected):
+            cases.append(pytest.param(fields, document, False, id=f"{shape}-rejects-{index}"))
+    return cases
+
+
+CASES = _cases()
+
+
+def _validator(fields):
+    return compile_json_schema([FieldModel(unique=False, **field) for field in fields])
+
+
+@pytest.mark.parametrize("fields,document,accepted", CASES)
+def test_document_errors(fields, document, accepted):
+    errors = document_errors(_validator(fields), document)
+    assert (errors == []) == accepted, errors
+
+
+@pytest.fixture(scope="module")
+def mongo_db():
+    uri = os.environ.get("MONGO_TEST_URI")
+    if not uri:
+        pytest.skip("MONGO_TEST_URI is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    name = f"masterlist_test_{uuid.uuid4().hex[:8]}"
+    try:
+        yield client[name]
+    finally:
+        client.drop_database(name)
+        client.close()
+
+
+@pytest.mark.parametrize("fields,document,accepted", CASES)
+def test_server_agrees(mongo_db, fields, document, accepted):
+    from pymongo.errors import WriteError
+
+    lcollection = mongo_db.create_collection(f"c_{uuid.uuid4().hex[:8]}", validator=_validator(fields), validationAction="error")
+    try:
+        lcollection.insert_one(dict(document))
+        server_accepted = True
+    except WriteError as exc:
+        assert exc.code == 121
+        server_accepted = False
+    assert server_accepted == (document_errors(_validator(fields), document) == []) == accepted
@@ -0,0 +1,156 @@
+
+#--------------Resumable uploads--------------#
+
+# Large import files are sent as numbered chunks, each optionally with its SHA-256,
+# into an upload session kept on local disk. A dropped connection only costs the chunk in
+# flight: the client asks which chunks arrived and sends the rest. On commit the
+# chunks are joined file-to-file (never held in memory) and handed to the importer.
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+SESSION_FILE = "session.json"
+COPY_BUFFER = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _chunk_path(session_dir: str, index: int) -> str:
+    return os.path.join(session_dir, f"{index:06d}.part")
+
+
+def create_session(directory: str, schema_name: str, filename: str, size: Optional[int], chunk_size: int) -> Dict[str, Any]:
+    session = {
+        "upload_id": uuid.uuid4().hex,
+        "schema_name": schema_name,
+        "filename": os.path.basename(filename),
+        "size": size,
+        "chunk_size": chunk_size,
+        "created_at": time.time(),
+    }
+    session_dir = os.path.join(directory, session["upload_id"])
+    os.makedirs(session_dir)
+    with open(os.path.join(session_dir, SESSION_FILE), "w") as file:
+        json.dump(session, file)
+    return session
+
+
+# Returns (session, session directory); raises 404 for unknown, expired or other-schema sessions
+def load_session(directory: str, upload_id: str, schema_name: str, ttl: int) -> Tuple[Dict[str, Any], str]:
+    if not UPLOAD_ID.match(upload_id):
+        raise UploadError(404, "Upload not found")
+    session_dir = os.path.join(directory, upload_id)
+    try:
+        with open(os.path.join(session_dir, SESSION_FILE)) as file:
+            session = json.load(file)
+    except (OSError, ValueError):
+        raise UploadError(404, "Upload not found")
+    if session["schema_name"] != schema_name:
+        raise UploadError(404, "Upload not found")
+    if time.time() - session["created_at"] > ttl:
+        remove_session(session_dir)
+        raise UploadError(404, "Upload expired")
+    return session, session_dir
+
+
+# Chunk index -> size of every chunk stored so far
+def received_chunks(session_dir: str) -> Dict[int, int]:
+    chunks = {}
+    for entry in os.scandir(session_dir):
+        if entry.name.endswith(".part"):
+            chunks[int(entry.name[:-5])] = entry.stat().st_size
+    return chunks
+
+
+# Stream a chunk body to disk while hashing it. The chunk only replaces an earlier
+# copy once it is complete and its checksum, when one was sent, matched, so a
+# retried chunk is never left half written.
+async def write_chunk(session: Dict[str, Any], session_dir: str, index: int, body: AsyncIterator[bytes], sha256: Optional[str] = None) -> int:
+    if index < 0:
+        raise UploadError(400, "Chunk index must not be negative")
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = _chunk_path(session_dir, index) + f".{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            async for piece in body:
+                size += len(piece)
+                if size > session["chunk_size"]:
+                    raise UploadError(413, f"Chunk is larger than the session chunk size ({session['chunk_size']} bytes)")
+                digest.update(piece)
+                file.write(piece)
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise UploadError(400, "Chunk checksum mismatch")
+        os.replace(temp_path, _chunk_path(session_dir, index))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return size
+
+
+# Join chunks 0..total_chunks-1 into one file next to them and return its path. The
+# chunks are kept until the session is removed, so a failed commit can be retried.
+# Runs blocking file I/O, call it from a worker thread.
+def assemble(session: Dict[str, Any], session_dir: str, total_chunks: int, sha256: Optional[str] = None) -> str:
+    chunks = received_chunks(session_dir)
+    missing = [index for index in range(total_chunks) if index not in chunks]
+    if missing:
+        raise UploadError(409, f"Missing chunks: {missing[:20]}")
+    extra = sorted(index for index in chunks if index >= total_chunks)
+    if extra:
+        raise UploadError(409, f"Chunks past the end of the file: {extra[:20]}")
+    size = sum(chunks.values())
+    if session.get("size") is not None and size != session["size"]:
+        raise UploadError(409, f"Received {size} bytes, expected {session['size']}")
+
+    path = os.path.join(session_dir, session["filename"])
+    digest = hashlib.sha256()
+    with open(path, "wb") as target:
+        for index in range(total_chunks):
+            with open(_chunk_path(session_dir, index), "rb") as source:
+                if sha256 is None:
+                    shutil.copyfileobj(source, target, COPY_BUFFER)
+                    continue
+                while True:
+                    block = source.read(COPY_BUFFER)
+                    if not block:
+                        break
+                    digest.update(block)
+                    target.write(block)
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        os.remove(path)
+        raise UploadError(400, "File checksum mismatch")
+    return path
+
+
+def remove_session(session_dir: str) -> None:
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+# Remove sessions older than `ttl` seconds
+def purge_sessions(directory: str, ttl: int) -> int:
+    removed = 0
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                remove_session(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,120 @@
+
+#--------------Database-level validation--------------#
+
+# Compiles a schema's field list into a MongoDB $jsonSchema collection validator.
+# The Python-side checks evaluate the very same compiled document, so what the
+# API rejects and what the server rejects come from one rule set.
+from typing import Any, Dict, List
+from pymongo.errors import CollectionInvalid, OperationFailure
+from models import FieldModel
+
+# FieldModel.type -> accepted BSON types. Whole numbers are accepted for float
+# fields because JSON/CSV input doesn't distinguish 5 from 5.0.
+BSON_TYPES = {
+    "str": ["string"],
+    "int": ["int", "long"],
+    "float": ["double", "int", "long"],
+    "bool": ["bool"],
+    "list": ["array"],
+    "dict": ["object"],
+}
+
+# BSON type -> Python types produced by the driver (bool is checked separately
+# because it is a subclass of int)
+PYTHON_TYPES = {
+    "string": (str,),
+    "int": (int,),
+    "long": (int,),
+    "double": (float,),
+    "bool": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def _property_schema(field: FieldModel) -> Dict[str, Any]:
+    prop: Dict[str, Any] = {}
+    if isinstance(field.type, str) and field.type in BSON_TYPES:
+        prop["bsonType"] = BSON_TYPES[field.type]
+    if field.allowed_values:
+        if field.type == "list":
+            prop["items"] = {"enum": list(field.allowed_values)}
+        else:
+            prop["enum"] = list(field.allowed_values)
+    if field.type == "dict" and field.dict_keys:
+        prop["properties"] = {
+            key: {"bsonType": BSON_TYPES[key_type]} if key_type in BSON_TYPES else {}
+            for key, key_type in field.dict_keys.items()
+        }
+        prop["additionalProperties"] = False
+    return prop
+
+
+def compile_json_schema(fields: List[FieldModel]) -> Dict[str, Any]:
+    # Only schema fields are described; bookkeeping fields such as modified_date are left open
+    return {
+        "$jsonSchema": {
+            "bsonType": "object",
+            "required": [field.col_name for field in fields],
+            "properties": {field.col_name: _property_schema(field) for field in fields},
+        }
+    }
+
+
+#--------------Python evaluation of the compiled rules--------------#
+
+def _matches_bson_type(value: Any, bson_types: List[str]) -> bool:
+    if isinstance(value, bool):
+        return "bool" in bson_types
+    return any(isinstance(value, PYTHON_TYPES[bson_type]) for bson_type in bson_types if bson_type != "bool")
+
+
+def _property_errors(name: str, prop: Dict[str, Any], value: Any) -> List[str]:
+    if "bsonType" in prop and not _matches_bson_type(value, prop["bsonType"]):
+        return [f"Invalid type for {name}"]
+    if "enum" in prop and value not in prop["enum"]:
+        return [f"Invalid value for {name}"]
+    errors = []
+    if "items" in prop and isinstance(value, list):
+        allowed = prop["items"]["enum"]
+        if any(item not in allowed for item in value):
+            errors.append(f"Invalid value for {name}")
+    if "properties" in prop and isinstance(value, dict):
+        known = prop["properties"]
+        if prop.get("additionalProperties") is False:
+            for key in value.keys() - known.keys():
+                errors.append(f"Invalid key for {name}: {key}")
+        for key, key_schema in known.items():
+            if key in value and "bsonType" in key_schema and not _matches_bson_type(value[key], key_schema["bsonType"]):
+                errors.append(f"Invalid type for {name}.{key}")
+    return errors
+
+
+# Returns the list of rule violations for a document, empty when the server would accept it
+def document_errors(validator: Dict[str, Any], document: Dict[str, Any]) -> List[str]:
+    json_schema = validator["$jsonSchema"]
+    errors = [f"Missing column: {name}" for name in json_schema["required"] if name not in document]
+    for name, prop in json_schema["properties"].items():
+        if name in document:
+            errors.extend(_property_errors(name, prop, document[name]))
+    return errors
+
+
+#--------------Applying the validator--------------#
+
+async def apply_validator(db, schema_name: str, fields: List[FieldModel], action: str = "error") -> None:
+    if action == "off":
+        return
+    validator = compile_json_schema(fields)
+    # "moderate" leaves already-invalid documents writable until they are fixed or migrated
+    try:
+        await db.command("collMod", schema_name, validator=validator, validationLevel="moderate", validationAction=action)
+    except OperationFailure as exc:
+        # 26: NamespaceNotFound, the collection hasn't been created yet
+        if exc.code != 26:
+            raise
+        try:
+            await db.create_collection(schema_name, validator=validator, validationLevel="moderate", validationAction=action)
+        except CollectionInvalid:
+            # Created concurrently in the meantime
+            await db.command("collMod", schema_name, validator=validator, validationLevel="moderate", validationAction=action)
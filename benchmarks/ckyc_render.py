@@ -0,0 +1,115 @@
+
+#--------------Benchmark: CKYC image extraction--------------#
+
+# Latency and peak memory per document for /ckyc/image's process_pdf_base64,
+# comparing the previous whole-page render (kept below as legacy_process) with the
+# region-only render in main.py. Each variant runs in its own process so the peak
+# RSS reported is that variant's alone.
+#
+#   python benchmarks/ckyc_render.py
+#   python benchmarks/ckyc_render.py --pdf sample.pdf --repeat 50 --output ckyc.json
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VARIANTS = ("full_page", "region")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# The previous implementation: the whole first page rendered at scale 4, then cropped
+def legacy_process(base64_string):
+    from pypdfium2 import PdfDocument
+
+    pdf = PdfDocument(base64.b64decode(base64_string))
+    image = pdf[0].render(scale=4).to_pil()
+    result = {}
+    for name, box in (("ckycImage", (40, 471, 2332, 2248)), ("photo", (1549, 1029, 2275, 1836))):
+        buffer = io.BytesIO()
+        image.crop(box).save(buffer, format="JPEG")
+        result[name] = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return result, 200
+
+
+# Runs in the child process
+def measure(variant: str, path: str, repeat: int) -> Dict[str, Any]:
+    # Both variants load the app module, so their baselines match
+    import main
+
+    process_pdf_base64 = main.process_pdf_base64 if variant == "region" else legacy_process
+    with open(path, "rb") as pdf_file:
+        document = base64.b64encode(pdf_file.read()).decode()
+
+    baseline = _peak_rss_mb()
+    # One untimed call so PDFium initialisation isn't counted
+    _, status = process_pdf_base64(document)
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process_pdf_base64(document)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "status": status,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+        "peak_above_baseline_mb": round(_peak_rss_mb() - baseline, 1),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"config": {"repeat": args.repeat}, "results": {}}
+    for path in args.pdf:
+        result: Dict[str, Any] = {}
+        for variant in args.variants:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--measure", variant, path, "--repeat", str(args.repeat)],
+                capture_output=True, text=True, check=True, cwd=ROOT,
+            )
+            result[variant] = json.loads(child.stdout)
+        if "full_page" in result and "region" in result:
+            result["speedup"] = round(result["full_page"]["p50_ms"] / result["region"]["p50_ms"], 2) if result["region"]["p50_ms"] else None
+            result["peak_above_baseline_ratio"] = round(result["region"]["peak_above_baseline_mb"] / result["full_page"]["peak_above_baseline_mb"], 2)
+        report["results"][os.path.basename(path)] = result
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CKYC image extraction latency and peak memory")
+    parser.add_argument("--pdf", nargs="+", default=sorted(glob.glob(os.path.join(ROOT, "compressed_pdf", "*.pdf"))))
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per document")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    parser.add_argument("--measure", nargs=2, metavar=("VARIANT", "PATH"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.repeat)))
+        sys.exit(0)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text)
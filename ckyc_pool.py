@@ -0,0 +1,151 @@
+
+#--------------CKYC render pool--------------#
+
+# PDF rendering and JPEG encoding are CPU bound, so /ckyc/image runs them in a pool
+# of worker processes started (and warmed up) with the app instead of on the event
+# loop's small threadpool. Submissions are bounded: at most `workers` renders run
+# and `max_queue` more wait, anything past that is turned away right away (429)
+# rather than queueing up latency for everyone.
+import asyncio
+import importlib
+import math
+import multiprocessing
+import os
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Render queue is full")
+        self.retry_after = retry_after
+
+
+class Histogram:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.total}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+# Runs in the worker: import the modules rendering needs once, not on the first request
+def _warm(modules):
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _ready():
+    return os.getpid()
+
+
+# Runs in the worker: call `function` and report when it started and finished, so the
+# parent can split the latency into queue wait and service time
+def _timed(function, args):
+    started = time.time()
+    result = function(*args)
+    return result, started, time.time()
+
+
+class RenderPool:
+    def __init__(self, workers, max_queue, warm_modules=()):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.warm_modules = tuple(warm_modules)
+        self.in_flight = 0
+        self.rejected = 0
+        self.wait_time = Histogram("ckyc_render_wait_seconds", "Time a render waited for a free worker")
+        self.service_time = Histogram("ckyc_render_service_seconds", "Time a worker spent rendering")
+        self._executor = None
+
+    @property
+    def queue_depth(self):
+        return max(0, self.in_flight - self.workers)
+
+    def _create_executor(self):
+        # Spawned, not forked, so workers don't inherit the server's threads and sockets
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm,
+            initargs=(self.warm_modules,),
+        )
+
+    # Start every worker and wait until each has imported its modules
+    async def start(self):
+        self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ready) for _ in range(self.workers)))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # Seconds until a slot is likely free: the queue ahead, drained by every worker
+    # at the average service time
+    def retry_after(self):
+        average = self.service_time.total / self.service_time.count if self.service_time.count else 1.0
+        return max(1, math.ceil(average * (self.queue_depth + 1) / self.workers))
+
+    # Run function(*args) in a worker. Raises QueueFull when every worker is busy and
+    # the queue is full.
+    async def submit(self, function, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+        if self._executor is None:
+            self._executor = self._create_executor()
+        executor = self._executor
+        self.in_flight += 1
+        submitted = time.time()
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(executor, _timed, function, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. PDFium crashed on a bad file); the next request starts a fresh pool
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self.in_flight -= 1
+        self.wait_time.observe(max(0.0, started - submitted))
+        self.service_time.observe(finished - started)
+        return result
+
+    # Prometheus text exposition of the pool's metrics
+    def render_metrics(self):
+        lines = [
+            "# HELP ckyc_render_queue_depth Renders waiting for a free worker",
+            "# TYPE ckyc_render_queue_depth gauge",
+            f"ckyc_render_queue_depth {self.queue_depth}",
+            "# HELP ckyc_render_in_flight Renders waiting or running",
+            "# TYPE ckyc_render_in_flight gauge",
+            f"ckyc_render_in_flight {self.in_flight}",
+            "# HELP ckyc_render_rejected_total Renders turned away because the queue was full",
+            "# TYPE ckyc_render_rejected_total counter",
+            f"ckyc_render_rejected_total {self.rejected}",
+        ]
+        lines += self.wait_time.render()
+        lines += self.service_time.render()
+        return "\n".join(lines) + "\n"
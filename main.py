@@ -2,67 +2,121 @@ from fastapi import FastAPI
 import numpy as np
 from pypdfium2 import PdfDocument
 from PIL import Image
-import base64, io
-from fastapi.responses import JSONResponse
+import base64, io, math, os
+from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, PlainTextResponse
 from schema import CKYCSchema
+from ckyc_pool import QueueFull, RenderPool
  
  
-app = FastAPI()
+# Worker processes rendering CKYC PDFs, and how many renders may wait for a free one
+# before requests are turned away with 429
+CKYC_WORKERS = int(os.environ.get("CKYC_WORKERS", os.cpu_count() or 1))
+CKYC_QUEUE_SIZE = int(os.environ.get("CKYC_QUEUE_SIZE", 2 * CKYC_WORKERS))
+# Workers import this module up front, it holds the render code they run
+render_pool = RenderPool(CKYC_WORKERS, CKYC_QUEUE_SIZE, warm_modules=(__name__,))
+
+
+# Start the render workers with the app and stop them on shutdown
+@asynccontextmanager
+async def lifespan(app):
+    await render_pool.start()
+    yield
+    render_pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
  
  
+# Page 1 is rasterized at this scale; the crop boxes are in pixels at this scale
+RENDER_SCALE = 4
+DETAILS_BOX = (40, 471, 2332, 2248)  # CKYC details
+PHOTO_BOX = (1549, 1029, 2275, 1836)  # Photo
+# Only the area covering both boxes is rendered, the rest of the page never is
+RENDER_BOX = (
+    min(DETAILS_BOX[0], PHOTO_BOX[0]), min(DETAILS_BOX[1], PHOTO_BOX[1]),
+    max(DETAILS_BOX[2], PHOTO_BOX[2]), max(DETAILS_BOX[3], PHOTO_BOX[3]),
+)
+
+
+def render_region(page, box, scale):
+    # Render just `box` (pixels at `scale`, clipped to the page) of the page.
+    # Returns the image and the page pixel position of its top left corner.
+    page_width = math.ceil(page.get_width() * scale)
+    page_height = math.ceil(page.get_height() * scale)
+    left, top = max(box[0], 0), max(box[1], 0)
+    right, bottom = min(box[2], page_width), min(box[3], page_height)
+
+    # pypdfium2 takes the crop in page units and rounds it up to whole pixels,
+    # half a pixel less lands exactly on the wanted pixel edge
+    def units(pixels):
+        return (pixels - 0.5) / scale if pixels > 0 else 0
+
+    crop = (units(left), units(page_height - bottom), units(page_width - right), units(top))
+    # RGBX is shared with PIL as is, no conversion copy of the bitmap is made
+    bitmap = page.render(scale=scale, crop=crop, prefer_bgrx=True, rev_byteorder=True)
+    return bitmap.to_pil(), (left, top)
+
+
+def encode_crop(image, origin, box):
+    # Crop `box` (page pixels) out of a region rendered at `origin` as base64 JPEG.
+    # JPEG takes RGBX as is; a box covering the whole region is encoded without a crop copy.
+    left, top = origin
+    box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+    if box != (0, 0) + image.size:
+        image = image.crop(box)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
 def process_pdf_base64(base64_string):
+    pdf = None
     try:
         # Decode the base64 string to binary content
         pdf_content = base64.b64decode(base64_string)
-    
+
         # Load the PDF document using pypdfium
         pdf = PdfDocument(pdf_content)
-    
-        details_base64 = None
-        photo_base64 = None
-    
-        # Loop over pages and render
-        for i in range(len(pdf)):
-            page = pdf[i]
-            image = page.render(scale=4).to_pil()
-    
-            # Example cropping, adjust as per your requirements
-            if i == 0:
-                img_details = image.crop((40, 471, 2332, 2248))  # Cropping image details
-                # img_details.save("img_details.jpg")
-                details_buffer = io.BytesIO()
-                img_details.save(details_buffer, format="JPEG")
-                details_base64 = base64.b64encode(details_buffer.getvalue()).decode('utf-8')
-    
-                img_photo = image.crop((1549, 1029, 2275, 1836))  # Cropping photo
-                # img_photo.save("img_photo.jpg")
-                photo_buffer = io.BytesIO()
-                img_photo.save(photo_buffer, format="JPEG")
-                photo_base64 = base64.b64encode(photo_buffer.getvalue()).decode('utf-8')
-    
-                return {
-                    "ckycImage": details_base64,
-                    "photo": photo_base64
-                }, 200
-                    
+
+        # Both crops come out of one render of the first page
+        image, origin = render_region(pdf[0], RENDER_BOX, RENDER_SCALE)
+        return {
+            "ckycImage": encode_crop(image, origin, DETAILS_BOX),
+            "photo": encode_crop(image, origin, PHOTO_BOX)
+        }, 200
+
     except Exception as Err:
         return {
             'error': str(Err)
-        }, 400   
-        
-           
+        }, 400
+    finally:
+        # Free the PDFium document and bitmap now rather than whenever the GC gets to them
+        if pdf is not None:
+            pdf.close()
+
+
 @app.post("/ckyc/image")
-def extract_pdf_details(request: CKYCSchema):
+async def extract_pdf_details(request: CKYCSchema):
     statusCode = 400
     response = {'message': 'Failed', 'result': {}}
     try:
  
-        # Extract details from the PDF
-        result, statusCode = process_pdf_base64(request.dataBase)
+        # Extract details from the PDF in a render worker
+        result, statusCode = await render_pool.submit(process_pdf_base64, request.dataBase)
         response['result'] = result
         if statusCode == 200:
             response['message'] = 'Success'
+    except QueueFull as Err:
+        return JSONResponse(status_code=429, content={'error': str(Err)}, headers={"Retry-After": str(Err.retry_after)})
     except Exception as Err:
-        response['result']['error'] = str(Err)
+        statusCode = 500
+        result = {'error': str(Err)}
     return JSONResponse(status_code=statusCode, content=result)
+
+
+# Render pool queue depth, wait and service times in Prometheus text format
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_pool.render_metrics(), media_type="text/plain; version=0.0.4")
  